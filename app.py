@@ -1,38 +1,75 @@
+import io
 import os
+import csv
 import sys
 sys.dont_write_bytecode = True
-import re
-import csv
 import json
 import datetime
-import subprocess
 
-from flask import Flask, render_template, jsonify, redirect, url_for, request
-from sqlalchemy import and_, case
-from sqlalchemy.sql import func
+from flask import (
+    Flask, Response, render_template, jsonify, redirect, url_for, request,
+    stream_with_context, g
+)
+from sqlalchemy import and_
 
-from db import Session, LogLoaderdb, SMTPMail, LogReport
-from mail import send_mail, email_tpl
+from db import Session, LogLoaderdb
+from mail import email_tpl
+from mail_queue import mail_queue, smtp_settings
 from config import Config
+from db_pool import configure_pool, pool_metrics
+from schema import create_tables
+from instrumentation import init_app as init_instrumentation, span
+from report_jobs import report_queue
+from report_cache import data_version
+from reporting import build_report, log_list_query, iter_log_list, row2dict
+from rollups import rebuild_rollups
+from excursions import rebuild_excursions
+from day_cache import bump_range
+from sample_pages import (
+    SamplePageError, fetch_sample_page, decode_cursor, parse_channels,
+    parse_page_size, parse_every
+)
+from importer import import_file, import_files, find_csv_files, CSVParseError
 
-DAYS_OF_WEEK = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+app = Flask(__name__)
 
-date_re = [
-    r'^(3[01]|[12][0-9]|0[1-9])/(1[0-2]|0[1-9])/[0-9]{4}$',
-    r'^(1[0-2]|0[1-9])-(3[01]|[12][0-9]|0[1-9])-[0-9]{4}$',
-]
+engine = configure_pool()
 
-EXCURSION_TEMP = '-10'
-INCURSION_TEMP = '-20'
+## tables for the ledger, rollups, excursions and day stamps exist before
+## the first request; creating them lazily inside requests races
+if engine is not None and getattr(Config, 'create_tables_on_start', True):
+    create_tables(engine)
 
-def row2dict(row):
-    d = {}
-    for column in row.__table__.columns:
-        d[column.name] = str(getattr(row, column.name))
+## per-route latency histograms at /metrics, spans in the Server-Timing
+## header, "X-Profile: <token>" writes a folded stack profile of the request
+init_instrumentation(
+    app,
+    profile_token=getattr(Config, 'profile_token', None),
+    profile_interval=getattr(Config, 'profile_interval', None),
+    profile_dir=getattr(Config, 'profile_dir', None),
+)
 
-    return d
 
-app = Flask(__name__)
+def db_session():
+
+    ## One session per request, opened on first use and always closed by
+    ## remove_db_session; views never close it themselves
+    if 'db_session' not in g:
+        g.db_session = Session()
+
+    return g.db_session
+
+
+@app.teardown_appcontext
+def remove_db_session(exc):
+
+    session = g.pop('db_session', None)
+    if session is None:
+        return
+
+    if exc is not None:
+        session.rollback()
+    session.close()
 
 
 @app.route('/', methods=['GET'])
@@ -52,186 +89,284 @@ def home_report(date_from_str, date_to_str):
     date_from   = datetime.datetime.strptime(date_from_str, "%Y-%m-%d").date()
     footer_text = request.args.get('footerText', None)
 
-    session = Session()
+    output_format = request.args.get('format', None)
+    if output_format or request.args.get('stream'):
+        return home_report_stream(host, date_from, date_to, date_from_str, date_to_str, footer_text, output_format)
 
-    q = session.query(LogLoaderdb)
-    if date_from != date_to:
-        q = q.filter(
-            and_(
-                LogLoaderdb.logdate >= date_from,
-                LogLoaderdb.logdate <= date_to,
-            )
-        )
-    else:
-        q = q.filter(LogLoaderdb.logdate==date_to)
+    session = db_session()
 
-    q = q.order_by(
-        LogLoaderdb.logdate.asc(),
-        LogLoaderdb.logtimein.asc()
-    )
+    q = log_list_query(session, date_from, date_to)
 
-    log_list = [row2dict(r) for r in q.all()]
+    with span('home_report.fetch'):
+        rows = q.all()
+    with span('home_report.row2dict'):
+        log_list = [row2dict(r) for r in rows]
 
     if not log_list:
+        return redirect(url_for('home', error='No data for this date range'))
+
+    version = data_version(session, date_from, date_to)
+
+    # hand the connection back to the pool before waiting on the PDF
+    session.close()
+
+    ## PDF is rendered by the report job queue, identical requests share one job
+    ## and unchanged data is served from the report cache
+    job = report_queue.submit(host, date_from_str, date_to_str, footer_text, version)
+
+    if not request.args.get('async'):
+        report_queue.wait(job, getattr(Config, 'report_wait_timeout', None))
+
+    file_path = job.file_path
+
+    return render_template('index.html', log_list=log_list, file_path=file_path, job_id=job.id)
+
+
+def home_report_stream(host, date_from, date_to, date_from_str, date_to_str, footer_text, output_format):
+
+    ## Log list is streamed off a server side cursor, memory stays at one chunk
+    ## of rows whatever the range; ?format=csv|json for raw rows, otherwise
+    ## index.html is rendered as a stream
+    if output_format not in [None, 'html', 'csv', 'json']:
+        return jsonify({
+            'status': 'error', 
+            'message': 'Unknown format!'
+        }), 400
+
+    chunk_size = getattr(Config, 'log_stream_chunk_size', None) or 1000
+
+    # outlives the view, so it is not the request session: stream_log_rows
+    # closes it once the body is sent
+    session = Session()
+
+    # before the cursor is opened, some drivers allow no other query on the
+    # connection while a streamed result is pending
+    version = data_version(session, date_from, date_to)
+
+    chunks = iter_log_list(session, date_from, date_to, chunk_size)
+    first = next(chunks, None)
+
+    if first is None:
         session.close()
         return redirect(url_for('home', error='No data for this date range'))
 
-    file_name = f'report_{datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S")}.pdf'
-    file_path = f'static/reports/{file_name}'
+    rows = stream_log_rows(session, first, chunks)
 
-    if footer_text:
-        url_path  = f'http://{host}/report/{date_from_str}/{date_to_str}?footerText={footer_text}'
-    else:
-        url_path  = f'http://{host}/report/{date_from_str}/{date_to_str}'
+    if output_format == 'csv':
+        return Response(
+            stream_with_context(csv_chunks(rows, chunk_size)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=log_{date_from_str}_{date_to_str}.csv'}
+        )
 
-    p = subprocess.run(
-        ['xvfb-run', '-s', '-screen 0 1024x768x24', '/usr/bin/wkhtmltopdf', '--no-stop-slow-scripts', '--javascript-delay', '5000', url_path, file_path], 
-        # ['xvfb-run', '--', '/usr/bin/wkhtmltopdf', '--no-stop-slow-scripts', '--javascript-delay', '3000', url_path, file_path], 
-        # ['/usr/bin/wkhtmltopdf', '--no-stop-slow-scripts', '--javascript-delay', '200', url_path, file_path], 
-        stdout=subprocess.PIPE,
-    )
+    if output_format == 'json':
+        return Response(stream_with_context(json_chunks(rows, chunk_size)), mimetype='application/json')
 
-    log_report = LogReport.create_log_report(
-        session,
-        filename=file_name,
-        filepath=file_path
-    )
+    # the page cannot wait for the PDF without holding back the first byte,
+    # the job is polled through /report/jobs/<job_id> instead
+    job = report_queue.submit(host, date_from_str, date_to_str, footer_text, version)
+
+    return Response(stream_with_context(stream_template(
+        'index.html', log_list=rows, file_path=job.file_path, job_id=job.id
+    )))
+
+
+def stream_log_rows(session, first, chunks):
 
+    # runs while the response is sent, the session is closed when the client
+    # has read everything or has gone away
     try:
-        session.commit()
-    except:
-        session.rollback()
-        raise
+        yield from first
+        for chunk in chunks:
+            yield from chunk
     finally:
+        chunks.close()
         session.close()
 
-    return render_template('index.html', log_list=log_list, file_path=file_path)
 
+def stream_template(template_name, **context):
 
-@app.route('/csv/import', methods=['GET', 'POST'])
-def csv_import():
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(5)
 
-    mount_path = Config.mount_point
-    csv_file_path = None
+    return stream
 
-    for file in os.listdir(mount_path):
-        if file.endswith('.csv') or file.endswith('.CSV'):
-            csv_file_path = os.path.join(mount_path, file)
-            break
 
-    if not csv_file_path:
-        print('-- No CSV file found --')
+def csv_chunks(rows, chunk_size):
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    header = False
+    pending = 0
+    for row in rows:
+        if not header:
+            writer.writerow(row.keys())
+            header = True
+        writer.writerow(row.values())
+        pending += 1
+
+        if pending >= chunk_size:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+
+    yield buf.getvalue()
+
+
+def json_chunks(rows, chunk_size):
+
+    parts = ['[']
+    sep = ''
+    for row in rows:
+        parts.append(sep + json.dumps(row))
+        sep = ','
+
+        if len(parts) >= chunk_size:
+            yield ''.join(parts)
+            parts = []
+
+    parts.append(']')
+    yield ''.join(parts)
+
+
+@app.route('/report/jobs', methods=['POST'])
+def report_job_submit():
+
+    data = json.loads(request.data) if request.data else request.form
+
+    date_from_str = data.get('dateFrom', None)
+    date_to_str   = data.get('dateTo', None)
+    footer_text   = data.get('footerText', None)
+
+    if None in [date_from_str, date_to_str]:
         return jsonify({
             'status': 'error', 
-            'message': 'No CSV file found!'
+            'message': 'Missing required data!'
         })
 
-    data_to_import = []
+    date_from = datetime.datetime.strptime(date_from_str, "%Y-%m-%d").date()
+    date_to   = datetime.datetime.strptime(date_to_str, "%Y-%m-%d").date()
 
-    print(f'-- CSV file found ({csv_file_path}) --')
+    session = db_session()
+
+    q = session.query(LogLoaderdb.id).filter(
+        and_(
+            LogLoaderdb.logdate >= date_from,
+            LogLoaderdb.logdate <= date_to,
+        )
+    )
+    has_data = q.first() is not None
+    version = data_version(session, date_from, date_to) if has_data else ''
+
+    if not has_data:
+        return jsonify({
+            'status': 'error', 
+            'message': 'No data for this date range'
+        })
 
-    ## Read CSV file
-    with open(csv_file_path, mode='r') as csv_file:
-        csv_reader = csv.reader(x.replace('\0', '') for x in csv_file)
+    job = report_queue.submit(request.headers.get("Host"), date_from_str, date_to_str, footer_text, version)
 
-        print('-- Start reading rows from csv file --')
-        location_id = None
-        for row in csv_reader:
+    return jsonify({'status': 'success', 'job': job.to_dict()})
 
-            # print(f'row: {row}')
 
-            if not row:
-                if location_id:
-                    location_id = None
-                continue
+@app.route('/report/jobs/<job_id>', methods=['GET'])
+def report_job_status(job_id):
 
-            if location_id:
+    job = report_queue.get(job_id)
 
-                # for date format dd/mm/yyyy
-                date_match = re.match(date_re[0], row[0], re.M|re.I)
-                if date_match:
+    if job is None:
+        return jsonify({
+            'status': 'error', 
+            'message': 'Unknown report job!'
+        }), 404
 
-                    # append zero values
-                    while len(row) < 19:
-                        row.append(0.00)
+    return jsonify({'status': 'success', 'job': job.to_dict()})
 
-                    data_to_import.append([location_id] + row)
-                    continue
 
-                # for date format mm-dd-yyyy
-                date_match = re.match(date_re[1], row[0], re.M|re.I)
-                if date_match:
+@app.route('/api/samples', methods=['GET'])
+def api_samples():
 
-                    # append zero values
-                    while len(row) < 19:
-                        row.append(0.00)
+    ## ?from=&to=&location=73,74&channels=1,2&limit=&every=&after=<next>
+    args = request.args
 
-                    m, d, y = row[0].split('-')
-                    row[0] = f'{d}/{m}/{y}'
-                    data_to_import.append([location_id] + row)
-                    continue
+    try:
+        date_from = datetime.datetime.strptime(args['from'], "%Y-%m-%d").date() if args.get('from') else None
+        date_to   = datetime.datetime.strptime(args['to'], "%Y-%m-%d").date() if args.get('to') else None
+    except ValueError:
+        return jsonify({
+            'status': 'error', 
+            'message': 'Invalid date!'
+        }), 400
 
-            else:
-                if row[0].startswith("Location ID:"):
-                    try:
-                        location_id = re.search('Location ID: (.+?)$', row[0]).group(1)
-                    except AttributeError:
-                        location_id = None
+    location_ids = [l.strip() for l in args.get('location', '').split(',') if l.strip()]
 
-        print('-- End reading rows from csv file --')
+    try:
+        channels = parse_channels(args.get('channels'))
+        limit    = parse_page_size(args.get('limit'))
+        every    = parse_every(args.get('every'))
+        cursor   = decode_cursor(args['after']) if args.get('after') else None
+    except SamplePageError as e:
+        return jsonify({
+            'status': 'error', 
+            'message': str(e)
+        }), 400
 
-    session = Session()
+    samples, next_cursor = fetch_sample_page(
+        db_session(), date_from, date_to, location_ids, channels, cursor, limit, every
+    )
 
-    ## Write data from CSV file to DataBase
-    for row in data_to_import:
+    return jsonify({
+        'status': 'success',
+        'samples': samples,
+        'next': next_cursor,
+    })
 
-        try:
-            dt = datetime.datetime.strptime(row[1] + ' ' + row[2], "%d/%m/%Y %H:%M:%S")
-        except Exception as e:
-            session.rollback()
-            session.close()
-            print(e)
-            return jsonify({
-                'status': 'error', 
-                'message': 'Error while parsing date from csv!'
-            })
 
-        try:
-            log_loader = LogLoaderdb.create_logloaderdb(
-                session,
-                location_id=row[0],
-                logdate=dt.date(),
-                logtimein=dt.time(),
-                chann1=row[3],
-                chann2=row[4],
-                chann3=row[5],
-                chann4=row[6],
-                chann5=row[7],
-                chann6=row[8],
-                chann7=row[9],
-                chann8=row[10],
-                chann9=row[11],
-                chann10=row[12],
-                chann11=row[13],
-                chann12=row[14],
-                chann13=row[15],
-                chann14=row[16],
-                chann15=row[17],
-                chann16=row[18],
-            )
-        except Exception as e:
-            session.rollback()
-            session.close()
-            print(e)
-            return jsonify({
-                'status': 'error', 
-                'message': 'Something has gone wrong!'
-            })
+@app.route('/csv/import', methods=['GET', 'POST'])
+def csv_import():
+
+    mount_path = Config.mount_point
+    csv_file_path = None
+
+    if request.args.get('all'):
+        return csv_import_all(mount_path)
+
+    for file in os.listdir(mount_path):
+        if file.endswith('.csv') or file.endswith('.CSV'):
+            csv_file_path = os.path.join(mount_path, file)
+            break
+
+    if not csv_file_path:
+        print('-- No CSV file found --')
+        return jsonify({
+            'status': 'error', 
+            'message': 'No CSV file found!'
+        })
 
-        # print(row2dict(log_loader))
+    print(f'-- CSV file found ({csv_file_path}) --')
 
-    # session.rollback()
-    # session.close()
+    session = db_session()
+
+    ## Stream new rows from CSV file to DataBase in batches
+    try:
+        stats = import_file(session, csv_file_path)
+    except CSVParseError as e:
+        session.rollback()
+        print(e)
+        return jsonify({
+            'status': 'error', 
+            'message': 'Error while parsing date from csv!'
+        })
+    except Exception as e:
+        session.rollback()
+        print(e)
+        return jsonify({
+            'status': 'error', 
+            'message': 'Something has gone wrong!'
+        })
 
     try:
         session.commit()
@@ -239,10 +374,36 @@ def csv_import():
         session.rollback()
         print(e)
         raise
-    finally:
-        session.close()
 
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', **stats})
+
+
+def csv_import_all(mount_path):
+
+    csv_file_paths = find_csv_files(mount_path)
+
+    if not csv_file_paths:
+        print('-- No CSV file found --')
+        return jsonify({
+            'status': 'error', 
+            'message': 'No CSV file found!'
+        })
+
+    print(f'-- {len(csv_file_paths)} CSV files found --')
+
+    started = datetime.datetime.utcnow()
+
+    files = import_files(db_session(), csv_file_paths)
+
+    seconds = (datetime.datetime.utcnow() - started).total_seconds()
+    failed = [f for f in files if f['status'] == 'error']
+
+    return jsonify({
+        'status': 'error' if failed else 'success',
+        'rows': sum(f.get('rows', 0) for f in files),
+        'seconds': round(seconds, 3),
+        'files': files,
+    })
 
 
 @app.route('/report/<date_from_str>/<date_to_str>', methods=['GET'])
@@ -254,288 +415,69 @@ def report(date_from_str, date_to_str):
 
     report_path = None
 
-    session = Session()
-
-    query = []
-    for i in range(1, 17):
-        query.append(
-            func.avg(getattr(LogLoaderdb, f'chann{i}'))
-        )
-        query.append(
-            func.min(getattr(LogLoaderdb, f'chann{i}'))
-        )
-        query.append(
-            func.max(getattr(LogLoaderdb, f'chann{i}'))
-        )
+    report_data = build_report(db_session(), date_from, date_to)
 
-    q = session.query(*query)
-    if date_from != date_to:
-        q = q.filter(
-            and_(
-                LogLoaderdb.location_id == '73',
-                LogLoaderdb.logdate >= date_from,
-                LogLoaderdb.logdate <= date_to,
-            )
-        )
-    else:
-        q = q.filter(LogLoaderdb.logdate==date_to)
-
-    r = q.first()
-
-    if None in r:
-        session.close()
+    if report_data is None:
         return redirect(url_for('home', error='No data for this date range'))
 
-    l15to25avg = [r[0], r[3], r[6], r[9], r[12], r[15], r[18]]
-    l15to25min = [r[1], r[4], r[7], r[10], r[13], r[16], r[19]]
-    l15to25max = [r[2], r[5], r[8], r[11], r[14], r[17], r[20]]
-    l2to8avg = [r[21], r[24], r[27], r[30], r[33], r[36], r[39]]
-    l2to8min = [r[22], r[25], r[28], r[31], r[34], r[37], r[40]]
-    l2to8max = [r[23], r[26], r[29], r[32], r[35], r[38], r[41]]
-
-
-    # query = []
-    # for i in range(1, 17):
-    #     query.append(
-    #         func.coalesce(
-    #             func.count(case([(getattr(LogLoaderdb, f'chann{i}')>EXCURSION_TEMP,  LogLoaderdb.id)], else_=None)), 
-    #             0.00)
-    #     )
-    #     query.append(
-    #         func.coalesce(
-    #             func.count(case([(getattr(LogLoaderdb, f'chann{i}')<INCURSION_TEMP,  LogLoaderdb.id)], else_=None)), 
-    #             0.00),
-    #     )
-
-    # q = session.query(*query)
-    # if date_from != date_to:
-    #     q = q.filter(
-    #         and_(
-    #             LogLoaderdb.location_id == '73',
-    #             LogLoaderdb.logdate >= date_from,
-    #             LogLoaderdb.logdate <= date_to,
-    #         )
-    #     )
-    # else:
-    #     q = q.filter(LogLoaderdb.logdate==date_to)
-
-    # print('EXCURSION_TEMP - INCURSION_TEMP')
-    # for res in q.all():
-    #     print(res)
-
-
-    header_dict = {
-        'chann1': {
-            'avg': r[0],
-            'min': r[1],
-            'max': r[2]
-        },
-        'chann2': {
-            'avg': r[3],
-            'min': r[4],
-            'max': r[5]
-        },
-        'chann3': {
-            'avg': r[6],
-            'min': r[7],
-            'max': r[8]
-        },
-        'chann4': {
-            'avg': r[9],
-            'min': r[10],
-            'max': r[11]
-        },
-        'chann5': {
-            'avg': r[12],
-            'min': r[13],
-            'max': r[14]
-        },
-        'chann6': {
-            'avg': r[15],
-            'min': r[16],
-            'max': r[17]
-        },
-        'chann7': {
-            'avg': r[18],
-            'min': r[19],
-            'max': r[20]
-        },
-        'chann8': {
-            'avg': r[21],
-            'min': r[22],
-            'max': r[23]
-        },
-        'chann9': {
-            'avg': r[24],
-            'min': r[25],
-            'max': r[26]
-        },
-        'chann10': {
-            'avg': r[27],
-            'min': r[28],
-            'max': r[29]
-        },
-        'chann11': {
-            'avg': r[30],
-            'min': r[31],
-            'max': r[32]
-        },
-        'chann12': {
-            'avg': r[33],
-            'min': r[34],
-            'max': r[35]
-        },
-        'chann13': {
-            'avg': r[36],
-            'min': r[37],
-            'max': r[38]
-        },
-        'chann14': {
-            'avg': r[39],
-            'min': r[40],
-            'max': r[41]
-        },
-        'chann15': {
-            'avg': r[42],
-            'min': r[43],
-            'max': r[44]
-        },
-        'chann16': {
-            'avg': r[45],
-            'min': r[46],
-            'max': r[47]
-        },
-        'l15to25': {
-            'avg': sum(l15to25avg) / len(l15to25avg),
-            'min': min(l15to25min),
-            'max': max(l15to25max)
-        },
-        'l2to8': {
-            'avg': sum(l2to8avg) / len(l2to8avg),
-            'min': min(l2to8min),
-            'max': max(l2to8max)
-        }
-    }
-
-
-
-    ## data for graphs
-    q = session.query(LogLoaderdb)
-    if date_from != date_to:
-        q = q.filter(
-            and_(
-                LogLoaderdb.location_id == '73',
-                LogLoaderdb.logdate >= date_from,
-                LogLoaderdb.logdate <= date_to,
-            )
-        )
-    else:
-        q = q.filter(LogLoaderdb.logdate==date_to)
-
-    q = q.order_by(
-        LogLoaderdb.logdate.asc(),
-        LogLoaderdb.logtimein.asc()
+    return render_template(
+        'report-format.html',
+        report_path=report_path,
+        footer_text=footer_text if footer_text else '',
+        **report_data
     )
 
-    log_list = [row2dict(r) for r in q.all()]
 
-    csv_g1 = ['Date, Temperature']
-    csv_g2 = ['Date, 1, 2, 3, 4, 5, 6, 7']
-    csv_g3 = ['Date, Temperature']
-    csv_g4 = ['Date, 8, 9, 10, 11, 12, 13, 14']
+@app.route('/rollups/rebuild/<date_from_str>/<date_to_str>', methods=['POST'])
+def rollups_rebuild(date_from_str, date_to_str):
 
-    for r in log_list:
-        d = r["logdate"] + " " + r["logtimein"]
-
-        l15to25 = []
-        g2 = ""
-        for i in range(1, 8):
-            l15to25.append(float(r[f'chann{i}']))
-            g2 += r[f'chann{i}'] + ","
-
-        l2to8 = []
-        g4 = ""
-        for i in range(8, 15):
-            l2to8.append(float(r[f'chann{i}']))
-            g4 += r[f'chann{i}'] + ","
-
-        avg1 = int(sum(l15to25) / len(l15to25))
-        csv_g1.append(f'{d}, {avg1}')
+    date_to     = datetime.datetime.strptime(date_to_str, "%Y-%m-%d").date()
+    date_from   = datetime.datetime.strptime(date_from_str, "%Y-%m-%d").date()
 
-        avg2 = int(sum(l2to8) / len(l2to8))
-        csv_g3.append(f'{d}, {avg2}')
+    session = db_session()
 
-        csv_g2.append(f'{d}, {g2[:-1]}')
-        csv_g4.append(f'{d}, {g4[:-1]}')
+    try:
+        rows = rebuild_rollups(session, date_from, date_to)
+        # rows may have been edited by hand, cached report days are stale
+        bump_range(session, date_from, date_to)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(e)
+        return jsonify({
+            'status': 'error', 
+            'message': 'Something has gone wrong!'
+        })
 
+    return jsonify({'status': 'success', 'rows': rows})
 
-    ## FREEZER LOG ##
-    csv_g5 = ['Date, Temperature']
-    csv_g6 = ['Date, Temperature']
-    csv_g7 = ['Date, Temperature']
 
-    q = session.query(
-        LogLoaderdb.location_id,
-        LogLoaderdb.logdate,
-        func.avg(LogLoaderdb.chann1)
-    )
-    if date_from != date_to:
-        q = q.filter(
-            and_(
-                LogLoaderdb.location_id.in_(['74', '75', '76']),
-                LogLoaderdb.logdate >= date_from,
-                LogLoaderdb.logdate <= date_to,
-            )
-        )
-    else:
-        q = q.filter(
-            and_(
-                LogLoaderdb.location_id.in_(['74', '75', '76']),
-                LogLoaderdb.logdate==date_to
-            )
-        )
+@app.route('/excursions/rebuild/<date_from_str>/<date_to_str>', methods=['POST'])
+def excursions_rebuild(date_from_str, date_to_str):
 
-    q = q.group_by(
-        LogLoaderdb.location_id,
-        LogLoaderdb.logdate,
-    )
-    q = q.order_by(
-        LogLoaderdb.logdate.asc(),
-    )
-    for r in q.all():
-        print(r)
-        print(DAYS_OF_WEEK[r[1].weekday()])
-        d = r[1].strftime("%Y-%m-%d")
-        # d = r[1].strftime("%Y-%m-%d") + " - " + DAYS_OF_WEEK[r[1].weekday()]
+    date_to     = datetime.datetime.strptime(date_to_str, "%Y-%m-%d").date()
+    date_from   = datetime.datetime.strptime(date_from_str, "%Y-%m-%d").date()
 
-        if r[0] == '74':
-            csv_g5.append(f'{d}, {r[2]}')
+    session = db_session()
 
-        elif r[0] == '75':
-            csv_g6.append(f'{d}, {r[2]}')
+    try:
+        rows = rebuild_excursions(session, date_from, date_to)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(e)
+        return jsonify({
+            'status': 'error', 
+            'message': 'Something has gone wrong!'
+        })
 
-        elif r[0] == '76':
-            csv_g7.append(f'{d}, {r[2]}')
+    return jsonify({'status': 'success', 'rows': rows})
 
 
-    session.close()
+@app.route('/metrics/db', methods=['GET'])
+def db_metrics():
 
-    return render_template(
-        'report-format.html',
-        title='DAILY' if date_from == date_to else 'WEEKLY',
-        date_from=date_from.strftime("%d.%m.%Y"),
-        date_to=date_to.strftime("%d.%m.%Y"), 
-        csv_g1=csv_g1,
-        csv_g2=csv_g2,
-        csv_g3=csv_g3,
-        csv_g4=csv_g4,
-        csv_g5=csv_g5,
-        csv_g6=csv_g6,
-        csv_g7=csv_g7,
-        header_dict=header_dict,
-        report_path=report_path,
-        footer_text=footer_text if footer_text else '',
-    )
+    return jsonify({'status': 'success', 'pool': pool_metrics()})
 
 
 @app.route('/send/mail', methods=['POST'])
@@ -558,45 +500,48 @@ def send_mail_report():
     date_to     = datetime.datetime.strptime(date_to_str, "%Y-%m-%d").date()
     report_type = 'DAILY' if date_from == date_to else 'WEEKLY'
 
-    session = Session()
-
     try:
-        email_params = session.query(SMTPMail).one()
+        email_params = smtp_settings(db_session())
     except Exception as e:
-        session.close()
         return jsonify({
             'status': 'error', 
             'message': 'Something is wrong smtpmail table!'
         })
-    
-    email_params_dict = row2dict(email_params)
 
-    session.close()
+    send_cc = [cc.strip() for cc in (email_params['temail'] or '').split(',') if cc.strip()]
+
+    ## Mail goes out from the background mail queue over a reused SMTP
+    ## connection; "wait": true keeps the old blocking behaviour
+    job = mail_queue.submit(
+        email_params,
+        send_to=[email_address],
+        send_cc=send_cc,
+        subject=f'MAA-FW-025 - {report_type} TEMPERATURE REPORT - {date_from} to {date_to}', 
+        message=email_tpl.format(report_type, date_from, date_to), 
+        attachment_path=report_path,
+    )
 
-    send_cc = email_params_dict['temail'].split(',')
-    if not isinstance(send_cc, list):
-        send_cc = [send_cc]
+    if data.get('wait'):
+        mail_queue.wait(job)
+        if job.status == 'error':
+            return jsonify({
+                'status': 'error', 
+                'message': 'Email is not sent!',
+                'mail': job.to_dict()
+            })
 
-    try:
-        send_mail(
-            send_from=email_params_dict['sfrom'], 
-            send_to=[email_address],
-            send_cc=send_cc,
-            subject=f'MAA-FW-025 - {report_type} TEMPERATURE REPORT - {date_from} to {date_to}', 
-            message=email_tpl.format(report_type, date_from, date_to), 
-            attachment_path=report_path,
-            server=email_params_dict['shost'], 
-            port=email_params_dict['sport'], 
-            username=email_params_dict['suser'], 
-            password=email_params_dict['spass'],
-            use_tls=True
-        )
-    except Exception as e:
-        print(e)
+    return jsonify({'status': 'success', 'mail': job.to_dict()})
+
+
+@app.route('/send/mail/<job_id>', methods=['GET'])
+def send_mail_status(job_id):
+
+    job = mail_queue.get(job_id)
+
+    if job is None:
         return jsonify({
             'status': 'error', 
-            'message': 'Email is not sent!'
-        })
-
-    return jsonify({'status': 'success'})
+            'message': 'Unknown mail job!'
+        }), 404
 
+    return jsonify({'status': 'success', 'mail': job.to_dict()})
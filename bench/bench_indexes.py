@@ -0,0 +1,138 @@
+import os
+import sys
+sys.dont_write_bytecode = True
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import argparse
+import datetime
+import statistics
+
+from sqlalchemy import create_engine
+
+from db import Session
+from config import Config
+from schema import migrate, drop_indexes
+from reporting import build_report, log_list_query
+from synthetic import seed_logloader, data_range
+
+# Times the hot LogLoaderdb range queries on a synthetic SQLite database,
+# first without and then with the managed indexes.
+#
+#   python bench/bench_indexes.py --rows 1000000 --output bench_indexes.json
+#   python bench/bench_indexes.py --baseline bench_indexes.json
+
+
+def timed(fn, repeat):
+
+    samples = []
+    for _ in range(repeat):
+        session = Session()
+        started = time.perf_counter()
+        try:
+            fn(session)
+        finally:
+            session.close()
+        samples.append(time.perf_counter() - started)
+
+    return {
+        'min': round(min(samples), 4),
+        'median': round(statistics.median(samples), 4),
+    }
+
+
+def cases(last_day, report_days):
+
+    first_day = last_day - datetime.timedelta(days=report_days - 1)
+
+    return {
+        'home_report_list_day': lambda s: log_list_query(s, last_day, last_day).all(),
+        f'home_report_list_{report_days}d': lambda s: log_list_query(s, first_day, last_day).all(),
+        'report_day': lambda s: build_report(s, last_day, last_day),
+        f'report_{report_days}d': lambda s: build_report(s, first_day, last_day),
+    }
+
+
+def run(repeat, report_days):
+
+    session = Session()
+    engine = session.get_bind()
+    session.close()
+
+    _, last_day = data_range(engine)
+    results = {}
+
+    drop_indexes(engine)
+    for name, fn in cases(last_day, report_days).items():
+        results.setdefault(name, {})['no_index'] = timed(fn, repeat)
+        print(f'{name:28} no index   {results[name]["no_index"]["median"]:.4f}s')
+
+    migrate(engine)
+    for name, fn in cases(last_day, report_days).items():
+        results[name]['indexed'] = timed(fn, repeat)
+        print(f'{name:28} indexed    {results[name]["indexed"]["median"]:.4f}s')
+
+    for name, r in results.items():
+        r['speedup'] = round(r['no_index']['median'] / r['indexed']['median'], 2)
+
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+
+        before = baseline[name]['indexed']['median']
+        after = r['indexed']['median']
+        if after > before * (1 + tolerance):
+            regressions.append(f'{name}: {before:.4f}s -> {after:.4f}s')
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='/tmp/bench_logloader.sqlite')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--report-days', type=int, default=7)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    engine = create_engine(f'sqlite:///{args.db}')
+    Session.configure(bind=engine)
+
+    # raw path only, the point is to measure the range scans themselves;
+    # the day cache would turn every timing after the first into hits
+    Config.report_use_rollups = False
+    Config.report_day_cache = False
+
+    rows = seed_logloader(engine, args.rows)
+    print(f'-- {rows} rows in {args.db} --')
+
+    results = run(args.repeat, args.report_days)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'rows': rows, 'results': results}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f'-- REGRESSION {line} --')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
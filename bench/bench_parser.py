@@ -0,0 +1,142 @@
+import os
+import sys
+sys.dont_write_bytecode = True
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import re
+import csv
+import json
+import time
+import argparse
+import datetime
+
+from csv_parser import parse_lines
+from mmap_reader import iter_file_rows
+from synthetic import LOCATIONS, days_for_rows, write_logger_csv
+
+# Rows/sec of csv_parser (text and mmap readers) against the original
+# csv_import loop on the same logger export, parsing only, no database.
+#
+#   python bench/bench_parser.py --rows 1000000
+
+date_re = [
+    r'^(3[01]|[12][0-9]|0[1-9])/(1[0-2]|0[1-9])/[0-9]{4}$',
+    r'^(1[0-2]|0[1-9])-(3[01]|[12][0-9]|0[1-9])-[0-9]{4}$',
+]
+
+
+def legacy_parse(csv_file_path):
+
+    # the read loop and per-row strptime csv_import used before csv_parser
+    data_to_import = []
+
+    with open(csv_file_path, mode='r') as csv_file:
+        csv_reader = csv.reader(x.replace('\0', '') for x in csv_file)
+
+        location_id = None
+        for row in csv_reader:
+
+            if not row:
+                if location_id:
+                    location_id = None
+                continue
+
+            if location_id:
+
+                date_match = re.match(date_re[0], row[0], re.M|re.I)
+                if date_match:
+                    while len(row) < 19:
+                        row.append(0.00)
+                    data_to_import.append([location_id] + row)
+                    continue
+
+                date_match = re.match(date_re[1], row[0], re.M|re.I)
+                if date_match:
+                    while len(row) < 19:
+                        row.append(0.00)
+                    m, d, y = row[0].split('-')
+                    row[0] = f'{d}/{m}/{y}'
+                    data_to_import.append([location_id] + row)
+                    continue
+
+            else:
+                if row[0].startswith("Location ID:"):
+                    try:
+                        location_id = re.search('Location ID: (.+?)$', row[0]).group(1)
+                    except AttributeError:
+                        location_id = None
+
+    rows = 0
+    for row in data_to_import:
+        dt = datetime.datetime.strptime(row[1] + ' ' + row[2], "%d/%m/%Y %H:%M:%S")
+        dt.date(), dt.time()
+        rows += 1
+
+    return rows
+
+
+def new_parse(csv_file_path):
+
+    rows = 0
+    with open(csv_file_path, mode='r') as csv_file:
+        for _ in parse_lines(x.replace('\0', '') for x in csv_file):
+            rows += 1
+
+    return rows
+
+
+def mmap_parse(csv_file_path):
+
+    rows = 0
+    for _ in iter_file_rows(csv_file_path, {'offset': 0, 'location_id': None}):
+        rows += 1
+
+    return rows
+
+
+def timed(fn, path):
+    started = time.perf_counter()
+    rows = fn(path)
+    seconds = time.perf_counter() - started
+
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(rows / seconds, 1),
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--fixture', default='/tmp/bench_logger_export.csv')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.fixture):
+        days = days_for_rows(args.rows)
+        print(f'-- Writing fixture {args.fixture} ({len(LOCATIONS)} locations x {days} days) --')
+        write_logger_csv(args.fixture, days=days)
+
+    results = {
+        'legacy': timed(legacy_parse, args.fixture),
+        'csv_parser': timed(new_parse, args.fixture),
+        'mmap_reader': timed(mmap_parse, args.fixture),
+    }
+    for name in ('csv_parser', 'mmap_reader'):
+        results[name]['speedup'] = round(
+            results[name]['rows_per_sec'] / results['legacy']['rows_per_sec'], 2
+        )
+
+    for name in ('legacy', 'csv_parser', 'mmap_reader'):
+        r = results[name]
+        print(f'{name:12} {r["rows"]:>9} rows {r["seconds"]:>8.3f}s {r["rows_per_sec"]:>12.1f} rows/s {r.get("speedup", 1.0):>6}x')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
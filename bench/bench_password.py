@@ -0,0 +1,87 @@
+import os
+import sys
+sys.dont_write_bytecode = True
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from password_hasher import PasswordHasher
+
+# Logins/sec per core for each password hash cost setting: a single-core
+# check loop, then the PasswordHasher process pool driven by concurrent
+# request threads.
+#
+#   python bench/bench_password.py --logins 64 --workers 4
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+    'scrypt:32768:8:1',
+]
+
+PASSWORD = 'correct horse battery staple'
+
+
+def single_core(pwhash, logins):
+
+    started = time.perf_counter()
+    for _ in range(logins):
+        assert check_password_hash(pwhash, PASSWORD)
+
+    return logins / (time.perf_counter() - started)
+
+
+def pooled(method, pwhash, logins, workers):
+
+    hasher = PasswordHasher(method=method, workers=workers)
+    hasher.verify(pwhash, PASSWORD)  # start the pool outside the timing
+
+    # as many request threads as logins in flight, like a login burst
+    with ThreadPoolExecutor(max_workers=workers * 4) as threads:
+        started = time.perf_counter()
+        results = list(threads.map(lambda _: hasher.verify(pwhash, PASSWORD), range(logins)))
+        seconds = time.perf_counter() - started
+
+    hasher.shutdown()
+    assert all(results)
+
+    return logins / seconds
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--methods', nargs='+', default=DEFAULT_METHODS)
+    parser.add_argument('--logins', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    results = {}
+    for method in args.methods:
+        pwhash = generate_password_hash(PASSWORD, method)
+
+        per_core = single_core(pwhash, args.logins)
+        pool = pooled(method, pwhash, args.logins, args.workers)
+
+        results[method] = {
+            'logins_per_sec_per_core': round(per_core, 2),
+            'ms_per_login': round(1000 / per_core, 1),
+            'pool_workers': args.workers,
+            'pool_logins_per_sec': round(pool, 2),
+        }
+        print(f'{method:24} {per_core:>8.2f}/s per core {1000 / per_core:>8.1f} ms   pool x{args.workers} {pool:>8.2f}/s')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
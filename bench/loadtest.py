@@ -0,0 +1,308 @@
+import os
+import sys
+sys.dont_write_bytecode = True
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import time
+import random
+import argparse
+import datetime
+import resource
+import threading
+import statistics
+import urllib.parse
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from db import Session
+from config import Config
+from synthetic import LOCATIONS, seed_logloader, data_range, write_logger_csv
+
+# Load test for the reporting endpoints: seeds a SQLite database with
+# synthetic logger data, writes fixture CSV exports, serves the app on a
+# local port with a stubbed PDF renderer and drives it with concurrent
+# clients. Prints throughput, p50/p95/p99 latency and peak RSS per
+# scenario and writes them as JSON for comparing runs.
+#
+#   python bench/loadtest.py --rows 2000000 --concurrency 8 --output loadtest.json
+#   python bench/loadtest.py --baseline loadtest.json
+#   python bench/loadtest.py --scenarios sign_in --base-url http://127.0.0.1:8000 \
+#       --sign-in-email user@example.com --sign-in-password secret
+
+SCENARIOS = ['report', 'home_report', 'csv_import', 'sign_in']
+
+
+def stub_pdf_renderer(delay):
+
+    # stands in for xvfb-run + wkhtmltopdf: same call, no browser
+    import report_jobs
+
+    def render_pdf(url_path, file_path):
+        time.sleep(delay)
+        with open(file_path, 'wb') as f:
+            f.write(b'%PDF-1.4\n% loadtest stub\n')
+
+        class Completed:
+            returncode = 0
+        return Completed()
+
+    report_jobs.render_pdf = render_pdf
+    Config.pdf_renderer = 'wkhtmltopdf'
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(port):
+
+    from app import app
+
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def request(base_url, method, path, data=None):
+
+    body = None
+    headers = {}
+    if data is not None:
+        body = urllib.parse.urlencode(data).encode()
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    req = urllib.request.Request(base_url + path, data=body, method=method, headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=300) as response:
+            response.read()
+            ok = response.status < 500
+    except urllib.error.HTTPError as e:
+        e.read()
+        ok = e.code < 500
+    except OSError:
+        ok = False
+
+    return time.perf_counter() - started, ok
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_scenario(base_url, make_request, requests, concurrency):
+
+    def one(i):
+        method, path, data = make_request(i)
+        return request(base_url, method, path, data)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    seconds = time.perf_counter() - started
+
+    latencies = [r[0] for r in results]
+    errors = sum(1 for r in results if not r[1])
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(requests / seconds, 2),
+        'mean': round(statistics.mean(latencies), 4),
+        'p50': round(percentile(latencies, 0.50), 4),
+        'p95': round(percentile(latencies, 0.95), 4),
+        'p99': round(percentile(latencies, 0.99), 4),
+        'max': round(max(latencies), 4),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return round(rss / 1024, 1)
+
+
+def date_ranges(first_day, last_day, report_days, seed):
+
+    span_days = (last_day - first_day).days - report_days + 1
+
+    # seeded per request number, the same run picks the same ranges
+    # whatever order the client threads get to them
+    def pick(i):
+        rnd = random.Random(seed * 1000003 + i)
+        start = first_day + datetime.timedelta(days=rnd.randrange(max(1, span_days)))
+        end = min(last_day, start + datetime.timedelta(days=report_days - 1))
+        return start.isoformat(), end.isoformat()
+
+    return pick
+
+
+def scenario_requests(name, args, ranges):
+
+    # every scenario is a function of the request number -> (method, path, form)
+    if name == 'report':
+        def make(i):
+            date_from, date_to = ranges(i)
+            return 'GET', f'/report/{date_from}/{date_to}', None
+        return make
+
+    if name == 'home_report':
+        def make(i):
+            date_from, date_to = ranges(i)
+            # a unique footer defeats the report cache, every request renders
+            query = f'?footerText=loadtest-{i}' if args.cold_reports else ''
+            return 'GET', f'/{date_from}/{date_to}{query}', None
+        return make
+
+    if name == 'csv_import':
+        def make(i):
+            # each request drops a new set of exports covering the days
+            # after the previous request's, so every import has rows to
+            # insert; files from concurrent requests are picked up too
+            start = args.csv_start + datetime.timedelta(days=i * args.csv_days)
+            write_fixtures(args.mount, args.csv_files, args.csv_days, start, f'{i + 1:04}')
+            return 'GET', '/csv/import?all=1', None
+        return make
+
+    if name == 'sign_in':
+        form = {'email': args.sign_in_email, 'password': args.sign_in_password}
+        return lambda i: ('POST', '/sign-in', form)
+
+    raise ValueError(f'Unknown scenario {name}')
+
+
+def write_fixtures(mount_path, files, days, start, tag):
+
+    # each export covers a slice of the locations, like one file per logger;
+    # written under another name and renamed, so an import running at the
+    # same time never reads a half written file
+    per_file = max(1, -(-len(LOCATIONS) // files))
+    rows = 0
+    for n in range(files):
+        locations = LOCATIONS[n * per_file:(n + 1) * per_file]
+        if not locations:
+            break
+        path = os.path.join(mount_path, f'loadtest_{tag}_{n + 1:02}.csv')
+        rows += write_logger_csv(path + '.part', locations=locations, start=start, days=days, seed=n + 1)
+        os.replace(path + '.part', path)
+
+    return rows
+
+
+def clear_fixtures(mount_path):
+
+    os.makedirs(mount_path, exist_ok=True)
+    for file in os.listdir(mount_path):
+        if file.startswith('loadtest_'):
+            os.remove(os.path.join(mount_path, file))
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='/tmp/loadtest_logloader.sqlite')
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--interval-minutes', type=int, default=5)
+    parser.add_argument('--mount', default='/tmp/loadtest_mount')
+    parser.add_argument('--csv-files', type=int, default=4)
+    parser.add_argument('--csv-days', type=int, default=7)
+    parser.add_argument('--scenarios', nargs='+', default=['report', 'home_report', 'csv_import'], choices=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--report-days', type=int, default=7)
+    parser.add_argument('--pdf-delay', type=float, default=0.5)
+    parser.add_argument('--cold-reports', action='store_true')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--base-url', default=None, help='drive an already running server instead')
+    parser.add_argument('--sign-in-email', default='loadtest@example.com')
+    parser.add_argument('--sign-in-password', default='loadtest')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    engine = create_engine(f'sqlite:///{args.db}')
+    Session.configure(bind=engine)
+
+    rows = seed_logloader(engine, args.rows, interval_minutes=args.interval_minutes)
+    first_day, last_day = data_range(engine)
+    print(f'-- {rows} rows in {args.db} ({first_day} .. {last_day}) --')
+
+    if 'csv_import' in args.scenarios:
+        Config.mount_point = args.mount
+        # fixtures start after the seeded days, rows already in the
+        # database would all be dropped as duplicates
+        clear_fixtures(args.mount)
+        args.csv_start = last_day + datetime.timedelta(days=1)
+        print(f'-- Fixture CSVs in {args.mount} from {args.csv_start}, {args.csv_days} days per request --')
+
+    base_url = args.base_url
+    server = None
+    if base_url is None:
+        if 'sign_in' in args.scenarios:
+            # /sign-in lives in the user blueprint's app, not in this one
+            print('-- sign_in needs --base-url of a running user app, skipped --')
+            args.scenarios = [s for s in args.scenarios if s != 'sign_in']
+
+        stub_pdf_renderer(args.pdf_delay)
+        server = serve(args.port)
+        base_url = f'http://127.0.0.1:{args.port}'
+
+    ranges = date_ranges(first_day, last_day, args.report_days, args.seed)
+
+    results = {}
+    try:
+        for name in args.scenarios:
+            make = scenario_requests(name, args, ranges)
+            r = results[name] = run_scenario(base_url, make, args.requests, args.concurrency)
+            print(
+                f'{name:12} {r["throughput_rps"]:>8.2f} req/s  p50 {r["p50"]:.4f}s  p95 {r["p95"]:.4f}s  '
+                f'p99 {r["p99"]:.4f}s  errors {r["errors"]}  rss {r["peak_rss_mb"]} MB'
+            )
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {
+        'rows': rows,
+        'locations': len(LOCATIONS),
+        'interval_minutes': args.interval_minutes,
+        'report_days': args.report_days,
+        'pdf_delay': args.pdf_delay,
+        'peak_rss_mb': peak_rss_mb(),
+        'scenarios': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f'-- REGRESSION {line} --')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
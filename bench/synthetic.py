@@ -0,0 +1,131 @@
+import random
+import datetime
+
+from sqlalchemy import func, select
+
+from db import LogLoaderdb
+
+LOCATIONS = [str(i) for i in range(70, 87)]
+CHANNEL_COUNT = 16
+
+START_DATE = datetime.date(2024, 1, 1)
+INTERVAL_MINUTES = 5
+
+
+def channel_bases(location_id):
+
+    # main room: channels 1-7 held at 15-25, channels 8-14 at 2-8;
+    # 74-76 are freezers, everything else looks like a room logger
+    if location_id in ('74', '75', '76'):
+        return [-15.0] * CHANNEL_COUNT
+    if location_id == '73':
+        return [20.0] * 7 + [5.0] * 7 + [20.0] * 2
+
+    return [18.0] * CHANNEL_COUNT
+
+
+def iter_samples(locations=LOCATIONS, start=START_DATE, days=1, interval_minutes=INTERVAL_MINUTES, seed=1):
+
+    rnd = random.Random(seed)
+    step = datetime.timedelta(minutes=interval_minutes)
+    end = datetime.datetime.combine(start, datetime.time()) + datetime.timedelta(days=days)
+
+    for location_id in locations:
+        values = channel_bases(location_id)
+        bases = list(values)
+        t = datetime.datetime.combine(start, datetime.time())
+
+        while t < end:
+            # bounded random walk around the base, with a rare excursion
+            for i in range(CHANNEL_COUNT):
+                values[i] += rnd.uniform(-0.3, 0.3) + (bases[i] - values[i]) * 0.05
+                if rnd.random() < 0.0005:
+                    values[i] += rnd.choice([-8.0, 8.0])
+
+            record = {
+                'location_id': location_id,
+                'logdate': t.date(),
+                'logtimein': t.time(),
+            }
+            for i in range(CHANNEL_COUNT):
+                record[f'chann{i + 1}'] = round(values[i], 1)
+
+            yield record
+            t += step
+
+
+def days_for_rows(rows, locations=LOCATIONS, interval_minutes=INTERVAL_MINUTES):
+    per_day = len(locations) * (24 * 60 // interval_minutes)
+    return max(1, -(-rows // per_day))
+
+
+def seed_logloader(engine, rows, locations=LOCATIONS, start=START_DATE, interval_minutes=INTERVAL_MINUTES, batch_size=20000):
+
+    table = LogLoaderdb.__table__
+    table.create(engine, checkfirst=True)
+
+    with engine.connect() as connection:
+        existing = connection.execute(select(func.count()).select_from(table)).scalar()
+    if existing:
+        return existing
+
+    days = days_for_rows(rows, locations, interval_minutes)
+    print(f'-- Seeding {len(locations)} locations x {days} days every {interval_minutes} min --')
+
+    inserted = 0
+    batch = []
+    with engine.begin() as connection:
+        for record in iter_samples(locations, start, days, interval_minutes):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                connection.execute(table.insert(), batch)
+                inserted += len(batch)
+                batch = []
+
+        if batch:
+            connection.execute(table.insert(), batch)
+            inserted += len(batch)
+
+    return inserted
+
+
+def data_range(engine):
+
+    table = LogLoaderdb.__table__
+
+    with engine.connect() as connection:
+        return connection.execute(
+            select(func.min(table.c.logdate), func.max(table.c.logdate))
+        ).one()
+
+
+def write_logger_csv(path, locations=LOCATIONS, start=START_DATE, days=1, interval_minutes=INTERVAL_MINUTES, seed=1):
+
+    # same layout as the logger exports csv_import reads: a "Location ID:"
+    # line, a header row, samples, and a blank line between sections;
+    # dates alternate between dd/mm/yyyy and mm-dd-yyyy like the real exports
+    rows = 0
+    location_id = None
+
+    with open(path, mode='w', newline='') as f:
+        for record in iter_samples(locations, start, days, interval_minutes, seed):
+            if record['location_id'] != location_id:
+                if location_id is not None:
+                    f.write('\n')
+                location_id = record['location_id']
+                f.write(f'Location ID: {location_id}\n')
+                f.write('Date,Time,' + ','.join(f'Ch{i}' for i in range(1, CHANNEL_COUNT + 1)) + '\n')
+
+            d = record['logdate']
+            if record['logtimein'].hour % 2:
+                date_str = d.strftime('%d/%m/%Y')
+            else:
+                date_str = d.strftime('%m-%d-%Y')
+
+            channels = ','.join(str(record[f'chann{i}']) for i in range(1, CHANNEL_COUNT + 1))
+            f.write(f'{date_str},{record["logtimein"].strftime("%H:%M:%S")},{channels}\n')
+            rows += 1
+
+        f.write('\n')
+
+    return rows
@@ -0,0 +1,121 @@
+import re
+import csv
+import datetime
+
+CHANNEL_COUNT = 16
+
+RECORD_COLUMNS = ['location_id', 'logdate', 'logtimein'] + [
+    f'chann{i}' for i in range(1, CHANNEL_COUNT + 1)
+]
+
+# dd/mm/yyyy or mm-dd-yyyy in one pattern, the groups give day/month/year
+# for whichever branch matched
+SAMPLE_DATE_RE = re.compile(
+    r'^(?:'
+    r'(3[01]|[12][0-9]|0[1-9])/(1[0-2]|0[1-9])/([0-9]{4})'
+    r'|'
+    r'(1[0-2]|0[1-9])-(3[01]|[12][0-9]|0[1-9])-([0-9]{4})'
+    r')$'
+)
+TIME_RE = re.compile(r'^([0-9]{1,2}):([0-9]{1,2}):([0-9]{1,2})$')
+
+LOCATION_PREFIX = 'Location ID:'
+LOCATION_RE = re.compile(r'Location ID: (.+?)$')
+
+ZERO_PADDING = (0.0,) * CHANNEL_COUNT
+
+
+class CSVParseError(ValueError):
+    pass
+
+
+def to_channel_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LoggerCSVParser:
+
+    # Turns csv.reader rows of a logger export into typed tuples
+    # (location_id, logdate, logtimein, chann1..chann16). Loggers repeat the
+    # same few dates and the same 1440 minute stamps over and over, so dates
+    # and times are converted once per distinct string and then cached.
+
+    def __init__(self, location_id=None):
+        self.location_id = location_id
+        self.dates = {}
+        self.times = {}
+
+    def parse_date(self, value, match):
+        logdate = self.dates.get(value)
+        if logdate is None:
+            d, m, y, m2, d2, y2 = match.groups()
+            try:
+                if d is not None:
+                    logdate = datetime.date(int(y), int(m), int(d))
+                else:
+                    logdate = datetime.date(int(y2), int(m2), int(d2))
+            except ValueError as e:
+                raise CSVParseError(f'{value}: {e}')
+            self.dates[value] = logdate
+
+        return logdate
+
+    def parse_time(self, value):
+        logtimein = self.times.get(value)
+        if logtimein is None:
+            match = TIME_RE.match(value)
+            if not match:
+                raise CSVParseError(f'time data {value!r} does not match format HH:MM:SS')
+            try:
+                logtimein = datetime.time(*map(int, match.groups()))
+            except ValueError as e:
+                raise CSVParseError(f'{value}: {e}')
+            self.times[value] = logtimein
+
+        return logtimein
+
+    def parse_row(self, row):
+
+        if not row:
+            self.location_id = None
+            return None
+
+        if self.location_id is None:
+            if row[0].startswith(LOCATION_PREFIX):
+                match = LOCATION_RE.search(row[0])
+                self.location_id = match.group(1) if match else None
+            return None
+
+        first = row[0]
+        match = SAMPLE_DATE_RE.match(first)
+        if match is None:
+            return None
+
+        logdate = self.parse_date(first, match)
+        logtimein = self.parse_time(row[1] if len(row) > 1 else '')
+
+        values = row[2:2 + CHANNEL_COUNT]
+        try:
+            channels = tuple(map(float, values))
+        except ValueError:
+            # blank or garbled readings become NULL instead of failing the row
+            channels = tuple(map(to_channel_value, values))
+        if len(channels) < CHANNEL_COUNT:
+            channels += ZERO_PADDING[len(channels):]
+
+        return (self.location_id, logdate, logtimein) + channels
+
+    def parse_rows(self, rows):
+        parse_row = self.parse_row
+
+        for row in rows:
+            record = parse_row(row)
+            if record is not None:
+                yield record
+
+
+def parse_lines(lines, location_id=None):
+    return LoggerCSVParser(location_id).parse_rows(csv.reader(lines))
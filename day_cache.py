@@ -0,0 +1,130 @@
+import datetime
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import Table, Column, Integer, Date, and_, select
+from sqlalchemy.exc import IntegrityError
+
+from db import LogLoaderdb
+from config import Config
+from lazy_tables import ensure_table
+
+DEFAULT_DAY_CACHE_SIZE = 400
+
+# One row per day with a counter the importer bumps every time it adds rows
+# for that day. A cached day is valid while its stamp is unchanged, so
+# checking a range costs one read of this table, not a count over the rows.
+log_day_stamp = Table(
+    'log_day_stamp',
+    LogLoaderdb.metadata,
+    Column('day', Date, primary_key=True),
+    Column('stamp', Integer, nullable=False),
+)
+
+
+def day_cache_enabled():
+    return getattr(Config, 'report_day_cache', True)
+
+
+def ensure_stamp_table(session):
+    ensure_table(session, log_day_stamp)
+
+
+def bump_days(session, days):
+
+    days = set(days)
+    if not days:
+        return
+
+    ensure_stamp_table(session)
+
+    # the increment is done by the database, two imports bumping the same
+    # day both count and a day cached between them reads as stale
+    t = log_day_stamp
+    session.execute(t.update().where(t.c.day.in_(days)).values(stamp=t.c.stamp + 1))
+
+    known = set(session.execute(select(t.c.day).where(t.c.day.in_(days))).scalars())
+    for day in days - known:
+        try:
+            with session.begin_nested():
+                session.execute(t.insert().values(day=day, stamp=1))
+        except IntegrityError:
+            # another import stamped the day first
+            session.execute(t.update().where(t.c.day == day).values(stamp=t.c.stamp + 1))
+
+
+def touch_days(session, rows):
+
+    # called with every batch the importer inserts, rows are
+    # (location_id, logdate, logtimein, ...) tuples
+    bump_days(session, {r[1] for r in rows})
+
+
+def bump_range(session, date_from, date_to):
+
+    # for changes made outside the importer, e.g. a rollup rebuild after
+    # manual edits
+    days = [date_from + datetime.timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    bump_days(session, days)
+
+
+def day_stamps(session, date_from, date_to):
+
+    # {day: stamp}; days never touched by the importer read as stamp 0
+    ensure_stamp_table(session)
+
+    t = log_day_stamp
+    q = select(t.c.day, t.c.stamp).where(
+        and_(
+            t.c.day >= date_from,
+            t.c.day <= date_to,
+        )
+    )
+
+    return {day: stamp for day, stamp in session.execute(q)}
+
+
+class DayCache:
+
+    # Bounded LRU of per-day report partials. Keys carry the day's stamp,
+    # so a day with new rows simply misses and its old entry ages out.
+
+    def __init__(self, size=None):
+        self._size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        return self._size or getattr(Config, 'report_day_cache_size', DEFAULT_DAY_CACHE_SIZE)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+day_cache = DayCache()
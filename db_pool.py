@@ -0,0 +1,132 @@
+import time
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+from db import Session
+from config import Config
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidated = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'invalidated': self.invalidated,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 4),
+                'timeouts': self.timeouts,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class MeteredQueuePool(QueuePool):
+
+    # QueuePool that records how often a checkout found every connection in
+    # use and had to block, and for how long
+    def _do_get(self):
+        busy = self.checkedin() == 0 and self.overflow() >= self._max_overflow
+        if not busy:
+            return super()._do_get()
+
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            pool_stats.add(timeouts=1)
+            raise
+        finally:
+            pool_stats.add(waits=1, wait_seconds=time.perf_counter() - started)
+
+
+def session_factory():
+    # Session may be a plain sessionmaker or a scoped_session around one
+    return getattr(Session, 'session_factory', Session)
+
+
+def pool_options():
+    return {
+        'poolclass': MeteredQueuePool,
+        'pool_size': getattr(Config, 'db_pool_size', DEFAULT_POOL_SIZE),
+        'max_overflow': getattr(Config, 'db_max_overflow', DEFAULT_MAX_OVERFLOW),
+        'pool_timeout': getattr(Config, 'db_pool_timeout', DEFAULT_POOL_TIMEOUT),
+        'pool_recycle': getattr(Config, 'db_pool_recycle', DEFAULT_POOL_RECYCLE),
+        'pool_pre_ping': getattr(Config, 'db_pool_pre_ping', True),
+    }
+
+
+def watch_pool(engine):
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        pool_stats.add(connects=1)
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_stats.add(checkouts=1)
+
+    @event.listens_for(engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_stats.add(invalidated=1)
+
+
+def configure_pool():
+
+    # Rebinds Session to an engine on the same URL with a sized, pre-pinged
+    # and recycled QueuePool. SQLite keeps the engine db.py made, its
+    # default pool already fits how the driver handles threads.
+    factory = session_factory()
+    engine = factory.kw.get('bind')
+    if engine is None:
+        return None
+
+    if engine.url.get_backend_name() != 'sqlite':
+        engine = create_engine(engine.url, **pool_options())
+        factory.configure(bind=engine)
+
+    watch_pool(engine)
+
+    return engine
+
+
+def pool_metrics():
+
+    engine = session_factory().kw.get('bind')
+    pool = engine.pool if engine is not None else None
+
+    metrics = {'pool': type(pool).__name__ if pool is not None else None}
+    if isinstance(pool, QueuePool):
+        metrics.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+        })
+    metrics.update(pool_stats.to_dict())
+
+    return metrics
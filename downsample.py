@@ -0,0 +1,113 @@
+import numpy as np
+
+from config import Config
+
+DEFAULT_GRAPH_POINTS = 1000
+DEFAULT_METHOD = 'minmax'
+
+
+def graph_points():
+    return getattr(Config, 'report_graph_points', DEFAULT_GRAPH_POINTS)
+
+
+def graph_method():
+    return getattr(Config, 'report_graph_downsample', DEFAULT_METHOD)
+
+
+def lttb_indices(x, y, threshold):
+
+    # Largest-Triangle-Three-Buckets: first and last point are kept, each
+    # bucket in between contributes the point that spans the largest
+    # triangle with the point kept before it and the next bucket's average
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+
+        next_x = np.nanmean(x[next_start:next_end]) if next_end > next_start else x[-1]
+        next_y = np.nanmean(y[next_start:next_end]) if next_end > next_start else y[-1]
+
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        area[np.isnan(area)] = -1.0
+
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+
+    return kept
+
+
+def minmax_indices(values, threshold):
+
+    # Every bucket keeps the rows holding its minimum and its maximum, per
+    # column, so no peak or dip survives only by luck; the bucket count is
+    # chosen so the union, first and last row included, stays within
+    # threshold rows.
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+
+    n, columns = values.shape
+    if n <= threshold:
+        return np.arange(n)
+
+    buckets = (threshold - 2) // (2 * columns)
+    if buckets < 1:
+        # too many columns for even one bucket within the budget, evenly
+        # spaced rows are the best that fits
+        return np.unique(np.linspace(0, n - 1, threshold).round().astype(np.int64))
+    if buckets * 2 * columns >= n:
+        return np.arange(n)
+
+    low = np.where(np.isnan(values), np.inf, values)
+    high = np.where(np.isnan(values), -np.inf, values)
+
+    kept = [np.array([0, n - 1])]
+    for start, end in zip(*bucket_edges(n, buckets)):
+        kept.append(start + np.argmin(low[start:end], axis=0))
+        kept.append(start + np.argmax(high[start:end], axis=0))
+
+    return np.unique(np.concatenate(kept))
+
+
+def bucket_edges(n, buckets):
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    return edges[:-1], edges[1:]
+
+
+def downsample_indices(x, values, threshold=None, method=None):
+
+    # Row indices to keep for one graph; x is the time axis in seconds,
+    # values one series or a (rows x series) block sharing that axis
+    threshold = graph_points() if threshold is None else threshold
+    method = method or graph_method()
+
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if not threshold or n <= threshold:
+        return np.arange(n)
+
+    if method == 'lttb':
+        if values.ndim == 1:
+            return lttb_indices(x, values, threshold)
+
+        per_series = max(3, threshold // values.shape[1])
+        return np.unique(np.concatenate([
+            lttb_indices(x, values[:, i], per_series) for i in range(values.shape[1])
+        ]))
+
+    return minmax_indices(values, threshold)
@@ -0,0 +1,331 @@
+import datetime
+
+from sqlalchemy import (
+    Table, Column, Integer, SmallInteger, Float, String, DateTime, Boolean, Index,
+    and_, select, bindparam
+)
+from sqlalchemy.sql import func
+
+from db import LogLoaderdb
+from config import Config
+from samples import CHANNELS, sample_columns
+from rollups import to_float
+from topology import get_topology
+from lazy_tables import ensure_table
+
+EXCURSION_FETCH_SIZE = 10000
+DEFAULT_MAX_GAP = 30 * 60
+
+# One row per run of consecutive samples outside a channel group's range:
+# 'excursion' above the high limit, 'incursion' below the low one. The run
+# still going at the last imported sample stays open and is extended by the
+# next import.
+log_excursion = Table(
+    'log_excursion',
+    LogLoaderdb.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('location_id', String(64), nullable=False),
+    Column('channel', SmallInteger, nullable=False),
+    Column('kind', String(16), nullable=False),
+    Column('start_at', DateTime, nullable=False),
+    Column('end_at', DateTime, nullable=False),
+    Column('peak', Float, nullable=False),
+    Column('samples', Integer, nullable=False),
+    Column('is_open', Boolean, nullable=False, default=False),
+    Index('ix_log_excursion_location_start', 'location_id', 'start_at'),
+    Index('ix_log_excursion_open', 'location_id', 'channel', 'is_open'),
+)
+
+
+def excursions_enabled():
+    return getattr(Config, 'report_track_excursions', True)
+
+
+def ensure_excursion_table(session):
+    ensure_table(session, log_excursion)
+
+
+def watched_channels(topology):
+
+    # {location_id: {channel number: (low, high)}} from the channel groups
+    watched = {}
+    for site in topology.sites:
+        limits = watched.setdefault(site.location_id, {})
+        for group in site.groups:
+            if group.low is None and group.high is None:
+                continue
+            for i in group.indexes:
+                limits[i + 1] = (group.low, group.high)
+
+    return {location_id: limits for location_id, limits in watched.items() if limits}
+
+
+def sample_kind(value, low, high):
+    if high is not None and value > high:
+        return 'excursion'
+    if low is not None and value < low:
+        return 'incursion'
+    return None
+
+
+def collect_series(rows, watched):
+
+    # rows are (location_id, logdate, logtimein, chann1..chann16) tuples;
+    # returns {(location_id, channel): [(timestamp, value), ...]} in time order
+    series = {}
+
+    for row in rows:
+        limits = watched.get(row[0])
+        if not limits:
+            continue
+
+        at = datetime.datetime.combine(row[1], row[2])
+        for channel in limits:
+            value = to_float(row[2 + channel])
+            if value is not None:
+                series.setdefault((row[0], channel), []).append((at, value))
+
+    for samples in series.values():
+        samples.sort(key=lambda s: s[0])
+
+    return series
+
+
+def load_open_events(session, keys, before=None):
+
+    # before bounds the lookup to events starting earlier, so a rebuild of
+    # an older range does not pick up the live event past its end
+    location_ids = {key[0] for key in keys}
+    conditions = [
+        log_excursion.c.location_id.in_(location_ids),
+        log_excursion.c.is_open == True,
+    ]
+    if before is not None:
+        conditions.append(log_excursion.c.start_at < before)
+
+    q = select(log_excursion).where(and_(*conditions))
+
+    return {
+        (r.location_id, r.channel): dict(r._mapping)
+        for r in session.execute(q)
+        if (r.location_id, r.channel) in keys
+    }
+
+
+def detect_events(series, watched, open_events, max_gap):
+
+    # Walks each channel's samples, extending the open event or starting a
+    # new one. A gap longer than max_gap, or a sample older than the open
+    # event (an out of order import), ends the event instead of bridging it.
+    events = []
+
+    for (location_id, channel), samples in series.items():
+        low, high = watched[location_id][channel]
+        event = open_events.get((location_id, channel))
+
+        for at, value in samples:
+            kind = sample_kind(value, low, high)
+
+            if event is not None and (
+                kind != event['kind']
+                or at < event['end_at']
+                or (at - event['end_at']).total_seconds() > max_gap
+            ):
+                event['is_open'] = False
+                events.append(event)
+                event = None
+
+            if kind is None:
+                continue
+
+            if event is None:
+                event = {
+                    'id': None,
+                    'location_id': location_id,
+                    'channel': channel,
+                    'kind': kind,
+                    'start_at': at,
+                    'end_at': at,
+                    'peak': value,
+                    'samples': 0,
+                    'is_open': True,
+                }
+
+            event['end_at'] = at
+            event['samples'] += 1
+            event['peak'] = max(event['peak'], value) if kind == 'excursion' else min(event['peak'], value)
+
+        if event is not None:
+            events.append(event)
+
+    return events
+
+
+def save_events(session, events):
+
+    updates = [dict(e, b_id=e['id']) for e in events if e['id'] is not None]
+    if updates:
+        session.execute(
+            log_excursion.update().where(
+                log_excursion.c.id == bindparam('b_id')
+            ).values(
+                end_at=bindparam('end_at'),
+                peak=bindparam('peak'),
+                samples=bindparam('samples'),
+                is_open=bindparam('is_open'),
+            ),
+            updates
+        )
+
+    inserts = [{k: v for k, v in e.items() if k != 'id'} for e in events if e['id'] is None]
+    if inserts:
+        session.execute(log_excursion.insert(), inserts)
+
+
+def update_excursions(session, rows, topology=None, before=None):
+
+    # called with every batch the importer inserts, next to update_rollups
+    watched = watched_channels(topology or get_topology())
+    series = collect_series(rows, watched)
+    if not series:
+        return
+
+    ensure_excursion_table(session)
+
+    max_gap = getattr(Config, 'excursion_max_gap', DEFAULT_MAX_GAP)
+    open_events = load_open_events(session, set(series), before)
+
+    save_events(session, detect_events(series, watched, open_events, max_gap))
+
+
+def rebuild_excursions(session, date_from, date_to, topology=None):
+
+    # backfill for data imported before the event index existed, or after
+    # an out of order import split events that belong together
+    ensure_excursion_table(session)
+
+    # events reaching over the edges are rebuilt whole, widen the range
+    # until no stored event sticks out of it
+    while True:
+        overlap = and_(
+            log_excursion.c.start_at < datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time()),
+            log_excursion.c.end_at >= datetime.datetime.combine(date_from, datetime.time()),
+        )
+        first, last = session.execute(
+            select(func.min(log_excursion.c.start_at), func.max(log_excursion.c.end_at)).where(overlap)
+        ).one()
+        if first is None or (first.date() >= date_from and last.date() <= date_to):
+            break
+        date_from = min(date_from, first.date())
+        date_to = max(date_to, last.date())
+
+    session.execute(log_excursion.delete().where(overlap))
+
+    table = LogLoaderdb.__table__
+    q = select(*sample_columns()).where(
+        and_(
+            table.c.logdate >= date_from,
+            table.c.logdate <= date_to,
+        )
+    ).order_by(
+        table.c.logdate.asc(),
+        table.c.logtimein.asc()
+    )
+    result = session.execute(q)
+
+    end = datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time())
+
+    rows = 0
+    while True:
+        chunk = result.fetchmany(EXCURSION_FETCH_SIZE)
+        if not chunk:
+            break
+        rows += len(chunk)
+        update_excursions(session, chunk, topology, before=end)
+
+    # a run still open at the end of the range was ended by the samples
+    # imported after it, which are not part of this rebuild
+    later = select(table.c.location_id).where(table.c.logdate > date_to).distinct()
+    session.execute(
+        log_excursion.update().where(
+            and_(
+                log_excursion.c.is_open == True,
+                log_excursion.c.start_at < end,
+                log_excursion.c.location_id.in_(later),
+            )
+        ).values(is_open=False)
+    )
+
+    return rows
+
+
+## Reading the index ##
+
+excursion_range_query = select(
+    log_excursion.c.location_id,
+    log_excursion.c.channel,
+    log_excursion.c.kind,
+    log_excursion.c.start_at,
+    log_excursion.c.end_at,
+    log_excursion.c.peak,
+).where(
+    and_(
+        log_excursion.c.location_id.in_(bindparam('location_ids', expanding=True)),
+        log_excursion.c.start_at < bindparam('end'),
+        log_excursion.c.end_at >= bindparam('start'),
+    )
+)
+
+
+def excursion_summary(session, topology, date_from, date_to):
+
+    # {location_id: {channel name: figures}} for every watched channel of the
+    # topology: number of excursions/incursions touching the range, their
+    # seconds inside it and the furthest value reached
+    ensure_excursion_table(session)
+
+    watched = watched_channels(topology)
+    start = datetime.datetime.combine(date_from, datetime.time())
+    end = datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time())
+
+    summary = {
+        location_id: {
+            CHANNELS[channel - 1]: {
+                'low': low,
+                'high': high,
+                'excursions': 0,
+                'excursion_seconds': 0.0,
+                'max': None,
+                'incursions': 0,
+                'incursion_seconds': 0.0,
+                'min': None,
+            }
+            for channel, (low, high) in limits.items()
+        }
+        for location_id, limits in watched.items()
+    }
+    if not summary:
+        return summary
+
+    rows = session.execute(excursion_range_query, {
+        'location_ids': list(summary),
+        'start': start,
+        'end': end,
+    })
+
+    for location_id, channel, kind, start_at, end_at, peak in rows:
+        figures = summary[location_id].get(CHANNELS[channel - 1])
+        if figures is None:
+            # thresholds changed since the event was recorded
+            continue
+
+        seconds = (min(end_at, end) - max(start_at, start)).total_seconds()
+        figures[kind + 's'] += 1
+        figures[kind + '_seconds'] += max(seconds, 0.0)
+
+        extreme = 'max' if kind == 'excursion' else 'min'
+        current = figures[extreme]
+        if current is None or (peak > current if kind == 'excursion' else peak < current):
+            figures[extreme] = peak
+
+    return summary
@@ -20,7 +20,17 @@ from flask.ext.login import (
 # Import the resbase object from the main app module
 from app import app, db, login_manager
 
-from app.email import send_email
+# Mail goes through the outbox, sent by a background worker
+from mail_outbox import enqueue_email, outbox_worker
+
+# Users for Flask-Login come from the user cache
+from user_cache import user_cache
+
+# Password hashing and checks run in a process pool
+from password_hasher import password_hasher
+
+# Route latency histograms, spans and opt-in request profiling
+from instrumentation import init_app as init_instrumentation
 
 # Import module forms
 from app.mod_user.form import *
@@ -30,16 +40,30 @@ from app.model.user import (
     UserAccount, UserAccountSetting, UserAccountTransaction
 )
 
+# Plain passwords set on the model are hashed in the pool
+password_hasher.init_model(UserAccount)
+
 # Import content limit decorator function
 from app.decoratorfunc import limit_content_length
 
 # Define the blueprint: 'login', set its url prefix: app.url/login
 user_blueprint = Blueprint('user', __name__, url_prefix='')
 
+init_instrumentation(
+    app,
+    profile_token=app.config.get('PROFILE_TOKEN'),
+    profile_dir=app.config.get('PROFILE_DIR'),
+)
+
+# Send mail left in the outbox before a restart; deployments running
+# mail_outbox.py standalone set OUTBOX_WORKER = False
+if app.config.get('OUTBOX_WORKER', True):
+    outbox_worker.start()
+
 
 @login_manager.user_loader
 def load_user(id):
-    return UserAccount.query.get(id)
+    return user_cache.load(id)
 
 
 def flash_errors(form):
@@ -65,7 +89,12 @@ def sign_in():
     if form.validate_on_submit():
         user = UserAccount.query.filter_by(email=form.email.data).first()
 
-        if user and user.check_password(form.password.data):
+        if user and password_hasher.verify_and_update(user, form.password.data):
+            # hash was upgraded to the current cost settings
+            if user in db.session.dirty:
+                db.session.commit()
+                user_cache.invalidate(user.id)
+
             login_user(user, remember=False)
 
             # Track user
@@ -108,13 +137,14 @@ def sign_up():
         )
         db.session.add(ua_setting)
 
-        db.session.commit()
-
         token = user.generate_confirmation_token()
         confirm_url = url_for('user.confirm_email', token=token, _external=True, _scheme='https')
         html = render_template('user/mail-confirm.html', confirm_url=confirm_url)
         subject = 'Molimo vas da potvrdite email adresu'
-        send_email(user.email, subject, html)
+        enqueue_email(user.email, subject, html)
+
+        # user, settings and confirmation mail are committed together
+        db.session.commit()
 
         login_user(user, remember=False)
 
@@ -142,6 +172,8 @@ def settings():
         db.session.add(form.ua_setting)
         db.session.commit()
 
+        user_cache.invalidate(form.user.id)
+
     flash_errors(form)
 
     return render_template('user/settings.html', form=form, header=True, footer=True)
@@ -162,7 +194,8 @@ def reset():
         confirm_url = url_for('user.reset_with_token', token=token, _external=True)
         html = render_template('user/mail-reset.html', confirm_url=confirm_url)
         subject = 'Resetovanje sifre'
-        send_email(user.email, subject, html)
+        enqueue_email(user.email, subject, html)
+        db.session.commit()
 
         return redirect(url_for('product.home'))
 
@@ -191,6 +224,8 @@ def reset_with_token(token):
         user.change_password(form.password.data)
         db.session.commit()
 
+        user_cache.invalidate(user.id)
+
         return redirect(url_for('user.sign_in'))
 
     flash_errors(form)
@@ -228,6 +263,8 @@ def confirm_email(token):
         db.session.add(ua_transaction)
         db.session.commit()
 
+        user_cache.invalidate(user.id)
+
         message = 'Potvrdili ste nalog. Hvala!'
 
         # if not current_user.is_authenticated():
@@ -252,7 +289,8 @@ def resend_confirm():
         confirm_url = url_for('user.confirm_email', token=token, _external=True, _scheme='https')
         html = render_template('user/mail-confirm.html', confirm_url=confirm_url)
         subject = 'Molimo vas da potvrdite email adresu'
-        send_email(current_user.email, subject, html)
+        enqueue_email(current_user.email, subject, html)
+        db.session.commit()
 
         return redirect(url_for('product.home'))
 
@@ -0,0 +1,279 @@
+import os
+import time
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import and_, select
+
+from db import LogLoaderdb
+from config import Config
+from ledger import plan_import, save_entry
+from rollups import update_rollups
+from excursions import excursions_enabled, update_excursions
+from day_cache import touch_days
+from csv_parser import CSVParseError, RECORD_COLUMNS
+from mmap_reader import iter_file_rows, plan_chunks, parse_chunk
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_SPLIT_BYTES = 4 * 1024 * 1024
+
+
+def get_batch_size():
+    return int(getattr(Config, 'import_batch_size', DEFAULT_BATCH_SIZE))
+
+
+def iter_csv_rows(csv_file_path, state=None):
+
+    # state carries the byte offset and the open "Location ID:" section, so an
+    # import can resume from the tail of a file that has grown since last time
+    if state is None:
+        state = {}
+    state.setdefault('offset', 0)
+    state.setdefault('location_id', None)
+
+    return iter_file_rows(csv_file_path, state)
+
+
+def iter_batches(records, batch_size):
+
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def filter_existing(session, batch):
+
+    # drop rows whose (location_id, logdate, logtimein) is already stored,
+    # looking only at the locations and date span covered by this batch
+    table = LogLoaderdb.__table__
+
+    location_ids = {r[0] for r in batch}
+    dates = [r[1] for r in batch]
+
+    q = select(
+        table.c.location_id,
+        table.c.logdate,
+        table.c.logtimein,
+    ).where(
+        and_(
+            table.c.location_id.in_(location_ids),
+            table.c.logdate >= min(dates),
+            table.c.logdate <= max(dates),
+        )
+    )
+    seen = {tuple(r) for r in session.execute(q)}
+
+    fresh = []
+    for record in batch:
+        key = record[:3]
+        if key in seen:
+            continue
+        seen.add(key)
+        fresh.append(record)
+
+    return fresh
+
+
+def bulk_insert(session, records, batch_size=None, dedup=True):
+
+    batch_size = batch_size or get_batch_size()
+    table = LogLoaderdb.__table__
+
+    stats = {'rows': 0, 'duplicates': 0, 'batches': 0}
+    started = time.perf_counter()
+
+    # Core insert with a list of parameter sets goes through executemany,
+    # so no ORM object is built per row and only one batch is held in memory.
+    for batch in iter_batches(records, batch_size):
+        parsed = len(batch)
+        if dedup:
+            batch = filter_existing(session, batch)
+
+        if batch:
+            session.execute(table.insert(), [dict(zip(RECORD_COLUMNS, r)) for r in batch])
+            update_rollups(session, batch)
+            if excursions_enabled():
+                update_excursions(session, batch)
+            touch_days(session, batch)
+
+        stats['rows'] += len(batch)
+        stats['duplicates'] += parsed - len(batch)
+        stats['batches'] += 1
+        print(f'-- Inserted {stats["rows"]} rows ({stats["batches"]} batches) --')
+
+    elapsed = time.perf_counter() - started
+
+    stats['seconds'] = round(elapsed, 3)
+    stats['rows_per_sec'] = round(stats['rows'] / elapsed, 1) if elapsed else 0.0
+
+    return stats
+
+
+def import_file(session, csv_file_path, batch_size=None, plan=None):
+
+    # the ledger row stays locked until the caller commits, a second import
+    # of the same file waits and then starts where this one stopped
+    plan = plan or plan_import(session, csv_file_path, lock=True)
+
+    if plan['action'] == 'skip':
+        print(f'-- CSV file unchanged since last import ({csv_file_path}) --')
+        return {
+            'action': 'skip',
+            'rows': 0,
+            'duplicates': 0,
+            'batches': 0,
+            'seconds': 0.0,
+            'rows_per_sec': 0.0,
+        }
+
+    state = {
+        'offset': plan['offset'],
+        'location_id': plan['location_id'],
+    }
+    stats = bulk_insert(session, iter_csv_rows(csv_file_path, state), batch_size)
+
+    save_entry(session, plan, state['offset'], state['location_id'], stats['rows'])
+
+    stats['action'] = plan['action']
+    stats['offset'] = state['offset']
+
+    return stats
+
+
+def find_csv_files(mount_path):
+
+    files = []
+    for file in sorted(os.listdir(mount_path)):
+        if file.endswith('.csv') or file.endswith('.CSV'):
+            files.append(os.path.join(mount_path, file))
+
+    return files
+
+
+def import_files(session, csv_file_paths, workers=None, batch_size=None):
+
+    # Files are cut into chunks of Config.import_split_bytes, parsed by a
+    # process pool and written strictly in path and chunk order, one
+    # transaction per file. Only a window of chunks is in flight at a time,
+    # so memory stays flat however big the exports are, and rows reach the
+    # rollups and excursion runs in the order they were logged.
+    workers = workers or getattr(Config, 'import_workers', None) or os.cpu_count()
+    split_bytes = getattr(Config, 'import_split_bytes', DEFAULT_SPLIT_BYTES)
+    results = {}
+    tasks = []
+
+    for path in csv_file_paths:
+        plan = plan_import(session, path)
+        if plan['action'] == 'skip':
+            results[path] = {'file': path, 'action': 'skip', 'status': 'success', 'rows': 0}
+            continue
+
+        chunks = plan_chunks(path, plan['offset'], plan['location_id'], split_bytes)
+        if not chunks:
+            # only a held back unterminated line past the offset
+            chunks = [(plan['offset'], None, plan['location_id'])]
+
+        for n, chunk in enumerate(chunks):
+            tasks.append((plan, n, len(chunks), chunk))
+
+    # planning only read, end that transaction before files lock their rows
+    session.rollback()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        queued = iter(tasks)
+        totals = {}
+
+        def submit_next():
+            for plan, n, count, (start, end, location_id) in queued:
+                if plan['path'] in results:
+                    # an earlier chunk of this file already failed
+                    continue
+                future = executor.submit(parse_chunk, plan['path'], start, end, location_id)
+                pending.append((plan, n, count, future))
+                return
+
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            plan, n, count, future = pending.popleft()
+            submit_next()
+
+            path = plan['path']
+            if path in results:
+                future.cancel()
+                continue
+
+            try:
+                if n == 0:
+                    # plans above are made without locks; the ledger row is
+                    # locked now, and when another import moved the file on
+                    # in the meantime it is read serially from there instead
+                    locked = plan_import(session, path, lock=True)
+                    if [locked[k] for k in ('action', 'offset', 'location_id')] != \
+                            [plan[k] for k in ('action', 'offset', 'location_id')]:
+                        future.cancel()
+                        stats = import_file(session, path, batch_size, locked)
+                        session.commit()
+                        results[path] = dict(stats, file=path, status='success')
+                        continue
+
+                    totals[path] = {'rows': 0, 'duplicates': 0, 'batches': 0, 'seconds': 0.0, 'parse_seconds': 0.0}
+                total = totals[path]
+
+                records, state, parse_seconds = future.result()
+                stats = bulk_insert(session, records, batch_size)
+                del records
+
+                for key in ('rows', 'duplicates', 'batches', 'seconds'):
+                    total[key] += stats[key]
+                total['parse_seconds'] += parse_seconds
+
+                if n == count - 1:
+                    save_entry(session, plan, state['offset'], state['location_id'], total['rows'])
+                    session.commit()
+            except CSVParseError as e:
+                session.rollback()
+                print(e)
+                results[path] = {
+                    'file': path,
+                    'action': plan['action'],
+                    'status': 'error',
+                    'message': 'Error while parsing date from csv!',
+                }
+                continue
+            except Exception as e:
+                session.rollback()
+                print(e)
+                results[path] = {
+                    'file': path,
+                    'action': plan['action'],
+                    'status': 'error',
+                    'message': 'Something has gone wrong!',
+                }
+                continue
+
+            if n == count - 1:
+                total = totals.pop(path)
+                results[path] = {
+                    'file': path,
+                    'action': plan['action'],
+                    'status': 'success',
+                    'rows': total['rows'],
+                    'duplicates': total['duplicates'],
+                    'batches': total['batches'],
+                    'seconds': round(total['seconds'], 3),
+                    'rows_per_sec': round(total['rows'] / total['seconds'], 1) if total['seconds'] else 0.0,
+                    'offset': state['offset'],
+                    'chunks': count,
+                    'parse_seconds': round(total['parse_seconds'], 3),
+                }
+
+    return [results[path] for path in csv_file_paths]
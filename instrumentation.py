@@ -0,0 +1,298 @@
+import os
+import sys
+import time
+import bisect
+import threading
+import contextlib
+from collections import Counter
+
+from flask import Response, g, request, has_request_context, jsonify
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds in seconds, the last bucket is +Inf
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+DEFAULT_PROFILE_HEADER = 'X-Profile'
+DEFAULT_PROFILE_INTERVAL = 0.005
+# under the app's instance folder, never under static where anyone could
+# download them
+DEFAULT_PROFILE_DIR = 'profiles'
+
+
+class Histogram:
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + [float('inf')], self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], self.counts)),
+        }
+
+
+class Metrics:
+
+    # Process wide latency histograms: one per (route, method, status) for
+    # requests and one per span name for the work done inside them.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.spans = {}
+
+    def observe(self, table, key, seconds):
+        with self.lock:
+            hist = table.get(key)
+            if hist is None:
+                hist = table[key] = Histogram()
+            hist.observe(seconds)
+
+    def observe_request(self, route, method, status, seconds):
+        self.observe(self.requests, (route, method, str(status)), seconds)
+
+    def observe_span(self, name, seconds):
+        self.observe(self.spans, name, seconds)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'requests': [
+                    {'route': r, 'method': m, 'status': s, **h.to_dict()}
+                    for (r, m, s), h in sorted(self.requests.items())
+                ],
+                'spans': {name: h.to_dict() for name, h in sorted(self.spans.items())},
+            }
+
+    def to_prometheus(self):
+        lines = [
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            for (route, method, status), h in sorted(self.requests.items()):
+                labels = f'route="{route}",method="{method}",status="{status}"'
+                lines += histogram_lines('http_request_duration_seconds', labels, h)
+
+            lines.append('# TYPE span_duration_seconds histogram')
+            for name, h in sorted(self.spans.items()):
+                lines += histogram_lines('span_duration_seconds', f'span="{name}"', h)
+
+        return '\n'.join(lines) + '\n'
+
+
+def histogram_lines(metric, labels, h):
+    lines = []
+    cumulative = 0
+    for bound, n in zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts):
+        cumulative += n
+        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_sum{{{labels}}} {h.total:.6f}')
+    lines.append(f'{metric}_count{{{labels}}} {h.count}')
+    return lines
+
+
+metrics = Metrics()
+
+
+def record_span(name, seconds):
+    metrics.observe_span(name, seconds)
+
+    # inside a request the span also goes into its Server-Timing header
+    if has_request_context() and 'spans' in g:
+        g.spans[name] = g.spans.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+## DB queries, every engine in the process ##
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if started:
+        record_span('db.query', time.perf_counter() - started.pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _query_failed(context):
+    started = context.connection.info.get('query_started') if context.connection else None
+    if started:
+        started.pop()
+
+
+## Sampling profiler ##
+
+class SamplingProfiler:
+
+    # Samples one thread's Python stack every interval from a helper
+    # thread and counts identical stacks, the output is the folded format
+    # flamegraph.pl and speedscope read: "frame;frame;frame count".
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def folded(self):
+        return ''.join(f'{stack} {n}\n' for stack, n in self.stacks.most_common())
+
+
+def profile_requested(app):
+    # opt in: nothing is profiled unless a token is configured, and then
+    # only requests carrying it
+    settings = app.extensions['instrumentation']
+    if not settings['profile_token']:
+        return False
+
+    return request.headers.get(settings['profile_header']) == settings['profile_token']
+
+
+def write_profile(app, profiler):
+    settings = app.extensions['instrumentation']
+    os.makedirs(settings['profile_dir'], exist_ok=True)
+
+    route = (request.endpoint or 'unknown').replace('.', '_')
+    file_path = os.path.join(settings['profile_dir'], f'{route}_{time.strftime("%Y%m%d-%H%M%S")}_{os.getpid()}.folded')
+    with open(file_path, 'w') as f:
+        f.write(profiler.folded())
+
+    return file_path
+
+
+## Flask wiring ##
+
+def metrics_view():
+
+    ## Prometheus text by default, ?format=json for the same data as JSON
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.to_dict())
+
+    return Response(metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app, metrics_path='/metrics', profile_header=None, profile_token=None,
+             profile_interval=None, profile_dir=None):
+
+    if 'instrumentation' in app.extensions:
+        return
+
+    if metrics_path:
+        app.add_url_rule(metrics_path, 'metrics', metrics_view, methods=['GET'])
+
+    app.extensions['instrumentation'] = {
+        'profile_header': profile_header or DEFAULT_PROFILE_HEADER,
+        'profile_token': profile_token,
+        'profile_interval': profile_interval or DEFAULT_PROFILE_INTERVAL,
+        'profile_dir': profile_dir or os.path.join(app.instance_path, DEFAULT_PROFILE_DIR),
+    }
+
+    @app.before_request
+    def _start_request():
+        g.spans = {}
+        g.request_started = time.perf_counter()
+        g.profiler = None
+
+        if profile_requested(app):
+            interval = app.extensions['instrumentation']['profile_interval']
+            g.profiler = SamplingProfiler(threading.get_ident(), interval).start()
+
+    @app.after_request
+    def _finish_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+
+        seconds = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code, seconds)
+
+        timings = [f'{name};dur={s * 1000:.1f}' for name, s in g.spans.items()]
+        timings.append(f'total;dur={seconds * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            response.headers['X-Profile-File'] = write_profile(app, profiler)
+
+        return response
+
+    @app.teardown_request
+    def _stop_profiler(exc):
+        # after_request does not run when the view raised
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+
+    def _render_started(sender, template, context, **extra):
+        g.setdefault('render_started', []).append(time.perf_counter())
+
+    def _render_finished(sender, template, context, **extra):
+        started = g.get('render_started')
+        if started:
+            record_span(f'template.{template.name}', time.perf_counter() - started.pop())
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
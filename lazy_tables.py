@@ -0,0 +1,35 @@
+import threading
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+_ready = set()
+_lock = threading.Lock()
+
+
+def ensure_table(session, table):
+
+    # Fallback for databases schema.migrate has not run against. Requests
+    # in this process create the table one at a time; another process
+    # winning the race shows up as "already exists" and is fine.
+    if table.name in _ready:
+        return
+
+    with _lock:
+        if table.name in _ready:
+            return
+
+        connection = session.connection()
+        try:
+            table.create(connection, checkfirst=True)
+        except (OperationalError, ProgrammingError):
+            if not inspect(connection).has_table(table.name):
+                raise
+
+        _ready.add(table.name)
+
+
+def mark_ready(tables):
+    # tables schema.migrate just created, no check needed on first use
+    with _lock:
+        _ready.update(table.name for table in tables)
@@ -0,0 +1,150 @@
+import os
+import hashlib
+import datetime
+
+from sqlalchemy import (
+    Table, Column, Integer, BigInteger, Float, String, DateTime, select
+)
+from sqlalchemy.exc import IntegrityError
+
+from db import LogLoaderdb
+from lazy_tables import ensure_table
+
+# Only the head of the file and the block just before the checkpoint are
+# hashed, so checking a grown file costs two small reads, not a full rescan.
+FINGERPRINT_BLOCK = 64 * 1024
+
+ingest_ledger = Table(
+    'ingest_ledger',
+    LogLoaderdb.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('path', String(512), nullable=False, unique=True),
+    Column('size', BigInteger, nullable=False),
+    Column('mtime', Float, nullable=False),
+    Column('content_hash', String(64), nullable=False),
+    Column('last_offset', BigInteger, nullable=False),
+    Column('location_id', String(64)),
+    Column('rows', BigInteger, nullable=False, default=0),
+    Column('updated_at', DateTime, nullable=False),
+)
+
+
+def ensure_ledger_table(session):
+    ensure_table(session, ingest_ledger)
+
+
+def file_fingerprint(path, length):
+
+    h = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        h.update(f.read(min(length, FINGERPRINT_BLOCK)))
+
+        if length > FINGERPRINT_BLOCK:
+            tail_start = max(FINGERPRINT_BLOCK, length - FINGERPRINT_BLOCK)
+            f.seek(tail_start)
+            h.update(f.read(length - tail_start))
+
+    h.update(str(length).encode())
+
+    return h.hexdigest()
+
+
+def get_entry(session, path):
+    ensure_ledger_table(session)
+
+    q = select(ingest_ledger).where(ingest_ledger.c.path == path)
+
+    return session.execute(q).first()
+
+
+def lock_entry(session, path):
+
+    # Locks the file's ledger row until the transaction ends, so imports of
+    # the same file run one after the other and the second plans from the
+    # offset the first one saved. A file seen for the first time gets an
+    # empty row to lock; it plans as a full read like a missing one.
+    ensure_ledger_table(session)
+
+    q = select(ingest_ledger).where(ingest_ledger.c.path == path).with_for_update()
+
+    entry = session.execute(q).first()
+    if entry is None:
+        try:
+            with session.begin_nested():
+                session.execute(ingest_ledger.insert().values(
+                    path=path,
+                    size=0,
+                    mtime=0.0,
+                    content_hash='',
+                    last_offset=0,
+                    rows=0,
+                    updated_at=datetime.datetime.utcnow(),
+                ))
+        except IntegrityError:
+            # another import added it first and has committed by now
+            pass
+        entry = session.execute(q).first()
+
+    return entry
+
+
+def plan_import(session, path, lock=False):
+
+    st = os.stat(path)
+    entry = lock_entry(session, path) if lock else get_entry(session, path)
+
+    plan = {
+        'path': path,
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'action': 'full',
+        'offset': 0,
+        'location_id': None,
+        'rows': 0,
+    }
+
+    if entry is None:
+        return plan
+
+    plan['rows'] = entry.rows
+
+    # unchanged and fully read; an unterminated last line held back while
+    # the file was being written is picked up by a tail import once it settles
+    if entry.size == st.st_size and entry.mtime == st.st_mtime and entry.last_offset == st.st_size:
+        plan['action'] = 'skip'
+        plan['offset'] = entry.last_offset
+        plan['location_id'] = entry.location_id
+        return plan
+
+    # file only grew: the part we already consumed must still be identical
+    if st.st_size >= entry.last_offset and \
+            file_fingerprint(path, entry.last_offset) == entry.content_hash:
+        plan['action'] = 'skip' if st.st_size == entry.last_offset else 'tail'
+        plan['offset'] = entry.last_offset
+        plan['location_id'] = entry.location_id
+        return plan
+
+    # rewritten or truncated, parse it again and let dedup drop known rows
+    plan['rows'] = 0
+
+    return plan
+
+
+def save_entry(session, plan, offset, location_id, rows):
+    ensure_ledger_table(session)
+
+    values = {
+        'size': plan['size'],
+        'mtime': plan['mtime'],
+        'content_hash': file_fingerprint(plan['path'], offset),
+        'last_offset': offset,
+        'location_id': location_id,
+        'rows': plan['rows'] + rows,
+        'updated_at': datetime.datetime.utcnow(),
+    }
+
+    result = session.execute(
+        ingest_ledger.update().where(ingest_ledger.c.path == plan['path']).values(**values)
+    )
+    if not result.rowcount:
+        session.execute(ingest_ledger.insert().values(path=plan['path'], **values))
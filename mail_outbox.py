@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+__all__ = ['EmailOutbox', 'enqueue_email', 'outbox_worker']
+
+
+
+import uuid
+import datetime
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SessionBase
+
+# Import the resbase object from the main app module
+from app import app, db
+
+from app.email import send_email
+
+from instrumentation import span
+
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_STALE_CLAIM = 10 * 60
+
+
+class EmailOutbox(db.Model):
+
+    # Mail waiting to be sent. Rows are written in the same transaction as
+    # the user change they belong to, so a rolled back sign-up never sends
+    # a mail and a committed one never loses its mail.
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+
+def enqueue_email(to, subject, html):
+
+    # Adds the mail to the current transaction, the caller commits
+    db.session.add(EmailOutbox(recipient=to, subject=subject, html=html))
+    db.session.info['outbox_pending'] = True
+
+
+@event.listens_for(SessionBase, 'after_commit')
+def wake_outbox_worker(session):
+    if session.info.pop('outbox_pending', None):
+        outbox_worker.wake()
+
+
+@event.listens_for(SessionBase, 'after_rollback')
+def forget_outbox_mail(session):
+    session.info.pop('outbox_pending', None)
+
+
+def retry_delay(attempts):
+    return datetime.timedelta(seconds=min(30 * 2 ** (attempts - 1), 60 * 60))
+
+
+class OutboxWorker:
+
+    # Background thread draining email_outbox in batches. Rows are claimed
+    # with a conditional UPDATE, so several app processes can run a worker
+    # against the same table without sending a mail twice.
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        # called at app init, so mail left pending or waiting for a retry
+        # before a restart goes out without waiting for a new one
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='mail-outbox', daemon=True)
+                self.thread.start()
+
+    def wake(self):
+        # with OUTBOX_WORKER off the standalone sender polls the table
+        if app.config.get('OUTBOX_WORKER', True):
+            self.start()
+        self.event.set()
+
+    def run(self):
+        poll = app.config.get('OUTBOX_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+
+        while True:
+            self.event.clear()
+            try:
+                with app.app_context():
+                    sent = self.drain()
+            except Exception as e:
+                print(e)
+                sent = 0
+
+            # a full batch means more may be waiting, go again right away
+            if not sent:
+                self.event.wait(poll)
+
+    def drain(self):
+        batch = self.claim()
+        if not batch:
+            return 0
+
+        now = datetime.datetime.utcnow()
+        max_attempts = app.config.get('OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+        for mail in batch:
+            mail.attempts += 1
+            try:
+                with span('smtp.send'):
+                    send_email(mail.recipient, mail.subject, mail.html)
+            except Exception as e:
+                print(e)
+                mail.last_error = str(e)
+                if mail.attempts >= max_attempts:
+                    mail.status = 'failed'
+                else:
+                    mail.status = 'pending'
+                    mail.next_attempt_at = now + retry_delay(mail.attempts)
+            else:
+                mail.status = 'sent'
+                mail.sent_at = datetime.datetime.utcnow()
+                mail.last_error = None
+            mail.claim_token = None
+
+        db.session.commit()
+
+        return len(batch)
+
+    def claim(self):
+        batch_size = app.config.get('OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        stale = app.config.get('OUTBOX_STALE_CLAIM', DEFAULT_STALE_CLAIM)
+
+        now = datetime.datetime.utcnow()
+        token = uuid.uuid4().hex
+
+        due = db.or_(
+            db.and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+            # a worker died mid batch, its claim is picked up again
+            db.and_(
+                EmailOutbox.status == 'sending',
+                EmailOutbox.claimed_at < now - datetime.timedelta(seconds=stale)
+            ),
+        )
+
+        ids = [
+            r.id for r in db.session.query(EmailOutbox.id)
+            .filter(due)
+            .order_by(EmailOutbox.id)
+            .limit(batch_size)
+        ]
+        if not ids:
+            db.session.rollback()
+            return []
+
+        EmailOutbox.query.filter(EmailOutbox.id.in_(ids), due).update(
+            {'status': 'sending', 'claim_token': token, 'claimed_at': now},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        return EmailOutbox.query.filter_by(claim_token=token).order_by(EmailOutbox.id).all()
+
+
+outbox_worker = OutboxWorker()
+
+
+if __name__ == '__main__':
+    # standalone sender, for deployments that keep mail out of web workers
+    outbox_worker.run()
@@ -0,0 +1,277 @@
+import os
+import ssl
+import time
+import uuid
+import queue
+import smtplib
+import datetime
+import threading
+import mimetypes
+from collections import OrderedDict
+from email.message import EmailMessage
+
+from sqlalchemy import event
+
+from db import SMTPMail
+from config import Config
+from instrumentation import span
+
+DEFAULT_SETTINGS_TTL = 300
+DEFAULT_IDLE_TIMEOUT = 60
+DEFAULT_MAIL_HISTORY = 200
+DEFAULT_SEND_ATTEMPTS = 3
+DEFAULT_WAIT_TIMEOUT = 60
+
+
+## SMTP settings, read once and kept until the smtpmail row changes ##
+
+_settings = {'value': None, 'loaded_at': 0.0}
+_settings_lock = threading.Lock()
+
+
+def invalidate_smtp_settings(*args):
+    with _settings_lock:
+        _settings['value'] = None
+
+
+for _name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(SMTPMail, _name, invalidate_smtp_settings)
+
+
+def smtp_settings(session):
+
+    # ORM writes to SMTPMail drop the cached row straight away; the TTL
+    # covers edits made outside this process or with plain SQL
+    ttl = getattr(Config, 'smtp_settings_ttl', DEFAULT_SETTINGS_TTL)
+
+    with _settings_lock:
+        value = _settings['value']
+        if value is not None and time.monotonic() - _settings['loaded_at'] < ttl:
+            return value
+
+    row = session.query(SMTPMail).one()
+    value = {column.name: getattr(row, column.name) for column in row.__table__.columns}
+
+    with _settings_lock:
+        _settings['value'] = value
+        _settings['loaded_at'] = time.monotonic()
+
+    return value
+
+
+def build_message(send_from, send_to, send_cc, subject, message, attachment_path=None):
+
+    msg = EmailMessage()
+    msg['From'] = send_from
+    msg['To'] = ', '.join(send_to)
+    if send_cc:
+        msg['Cc'] = ', '.join(send_cc)
+    msg['Subject'] = subject
+    msg.set_content(message)
+
+    if attachment_path:
+        ctype, _ = mimetypes.guess_type(attachment_path)
+        maintype, subtype = (ctype or 'application/octet-stream').split('/', 1)
+        with open(attachment_path, 'rb') as f:
+            msg.add_attachment(
+                f.read(),
+                maintype=maintype,
+                subtype=subtype,
+                filename=os.path.basename(attachment_path),
+            )
+
+    return msg
+
+
+class SMTPConnection:
+
+    # One logged-in SMTP connection reused across messages: the TLS
+    # handshake and AUTH happen once, a dropped connection is reopened on
+    # the next send and an idle one is closed before the server drops it.
+
+    def __init__(self):
+        self.smtp = None
+        self.key = None
+        self.last_used = 0.0
+
+    def open(self, settings):
+        use_tls = getattr(Config, 'smtp_use_tls', True)
+        port = int(settings['sport'])
+
+        if use_tls and port == 465:
+            smtp = smtplib.SMTP_SSL(settings['shost'], port, context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(settings['shost'], port)
+            if use_tls:
+                smtp.starttls(context=ssl.create_default_context())
+
+        if settings.get('suser'):
+            smtp.login(settings['suser'], settings['spass'])
+
+        return smtp
+
+    def send(self, settings, msg):
+        key = (settings['shost'], settings['sport'], settings.get('suser'), settings.get('spass'))
+        idle = getattr(Config, 'smtp_idle_timeout', DEFAULT_IDLE_TIMEOUT)
+
+        if self.smtp is not None and (key != self.key or time.monotonic() - self.last_used > idle):
+            self.close()
+
+        reconnected = False
+        if self.smtp is None:
+            self.smtp = self.open(settings)
+            self.key = key
+            reconnected = True
+
+        try:
+            self.smtp.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError):
+            # a reused connection may have gone away under us, retry once on
+            # a fresh one; a fresh one failing is a real error
+            self.close()
+            if reconnected:
+                raise
+            self.smtp = self.open(settings)
+            self.key = key
+            self.smtp.send_message(msg)
+
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.smtp = None
+        self.key = None
+
+
+class MailJob:
+
+    def __init__(self, settings, send_to, send_cc, subject, message, attachment_path):
+        self.id = uuid.uuid4().hex
+        self.settings = settings
+        self.send_to = send_to
+        self.send_cc = send_cc
+        self.subject = subject
+        self.message = message
+        self.attachment_path = attachment_path
+        self.status = 'queued'
+        self.attempts = 0
+        self.error = None
+        self.created_at = datetime.datetime.utcnow()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'send_to': self.send_to,
+            'subject': self.subject,
+            'attempts': self.attempts,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class MailQueue:
+
+    # Report mails are sent by one background thread over one SMTP
+    # connection, the request only queues the message and returns.
+
+    def __init__(self, history=None, attempts=None):
+        self.history = history or getattr(Config, 'mail_job_history', DEFAULT_MAIL_HISTORY)
+        self.attempts = attempts or getattr(Config, 'mail_send_attempts', DEFAULT_SEND_ATTEMPTS)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.connection = SMTPConnection()
+        self.worker = None
+
+    def submit(self, settings, send_to, send_cc, subject, message, attachment_path=None):
+        job = MailJob(settings, send_to, send_cc, subject, message, attachment_path)
+
+        with self.lock:
+            self.jobs[job.id] = job
+            self._trim()
+
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                self.worker.start()
+
+        self.queue.put(job)
+
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def wait(self, job, timeout=None):
+        # never block a request for good on a job that cannot finish
+        timeout = timeout or getattr(Config, 'mail_wait_timeout', None) or DEFAULT_WAIT_TIMEOUT
+        job.done.wait(timeout)
+        return job
+
+    def _trim(self):
+        while len(self.jobs) > self.history:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if not oldest.done.is_set():
+                break
+            del self.jobs[oldest_id]
+
+    def _run(self):
+        idle = getattr(Config, 'smtp_idle_timeout', DEFAULT_IDLE_TIMEOUT)
+
+        while True:
+            try:
+                job = self.queue.get(timeout=idle)
+            except queue.Empty:
+                self.connection.close()
+                continue
+
+            try:
+                self._send(job)
+            except Exception as e:
+                # a bad address or settings row fails the job, not the worker
+                print(e)
+                self.connection.close()
+                self._finish(job, e)
+
+    def _send(self, job):
+        job.status = 'sending'
+
+        msg = build_message(
+            job.settings['sfrom'], job.send_to, job.send_cc,
+            job.subject, job.message, job.attachment_path
+        )
+
+        while True:
+            job.attempts += 1
+            try:
+                with span('smtp.send'):
+                    self.connection.send(job.settings, msg)
+            except (smtplib.SMTPException, OSError) as e:
+                print(e)
+                if job.attempts < self.attempts and not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    time.sleep(min(2 ** job.attempts, 30))
+                    continue
+                self._finish(job, e)
+                return
+
+            self._finish(job)
+            return
+
+    def _finish(self, job, error=None):
+        job.status = 'error' if error else 'sent'
+        job.error = str(error) if error else None
+        job.finished_at = datetime.datetime.utcnow()
+        job.settings = None
+        job.done.set()
+
+
+mail_queue = MailQueue()
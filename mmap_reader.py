@@ -0,0 +1,177 @@
+import os
+import re
+import csv
+import mmap
+import time
+import contextlib
+
+from config import Config
+from csv_parser import LoggerCSVParser, LOCATION_PREFIX
+
+# a newline followed by a blank line (NULs and CRs only) or by a
+# "Location ID:" line: the only lines where the parser's location changes.
+# split_fields drops NULs anywhere in a line and unquotes the first field,
+# so both are allowed around each character of the prefix here too
+LOCATION_LINE = rb'\x00*"?\x00*' + rb'\x00*'.join(
+    re.escape(bytes([c])) for c in LOCATION_PREFIX.encode()
+)
+STATE_LINE_RE = re.compile(rb'\n(?=[\x00\r]*\n|' + LOCATION_LINE + rb')')
+
+DEFAULT_SETTLE_SECONDS = 60
+
+
+@contextlib.contextmanager
+def mapped(path):
+
+    with open(path, mode='rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # mmap refuses empty files, an empty bytes object reads the same
+            yield b''
+            return
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def split_fields(line):
+
+    # Works on the raw bytes of one line: NULs are only stripped when the
+    # line has any, and only the date and time fields are decoded; channel
+    # values stay bytes, float() reads them directly.
+    if b'\0' in line:
+        line = line.replace(b'\0', b'')
+
+    line = line.rstrip(b'\r\n')
+    if not line:
+        return []
+
+    if b'"' in line:
+        return next(csv.reader([line.decode('utf-8', errors='replace')]), [])
+
+    fields = line.split(b',')
+    fields[0] = fields[0].decode('utf-8', errors='replace')
+    if len(fields) > 1:
+        fields[1] = fields[1].decode('utf-8', errors='replace')
+
+    return fields
+
+
+def is_settled(csv_file_path):
+    # a file untouched for a while is complete, its last line too
+    settle = getattr(Config, 'import_settle_seconds', DEFAULT_SETTLE_SECONDS)
+    return time.time() - os.stat(csv_file_path).st_mtime >= settle
+
+
+def resume_position(mm, pos):
+
+    # the last import ended on a line without its newline; when the file
+    # grew since, that newline is the first byte here and not a blank line
+    if pos and mm[pos - 1:pos] != b'\n':
+        if mm[pos:pos + 2] == b'\r\n':
+            return pos + 2
+        if mm[pos:pos + 1] == b'\n':
+            return pos + 1
+
+    return pos
+
+
+def iter_mapped_rows(mm, start, end, state, parser, settled=False):
+
+    pos = resume_position(mm, start)
+    find = mm.find
+
+    while pos < end:
+        nl = find(b'\n', pos, end)
+
+        if nl == -1:
+            # a logger may still be writing the last line, leave it for the
+            # next run unless the file has settled
+            if not settled:
+                break
+            nl = end - 1
+
+        line = mm[pos:nl + 1]
+        pos = nl + 1
+        state['offset'] = pos
+
+        record = parser.parse_row(split_fields(line))
+        state['location_id'] = parser.location_id
+
+        if record is not None:
+            yield record
+
+
+def iter_file_rows(csv_file_path, state, end=None):
+
+    parser = LoggerCSVParser(state['location_id'])
+
+    with mapped(csv_file_path) as mm:
+        stop = len(mm) if end is None else end
+        # only the end of the file can hold an unterminated line
+        settled = stop == len(mm) and is_settled(csv_file_path)
+        yield from iter_mapped_rows(mm, state['offset'], stop, state, parser, settled)
+
+
+def line_at(mm, pos):
+    end = mm.find(b'\n', pos)
+    return mm[pos:] if end == -1 else mm[pos:end + 1]
+
+
+def plan_chunks(csv_file_path, start=0, location_id=None, chunk_bytes=None):
+
+    # Cuts the file from start into [start, end) ranges of about chunk_bytes,
+    # each ending on a line break, together with the location the parser
+    # holds at the start of each range. That location only changes on a
+    # blank line or a "Location ID:" line, so one regex pass over the mapped
+    # file finds every change and any range parses on its own, whatever the
+    # size of a single location's section.
+    with mapped(csv_file_path) as mm:
+        size = len(mm)
+        start = resume_position(mm, start)
+        if start >= size:
+            return []
+
+        cuts = []
+        pos = start
+        while chunk_bytes and pos + chunk_bytes < size:
+            nl = mm.find(b'\n', pos + chunk_bytes)
+            if nl == -1 or nl + 1 >= size:
+                break
+            pos = nl + 1
+            cuts.append(pos)
+
+        # line starts that may change the parser's location, in file order
+        changes = [m.end() for m in STATE_LINE_RE.finditer(mm, start, cuts[-1] if cuts else start)]
+        if STATE_LINE_RE.match(b'\n' + line_at(mm, start)):
+            changes.insert(0, start)
+
+        parser = LoggerCSVParser(location_id)
+        chunks = []
+        chunk_start = start
+        chunk_location = location_id
+        n = 0
+
+        for cut in cuts + [size]:
+            while n < len(changes) and changes[n] < cut:
+                parser.parse_row(split_fields(line_at(mm, changes[n])))
+                n += 1
+            chunks.append((chunk_start, cut, chunk_location))
+            chunk_start = cut
+            chunk_location = parser.location_id
+
+    return chunks
+
+
+def parse_chunk(csv_file_path, start, end, location_id=None):
+
+    # runs in a worker process: parses one range from plan_chunks, the
+    # records come back as one bounded list
+    state = {'offset': start, 'location_id': location_id}
+    started = time.perf_counter()
+
+    records = list(iter_file_rows(csv_file_path, state, end))
+
+    return records, state, time.perf_counter() - started
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+__all__ = ['PasswordHasher', 'password_hasher']
+
+
+
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from instrumentation import span
+
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+DEFAULT_TIMEOUT = 30
+
+
+def hash_method(pwhash):
+    # 'pbkdf2:sha256:600000$salt$hash' -> 'pbkdf2:sha256:600000'
+    return pwhash.split('$', 1)[0] if pwhash else ''
+
+
+# modular crypt ('$2b$12$...', '$argon2id$...', '$6$...') or the
+# 'method$salt$hash' layout werkzeug and older libraries use
+STORED_HASH_RE = re.compile(
+    r'^(?:\$[0-9a-z-]+\$\S{20,}'
+    r'|(?:pbkdf2|scrypt|sha1|sha224|sha256|sha384|sha512|md5)[0-9a-z:]*\$[^$]*\$[0-9a-zA-Z./+=]{20,})$'
+)
+
+
+def is_werkzeug_hash(value):
+    # the formats check_password_hash can verify: 'method$salt$hash'
+    return (
+        isinstance(value, str)
+        and value.count('$') == 2
+        and value.startswith(('pbkdf2:', 'scrypt:'))
+    )
+
+
+def is_hash(value):
+    # any stored hash, werkzeug's or not; those are never hashed again
+    return isinstance(value, str) and STORED_HASH_RE.match(value) is not None
+
+
+class PasswordHasher:
+
+    # Hashing and checking passwords is deliberately slow. Both run in a
+    # process pool, so a burst of logins keeps the CPUs busy without every
+    # web worker thread sitting inside a KDF holding the GIL. The method
+    # string carries the cost (pbkdf2:sha256:<iterations> or
+    # scrypt:<n>:<r>:<p>); hashes made with an older one are replaced on
+    # the next successful login.
+
+    def __init__(self, method=None, workers=None, timeout=None):
+        self._method = method
+        self._workers = workers
+        self._timeout = timeout
+        self.lock = threading.Lock()
+        self.executor = None
+        self.prefixes = {}
+
+    def config(self, name, default):
+        try:
+            return current_app.config.get(name, default)
+        except RuntimeError:
+            # outside an app context, e.g. the benchmark
+            return default
+
+    @property
+    def method(self):
+        return self._method or self.config('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+
+    @property
+    def timeout(self):
+        return self._timeout or self.config('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                workers = self._workers or self.config('PASSWORD_HASH_WORKERS', None) or os.cpu_count()
+                self.executor = ProcessPoolExecutor(max_workers=workers)
+
+            return self.executor
+
+    def hash(self, password):
+        with span('password.hash'):
+            return self.get_executor().submit(
+                generate_password_hash, password, self.method
+            ).result(self.timeout)
+
+    def verify(self, pwhash, password):
+        if not pwhash or password is None:
+            return False
+
+        with span('password.verify'):
+            return self.get_executor().submit(
+                check_password_hash, pwhash, password
+            ).result(self.timeout)
+
+    def method_prefix(self, method):
+
+        # werkzeug fills in defaults, 'scrypt' is stored as 'scrypt:32768:8:1'
+        # and 'pbkdf2:sha256' with its iteration count; a probe hash made
+        # once per method gives the prefix stored hashes actually carry
+        prefix = self.prefixes.get(method)
+        if prefix is None:
+            prefix = hash_method(
+                self.get_executor().submit(
+                    generate_password_hash, '', method
+                ).result(self.timeout)
+            )
+            self.prefixes[method] = prefix
+
+        return prefix
+
+    def needs_rehash(self, pwhash):
+        return hash_method(pwhash) != self.method_prefix(self.method)
+
+    def verify_and_update(self, user, password):
+
+        # True when the password matches. The hash is upgraded in place when
+        # the configured method changed, the caller commits. Hashes werkzeug
+        # does not know, e.g. bcrypt, are left to the model's own check and
+        # kept as they are, since the model may rely on that format.
+        if not is_werkzeug_hash(user.password):
+            return bool(user.password) and password is not None and user.check_password(password)
+
+        if not self.verify(user.password, password):
+            return False
+
+        if self.needs_rehash(user.password):
+            user.password = self.hash(password)
+
+        return True
+
+    def init_model(self, model, attribute='password'):
+
+        # Hashes plain passwords assigned to the model's column, from the
+        # constructor or anywhere else, in the pool; values that already
+        # are hashes, in any format, are stored as they are. A model that
+        # hashes in its own constructor gains nothing from this.
+        def hash_on_set(target, value, oldvalue, initiator):
+            if value is None or is_hash(value):
+                return value
+            return self.hash(value)
+
+        event.listen(getattr(model, attribute), 'set', hash_on_set, retval=True)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+password_hasher = PasswordHasher()
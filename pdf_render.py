@@ -0,0 +1,265 @@
+import math
+import datetime
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+PAGE_MARGIN = 15
+CHART_HEIGHT = 60
+CHART_TICKS = 5
+
+SERIES_COLORS = [
+    '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728',
+    '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
+]
+
+
+def native_available():
+    return canvas is not None
+
+
+def parse_series(lines):
+
+    names = [h.strip() for h in lines[0].split(',')[1:]]
+    x = []
+    ys = [[] for _ in names]
+
+    for line in lines[1:]:
+        parts = line.split(',')
+        x.append(datetime.datetime.fromisoformat(parts[0].strip()))
+        for i, value in enumerate(parts[1:len(names) + 1]):
+            ys[i].append(float(value))
+
+    return names, x, ys
+
+
+def draw_chart(pdf, lines, title, left, bottom, width, height):
+
+    # charts are drawn as vector paths straight onto the page, so there is
+    # no browser-side plotting and no raster image to encode
+    names, x, ys = parse_series(lines)
+
+    # blank readings come through as nan and leave a gap in the line
+    values = [v for y in ys for v in y if not math.isnan(v)]
+    if not values:
+        return
+
+    x0 = x[0].timestamp()
+    x_span = (x[-1].timestamp() - x0) or 1.0
+
+    y_min, y_max = min(values), max(values)
+    if y_min == y_max:
+        y_min, y_max = y_min - 1, y_max + 1
+    y_span = y_max - y_min
+
+    plot_left = left + 12 * mm
+    plot_bottom = bottom + 8 * mm
+    plot_w = width - 14 * mm
+    plot_h = height - 16 * mm
+
+    pdf.setFont('Helvetica-Bold', 8)
+    pdf.drawString(left, bottom + height - 4 * mm, title)
+
+    pdf.setStrokeColor(colors.lightgrey)
+    pdf.setLineWidth(0.3)
+    pdf.setFont('Helvetica', 6)
+    pdf.setFillColor(colors.black)
+
+    for i in range(CHART_TICKS + 1):
+        ty = plot_bottom + plot_h * i / CHART_TICKS
+        pdf.line(plot_left, ty, plot_left + plot_w, ty)
+        pdf.drawRightString(plot_left - 1 * mm, ty - 1, f'{y_min + y_span * i / CHART_TICKS:.1f}')
+
+        tx = plot_left + plot_w * i / CHART_TICKS
+        label = datetime.datetime.fromtimestamp(x0 + x_span * i / CHART_TICKS)
+        pdf.drawCentredString(tx, plot_bottom - 4 * mm, label.strftime('%d.%m %H:%M'))
+
+    pdf.setStrokeColor(colors.black)
+    pdf.rect(plot_left, plot_bottom, plot_w, plot_h)
+
+    px = [plot_left + plot_w * (t.timestamp() - x0) / x_span for t in x]
+
+    pdf.setLineWidth(0.5)
+    for i, (name, y) in enumerate(zip(names, ys)):
+        color = colors.HexColor(SERIES_COLORS[i % len(SERIES_COLORS)])
+        pdf.setStrokeColor(color)
+
+        path = pdf.beginPath()
+        pen_down = False
+        for cx, v in zip(px, y):
+            if math.isnan(v):
+                pen_down = False
+                continue
+            cy = plot_bottom + plot_h * (v - y_min) / y_span
+            if pen_down:
+                path.lineTo(cx, cy)
+            else:
+                path.moveTo(cx, cy)
+                pen_down = True
+        pdf.drawPath(path, stroke=1, fill=0)
+
+        if len(names) > 1:
+            pdf.setFillColor(color)
+            pdf.drawRightString(left + width - (len(names) - 1 - i) * 6 * mm, bottom + height - 4 * mm, name)
+
+    pdf.setFillColor(colors.black)
+    pdf.setStrokeColor(colors.black)
+
+
+def draw_footer(pdf, footer_text):
+    if footer_text:
+        pdf.setFont('Helvetica', 7)
+        pdf.drawString(PAGE_MARGIN * mm, 8 * mm, footer_text)
+
+
+def page_top():
+    return A4[1] - PAGE_MARGIN * mm
+
+
+def draw_header_row(pdf, labels, top, col_width):
+    pdf.setFont('Helvetica-Bold', 8)
+    for col, label in enumerate(labels):
+        pdf.drawString((PAGE_MARGIN + col * col_width) * mm, top, label)
+    pdf.setFont('Helvetica', 8)
+
+
+def next_row(pdf, top, footer_text, labels, col_width):
+
+    # a table running into the bottom margin goes on over the next page,
+    # with its header row repeated
+    top -= 4 * mm
+    if top < PAGE_MARGIN * mm:
+        draw_footer(pdf, footer_text)
+        pdf.showPage()
+        top = page_top()
+        draw_header_row(pdf, labels, top, col_width)
+        top -= 4 * mm
+
+    return top
+
+
+def draw_table_header(pdf, labels, top, footer_text, col_width):
+
+    # the header row stays on the page only with room for a row under it
+    if top - 4 * mm < PAGE_MARGIN * mm:
+        draw_footer(pdf, footer_text)
+        pdf.showPage()
+        top = page_top()
+
+    draw_header_row(pdf, labels, top, col_width)
+
+    return top
+
+
+def draw_stats(pdf, header_dict, top, footer_text=None):
+
+    labels = ['', 'AVG', 'MIN', 'MAX']
+    top = draw_table_header(pdf, labels, top, footer_text, 30)
+
+    # channels first, then the groups of the main site
+    for name, stats in header_dict.items():
+        top = next_row(pdf, top, footer_text, labels, 30)
+        pdf.drawString(PAGE_MARGIN * mm, top, name)
+        for col, key in enumerate(['avg', 'min', 'max'], start=1):
+            pdf.drawString((PAGE_MARGIN + col * 30) * mm, top, f'{float(stats[key]):.2f}')
+
+    return top
+
+
+def draw_sites(pdf, sites, top, footer_text=None):
+
+    # one line per channel group of every site in the topology
+    labels = ['SITE', 'GROUP', 'AVG', 'MIN', 'MAX']
+    top = draw_table_header(pdf, labels, top, footer_text, 30)
+
+    for site in sites:
+        for name, stats in site['groups'].items():
+            top = next_row(pdf, top, footer_text, labels, 30)
+            pdf.drawString(PAGE_MARGIN * mm, top, site['label'])
+            pdf.drawString((PAGE_MARGIN + 30) * mm, top, stats['label'] if stats else name)
+            for col, key in enumerate(['avg', 'min', 'max'], start=2):
+                value = f'{float(stats[key]):.2f}' if stats else '-'
+                pdf.drawString((PAGE_MARGIN + col * 30) * mm, top, value)
+
+    return top
+
+
+def format_seconds(seconds):
+    minutes = int(seconds // 60)
+    return f'{minutes // 60}h {minutes % 60:02}m'
+
+
+def draw_excursions(pdf, sites, top, footer_text=None):
+
+    # only channels that left their range get a line
+    rows = [
+        (site['label'], name, figures)
+        for site in sites
+        for name, figures in site.get('excursions', {}).items()
+        if figures['excursions'] or figures['incursions']
+    ]
+    if not rows:
+        return top
+
+    labels = ['SITE', 'CHANNEL', 'ABOVE', 'TIME', 'MAX', 'BELOW', 'TIME', 'MIN']
+    top = draw_table_header(pdf, labels, top, footer_text, 22)
+
+    for label, name, figures in rows:
+        top = next_row(pdf, top, footer_text, labels, 22)
+        values = [
+            label,
+            name,
+            str(figures['excursions']),
+            format_seconds(figures['excursion_seconds']),
+            f'{figures["max"]:.2f}' if figures['max'] is not None else '-',
+            str(figures['incursions']),
+            format_seconds(figures['incursion_seconds']),
+            f'{figures["min"]:.2f}' if figures['min'] is not None else '-',
+        ]
+        for col, value in enumerate(values):
+            pdf.drawString((PAGE_MARGIN + col * 22) * mm, top, value)
+
+    return top
+
+
+def render_report_pdf(report_data, footer_text, file_path):
+
+    width, height = A4
+    chart_w = width - 2 * PAGE_MARGIN * mm
+    chart_h = CHART_HEIGHT * mm
+
+    pdf = canvas.Canvas(file_path, pagesize=A4, pageCompression=1)
+
+    top = page_top()
+    pdf.setFont('Helvetica-Bold', 12)
+    pdf.drawString(PAGE_MARGIN * mm, top, f'MAA-FW-025 - {report_data["title"]} TEMPERATURE REPORT')
+    top -= 6 * mm
+    pdf.setFont('Helvetica', 9)
+    pdf.drawString(PAGE_MARGIN * mm, top, f'{report_data["date_from"]} - {report_data["date_to"]}')
+    top -= 8 * mm
+
+    top = draw_stats(pdf, report_data['header_dict'], top, footer_text) - 6 * mm
+    top = draw_sites(pdf, report_data['sites'], top, footer_text) - 6 * mm
+    top = draw_excursions(pdf, report_data['sites'], top, footer_text) - 6 * mm
+
+    for key, title in report_data['graphs']:
+        lines = report_data[key]
+        if len(lines) < 2:
+            continue
+
+        if top - chart_h < PAGE_MARGIN * mm:
+            draw_footer(pdf, footer_text)
+            pdf.showPage()
+            top = page_top()
+
+        top -= chart_h
+        draw_chart(pdf, lines, title, PAGE_MARGIN * mm, top, chart_w, chart_h)
+        top -= 4 * mm
+
+    draw_footer(pdf, footer_text)
+    pdf.save()
@@ -0,0 +1,94 @@
+import os
+import time
+import hashlib
+
+from sqlalchemy import and_
+from sqlalchemy.sql import func
+
+from db import LogLoaderdb
+from config import Config
+
+REPORTS_DIR = 'static/reports'
+
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def data_version(session, date_from, date_to):
+
+    # any insert or delete inside the range changes count or max id
+    q = session.query(
+        func.count(LogLoaderdb.id),
+        func.max(LogLoaderdb.id),
+    ).filter(
+        and_(
+            LogLoaderdb.logdate >= date_from,
+            LogLoaderdb.logdate <= date_to,
+        )
+    )
+    count, max_id = q.one()
+
+    return f'{count}-{max_id or 0}'
+
+
+def cache_key(date_from_str, date_to_str, footer_text, version):
+
+    raw = '\n'.join([date_from_str, date_to_str, footer_text or '', version])
+
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def cache_file_name(key):
+    return f'report_{key}.pdf'
+
+
+def lookup(key):
+
+    file_path = os.path.join(REPORTS_DIR, cache_file_name(key))
+
+    if not os.path.exists(file_path):
+        return None
+
+    # mtime doubles as the last-used stamp for LRU eviction
+    os.utime(file_path)
+
+    return file_path
+
+
+def evict(max_bytes=None, max_age=None):
+
+    max_bytes = max_bytes or getattr(Config, 'report_cache_max_bytes', DEFAULT_CACHE_MAX_BYTES)
+    max_age = max_age or getattr(Config, 'report_cache_max_age', DEFAULT_CACHE_MAX_AGE)
+
+    now = time.time()
+    files = []
+
+    for file in os.listdir(REPORTS_DIR):
+        if not (file.startswith('report_') and file.endswith('.pdf')):
+            continue
+
+        file_path = os.path.join(REPORTS_DIR, file)
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+
+        files.append((st.st_mtime, st.st_size, file_path))
+
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+
+    for mtime, size, file_path in files:
+        if total <= max_bytes and now - mtime <= max_age:
+            break
+
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+        total -= size
+        removed += 1
+
+    return removed
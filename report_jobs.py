@@ -0,0 +1,203 @@
+import os
+import uuid
+import datetime
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from db import Session, LogReport
+from config import Config
+from reporting import build_report
+from pdf_render import native_available, render_report_pdf
+from report_cache import cache_key, cache_file_name, lookup, evict, REPORTS_DIR
+from instrumentation import span
+
+DEFAULT_REPORT_WORKERS = 2
+DEFAULT_JOB_HISTORY = 500
+
+
+def use_native_renderer():
+    return getattr(Config, 'pdf_renderer', 'native') == 'native' and native_available()
+
+
+def render_pdf(url_path, file_path):
+
+    return subprocess.run(
+        ['xvfb-run', '-s', '-screen 0 1024x768x24', '/usr/bin/wkhtmltopdf', '--no-stop-slow-scripts', '--javascript-delay', '5000', url_path, file_path],
+        # ['xvfb-run', '--', '/usr/bin/wkhtmltopdf', '--no-stop-slow-scripts', '--javascript-delay', '3000', url_path, file_path],
+        # ['/usr/bin/wkhtmltopdf', '--no-stop-slow-scripts', '--javascript-delay', '200', url_path, file_path],
+        stdout=subprocess.PIPE,
+    )
+
+
+def render_native(session, job, file_path):
+
+    # builds the same data as the /report view and draws it in-process,
+    # no headless browser, X server or HTTP call back into the app
+    date_from_str, date_to_str, footer_text, version = job.key
+
+    date_from = datetime.datetime.strptime(date_from_str, "%Y-%m-%d").date()
+    date_to   = datetime.datetime.strptime(date_to_str, "%Y-%m-%d").date()
+
+    report_data = build_report(session, date_from, date_to)
+    if report_data is None:
+        raise RuntimeError('No data for this date range')
+
+    render_report_pdf(report_data, footer_text, file_path)
+
+
+class ReportJob:
+
+    def __init__(self, key, url_path, file_name, file_path):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.cached = False
+        self.url_path = url_path
+        self.file_name = file_name
+        self.file_path = file_path
+        self.status = 'queued'
+        self.error = None
+        self.created_at = datetime.datetime.utcnow()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        date_from_str, date_to_str, footer_text, version = self.key
+
+        return {
+            'id': self.id,
+            'status': self.status,
+            'cached': self.cached,
+            'dateFrom': date_from_str,
+            'dateTo': date_to_str,
+            'footerText': footer_text,
+            'file_name': self.file_name,
+            'file_path': self.file_path,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class ReportJobQueue:
+
+    def __init__(self, max_workers=None, history=None):
+        self.max_workers = max_workers or getattr(Config, 'report_workers', DEFAULT_REPORT_WORKERS)
+        self.history = history or getattr(Config, 'report_job_history', DEFAULT_JOB_HISTORY)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='report-job',
+        )
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.in_flight = {}
+
+    def submit(self, host, date_from_str, date_to_str, footer_text=None, version=''):
+        key = (date_from_str, date_to_str, footer_text or None, version)
+        report_key = cache_key(date_from_str, date_to_str, footer_text, version)
+
+        with self.lock:
+            # identical request already queued or running: share its job
+            job = self.in_flight.get(key)
+            if job:
+                return job
+
+            file_name = cache_file_name(report_key)
+            file_path = f'{REPORTS_DIR}/{file_name}'
+
+            if footer_text:
+                url_path  = f'http://{host}/report/{date_from_str}/{date_to_str}?footerText={footer_text}'
+            else:
+                url_path  = f'http://{host}/report/{date_from_str}/{date_to_str}'
+
+            job = ReportJob(key, url_path, file_name, file_path)
+            self.jobs[job.id] = job
+            self._trim()
+
+            # same range, footer and data already rendered: reuse the file
+            if lookup(report_key):
+                job.cached = True
+                job.status = 'done'
+                job.finished_at = job.created_at
+                job.done.set()
+                return job
+
+            self.in_flight[key] = job
+
+        self.executor.submit(self._run, job)
+
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def wait(self, job, timeout=None):
+        job.done.wait(timeout)
+        return job
+
+    def _trim(self):
+        while len(self.jobs) > self.history:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if not oldest.done.is_set():
+                break
+            del self.jobs[oldest_id]
+
+    def _run(self, job):
+        job.status = 'running'
+
+        session = Session()
+
+        # render next to the final name so a half-written PDF is never a cache hit
+        tmp_path = f'{job.file_path}.{job.id}.tmp'
+
+        try:
+            if use_native_renderer():
+                with span('pdf.native'):
+                    render_native(session, job, tmp_path)
+            else:
+                with span('pdf.wkhtmltopdf'):
+                    p = render_pdf(job.url_path, tmp_path)
+                if not os.path.exists(tmp_path):
+                    raise RuntimeError(f'PDF was not created (exit code {p.returncode})')
+
+            os.replace(tmp_path, job.file_path)
+
+            LogReport.create_log_report(
+                session,
+                filename=job.file_name,
+                filepath=job.file_path
+            )
+            session.commit()
+
+            job.status = 'done'
+        except Exception as e:
+            session.rollback()
+            print(e)
+            job.status = 'error'
+            job.error = str(e)
+
+            # evict() only sees finished PDFs, a failed render's partial
+            # output would stay in the reports directory for good
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(e)
+        finally:
+            session.close()
+
+            job.finished_at = datetime.datetime.utcnow()
+            with self.lock:
+                self.in_flight.pop(job.key, None)
+            job.done.set()
+
+        try:
+            evict()
+        except OSError as e:
+            print(e)
+
+
+report_queue = ReportJobQueue()
@@ -0,0 +1,558 @@
+import datetime
+
+import numpy as np
+from sqlalchemy import and_, select
+
+from db import LogLoaderdb
+from samples import CHANNELS, sample_columns, fetch_samples
+from downsample import downsample_indices, graph_points, graph_method
+from instrumentation import span
+from rollups import rollups_enabled, ensure_rollup_tables, rollup_channel_stats
+from topology import get_topology, site_channel_stats, site_day_partials, site_daily_averages
+from excursions import excursions_enabled, excursion_summary
+from day_cache import day_cache_enabled, day_stamps, day_cache
+
+DAYS_OF_WEEK = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+
+
+def row2dict(row):
+    d = {}
+    for column in row.__table__.columns:
+        d[column.name] = str(getattr(row, column.name))
+
+    return d
+
+
+LOG_LIST_CHUNK_SIZE = 1000
+
+
+def log_list_query(session, date_from, date_to):
+
+    q = session.query(LogLoaderdb)
+    if date_from != date_to:
+        q = q.filter(
+            and_(
+                LogLoaderdb.logdate >= date_from,
+                LogLoaderdb.logdate <= date_to,
+            )
+        )
+    else:
+        q = q.filter(LogLoaderdb.logdate==date_to)
+
+    q = q.order_by(
+        LogLoaderdb.logdate.asc(),
+        LogLoaderdb.logtimein.asc()
+    )
+
+    return q
+
+
+def log_list_select(date_from, date_to):
+
+    # Core version of log_list_query for streaming, plain tuples instead of
+    # ORM objects
+    table = LogLoaderdb.__table__
+
+    q = select(table)
+    if date_from != date_to:
+        q = q.where(
+            and_(
+                table.c.logdate >= date_from,
+                table.c.logdate <= date_to,
+            )
+        )
+    else:
+        q = q.where(table.c.logdate==date_to)
+
+    q = q.order_by(
+        table.c.logdate.asc(),
+        table.c.logtimein.asc()
+    )
+
+    return q
+
+
+def iter_log_list(session, date_from, date_to, chunk_size=LOG_LIST_CHUNK_SIZE):
+
+    # Yields the log list in chunks of row2dict style dicts. stream_results
+    # asks for a server side cursor where the driver has one, so only one
+    # chunk of rows is held in memory however long the range is.
+    names = [c.name for c in LogLoaderdb.__table__.columns]
+
+    result = session.execute(
+        log_list_select(date_from, date_to).execution_options(stream_results=True)
+    )
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [dict(zip(names, map(str, r))) for r in rows]
+    finally:
+        result.close()
+
+
+def fetch_report_samples(session, topology, date_from, date_to, with_freezers=True):
+
+    # One ordered scan over the range feeds every part of the report, the
+    # rows come back as columnar arrays and are split by location afterwards.
+    table = LogLoaderdb.__table__
+    main_location = topology.main.location_id
+
+    location_ids = topology.location_ids if with_freezers else [main_location]
+
+    q = select(*sample_columns())
+    if date_from != date_to:
+        q = q.where(
+            and_(
+                table.c.location_id.in_(location_ids),
+                table.c.logdate >= date_from,
+                table.c.logdate <= date_to,
+            )
+        )
+    else:
+        q = q.where(table.c.logdate==date_to)
+
+    q = q.order_by(
+        table.c.logdate.asc(),
+        table.c.logtimein.asc()
+    )
+
+    samples = fetch_samples(session, q)
+
+    # a single day report covers every location, a range only the main one
+    if date_from != date_to:
+        main = samples.take(samples.location_id == main_location)
+    else:
+        main = samples
+
+    return main, samples
+
+
+def channel_stats(channels):
+
+    # column-wise over the (rows x channels) block, NULLs are NaN and ignored
+    # the same way SQL avg/min/max ignore them
+    counts = np.count_nonzero(~np.isnan(channels), axis=0)
+    if not len(channels) or not counts.all():
+        return None
+
+    avg = np.nansum(channels, axis=0) / counts
+
+    return [
+        {'avg': a, 'min': lo, 'max': hi}
+        for a, lo, hi in zip(
+            avg.tolist(),
+            np.nanmin(channels, axis=0).tolist(),
+            np.nanmax(channels, axis=0).tolist(),
+        )
+    ]
+
+
+def group_stats(stats):
+    return {
+        'avg': sum(s['avg'] for s in stats) / len(stats),
+        'min': min(s['min'] for s in stats),
+        'max': max(s['max'] for s in stats),
+    }
+
+
+def channel_partials(channels):
+
+    # {channel number: (count, sum, min, max)} for the channels holding any
+    # value, the same shape site_channel_stats reads from the rollups
+    partials = {}
+    for i in range(channels.shape[1]):
+        values = channels[:, i]
+        values = values[~np.isnan(values)]
+        if len(values):
+            partials[i + 1] = (len(values), float(values.sum()), float(values.min()), float(values.max()))
+
+    return partials
+
+
+def site_summary(site, partials, excursions):
+
+    channels = {}
+    for i, name in enumerate(CHANNELS, start=1):
+        if i in partials:
+            count, total, low, high = partials[i]
+            channels[name] = {'avg': total / count, 'min': low, 'max': high, 'count': count}
+
+    groups = {}
+    for group in site.groups:
+        stats = [channels[name] for name in group.channels if name in channels]
+        groups[group.name] = dict(group_stats(stats), label=group.label) if stats else None
+
+    return {
+        'location_id': site.location_id,
+        'label': site.label,
+        'kind': site.kind,
+        'channels': channels,
+        'groups': groups,
+        'excursions': excursions,
+    }
+
+
+def daily_averages(samples, location_id, channel='chann1'):
+
+    selected = samples.take(samples.location_id == location_id)
+    values = selected.channel(channel)
+    valid = ~np.isnan(values)
+
+    days, inverse = np.unique(selected.logdate[valid], return_inverse=True)
+    sums = np.bincount(inverse, weights=values[valid], minlength=len(days))
+    counts = np.bincount(inverse, minlength=len(days))
+
+    return days.tolist(), (sums / counts).tolist()
+
+
+def partials_stats(by_channel):
+
+    # channel_stats from {channel number: (count, sum, min, max)}, None
+    # unless every channel has samples
+    if len(by_channel) < len(CHANNELS):
+        return None
+
+    return [
+        {'avg': total / count, 'min': low, 'max': high}
+        for count, total, low, high in (by_channel[i] for i in range(1, len(CHANNELS) + 1))
+    ]
+
+
+def merge_channel_partials(parts):
+
+    merged = {}
+    for partials in parts:
+        for channel, (count, total, low, high) in partials.items():
+            acc = merged.get(channel)
+            if acc is None:
+                merged[channel] = (count, total, low, high)
+            else:
+                merged[channel] = (acc[0] + count, acc[1] + total, min(acc[2], low), max(acc[3], high))
+
+    return merged
+
+
+def rollup_stats(session, topology, main, date_from, date_to):
+
+    # Reports always cover whole days, so the daily rollups answer the stats.
+    # Sample counts must agree with the raw rows already loaded for the
+    # graphs, otherwise the rollups are behind and the raw rows are used.
+    # A range report reads every site of the topology in the same grouped
+    # query, a single day covers all locations.
+    if date_from != date_to:
+        sites = site_channel_stats(session, topology, date_from, date_to)
+        by_channel = sites[topology.main.location_id]
+        if len(by_channel) < len(CHANNELS):
+            return None, None
+
+        stats = partials_stats(by_channel)
+        counts = [by_channel[i][0] for i in range(1, len(CHANNELS) + 1)]
+    else:
+        sites = None
+        stats, counts = rollup_channel_stats(session, date_from, date_to)
+        if stats is None:
+            return None, None
+
+    raw_counts = np.count_nonzero(~np.isnan(main.channels), axis=0).tolist()
+    if counts != raw_counts:
+        print('-- Rollups out of date for this range, using raw rows --')
+        return None, None
+
+    return stats, sites
+
+
+def graph_title_channels(group):
+    numbers = [str(i + 1) for i in group.indexes]
+    return f'{numbers[0]}-{numbers[-1]}' if len(numbers) > 1 else numbers[0]
+
+
+def group_series(main, group):
+
+    # the average and the per sensor series of one channel group as
+    # (seconds, labels, values), each cut to Config.report_graph_points rows
+    if not len(main):
+        empty = np.empty(0, dtype=np.int64)
+        return (
+            (empty, np.empty(0, dtype=object), empty),
+            (empty, np.empty(0, dtype=object), np.empty((0, len(group.indexes)))),
+        )
+
+    seconds = main.timestamps().astype(np.int64)
+    labels = np.array(main.labels(), dtype=object)
+    values = main.channels[:, group.indexes]
+
+    # blank readings are NaN: the average is over the sensors that have a
+    # value, a row where none has one is left out of the average graph
+    counts = np.count_nonzero(~np.isnan(values), axis=1)
+    valid = counts > 0
+
+    # int() truncates towards zero, so does np.trunc
+    avg = np.trunc(np.nansum(values[valid], axis=1) / counts[valid]).astype(np.int64)
+
+    return (
+        cut_series(seconds[valid], labels[valid], avg),
+        cut_series(seconds, labels, values),
+    )
+
+
+def cut_series(seconds, labels, values):
+    if not len(seconds):
+        return seconds, labels, values
+
+    index = downsample_indices((seconds - seconds[0]).astype(np.float64), values)
+
+    return seconds[index], labels[index], values[index]
+
+
+def concat_series(parts):
+    return tuple(np.concatenate([p[i] for p in parts]) for i in range(3))
+
+
+def day_partial(samples, topology, day, rollups=None):
+
+    # What a range report needs from one day: every site's per channel
+    # count/sum/min/max and the main site's graph series, already cut to
+    # the graph size so a cached day stays small. With the day's rollups
+    # only the main site's rows are loaded: its figures come from them and
+    # the other sites' from the rollups, unless the rollups are behind the
+    # main site's rows, then None is returned and the day is read raw.
+    day_samples = samples.take(samples.logdate == np.datetime64(day, 'D'))
+    main_id = topology.main.location_id
+    main = day_samples.take(day_samples.location_id == main_id)
+
+    sites = {}
+    for site in topology.sites:
+        if rollups is not None and site.location_id != main_id:
+            sites[site.location_id] = rollups.get(site.location_id, {})
+        else:
+            sites[site.location_id] = channel_partials(day_samples.take(day_samples.location_id == site.location_id).channels)
+
+    if rollups is not None:
+        counts = {channel: p[0] for channel, p in rollups.get(main_id, {}).items()}
+        if counts != {channel: p[0] for channel, p in sites[main_id].items()}:
+            return None
+
+    return {
+        'sites': sites,
+        'series': [group_series(main, group) for group in topology.main.groups],
+    }
+
+
+def fetch_days(session, location_ids, days):
+
+    table = LogLoaderdb.__table__
+    q = select(*sample_columns()).where(
+        and_(
+            table.c.location_id.in_(location_ids),
+            table.c.logdate.in_(days),
+        )
+    ).order_by(
+        table.c.logdate.asc(),
+        table.c.logtimein.asc()
+    )
+
+    with span('report.fetch'):
+        return fetch_samples(session, q)
+
+
+def report_days(session, topology, date_from, date_to):
+
+    # Per day partials for the range, from the day cache where the day's
+    # stamp still matches. Missing days take the sites' figures from the
+    # daily rollups and only the main site's rows for the graphs; days the
+    # rollups are behind on are read raw for every site.
+    days = [date_from + datetime.timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    stamps = day_stamps(session, date_from, date_to)
+    settings = (topology.name, graph_points(), graph_method())
+
+    keys = {day: settings + (day, stamps.get(day, 0)) for day in days}
+    partials = {day: day_cache.get(keys[day]) for day in days}
+    missing = [day for day in days if partials[day] is None]
+
+    if missing and rollups_enabled():
+        ensure_rollup_tables(session)
+        rollups = site_day_partials(session, topology, missing)
+        samples = fetch_days(session, [topology.main.location_id], missing)
+
+        for day in missing:
+            partials[day] = day_partial(samples, topology, day, rollups[day])
+
+        stale = [day for day in missing if partials[day] is None]
+        if stale:
+            print('-- Rollups out of date for some days, using raw rows --')
+    else:
+        stale = missing
+
+    if stale:
+        samples = fetch_days(session, topology.location_ids, stale)
+        for day in stale:
+            partials[day] = day_partial(samples, topology, day)
+
+    for day in missing:
+        day_cache.set(keys[day], partials[day])
+
+    return [(day, partials[day]) for day in days]
+
+
+def build_report(session, date_from, date_to, topology=None):
+
+    topology = topology or get_topology()
+
+    # a range is merged from per day partials; a single day report covers
+    # every location in its graphs and stats, so it is built directly
+    if date_from != date_to and day_cache_enabled():
+        with span('report.days'):
+            days = report_days(session, topology, date_from, date_to)
+
+        with span('report.stats'):
+            site_partials = {
+                site.location_id: merge_channel_partials(p['sites'][site.location_id] for _, p in days)
+                for site in topology.sites
+            }
+            stats = partials_stats(site_partials[topology.main.location_id])
+
+        if stats is None:
+            return None
+
+        with span('report.graphs'):
+            series = [
+                [
+                    cut_series(*concat_series([p['series'][n][kind] for _, p in days]))
+                    for kind in (0, 1)
+                ]
+                for n in range(len(topology.main.groups))
+            ]
+
+        with span('report.freezers'):
+            averages = {}
+            for site in topology.freezers:
+                channel = watched_channel(site)
+                averages[site.location_id] = ([], [])
+                for day, p in days:
+                    figures = p['sites'][site.location_id].get(channel)
+                    if figures:
+                        averages[site.location_id][0].append(day)
+                        averages[site.location_id][1].append(figures[1] / figures[0])
+
+        return report_dict(session, topology, date_from, date_to, stats, site_partials, series, averages)
+
+    main_site = topology.main
+
+    use_rollups = rollups_enabled()
+    if use_rollups:
+        ensure_rollup_tables(session)
+
+    with span('report.fetch'):
+        main, samples = fetch_report_samples(session, topology, date_from, date_to, with_freezers=not use_rollups)
+    columns = main.channels
+
+    with span('report.stats'):
+        stats, site_partials = rollup_stats(session, topology, main, date_from, date_to) if use_rollups else (None, None)
+
+        if stats is None:
+            if use_rollups and date_from != date_to:
+                # rollups are behind: fall back to the freezer rows as well
+                with span('report.fetch'):
+                    main, samples = fetch_report_samples(session, topology, date_from, date_to)
+                columns = main.channels
+
+            use_rollups = False
+            stats = channel_stats(columns)
+
+        if stats is not None and site_partials is None:
+            # every site's rows are already loaded, no extra query
+            site_partials = {
+                site.location_id: channel_partials(samples.take(samples.location_id == site.location_id).channels)
+                for site in topology.sites
+            }
+
+    if stats is None:
+        return None
+
+    with span('report.graphs'):
+        series = [group_series(main, group) for group in main_site.groups]
+
+    with span('report.freezers'):
+        freezers = topology.freezers
+        watched = {site.location_id: watched_channel(site) for site in freezers}
+
+        if use_rollups:
+            averages = {}
+            for channel in sorted(set(watched.values())):
+                sites = [site for site in freezers if watched[site.location_id] == channel]
+                averages.update(site_daily_averages(session, topology, sites, date_from, date_to, channel))
+        else:
+            averages = {
+                site.location_id: daily_averages(samples, site.location_id, CHANNELS[watched[site.location_id] - 1])
+                for site in freezers
+            }
+
+    return report_dict(session, topology, date_from, date_to, stats, site_partials, series, averages)
+
+
+def watched_channel(site):
+    # a freezer's graph follows the first channel of its first group
+    return site.groups[0].indexes[0] + 1 if site.groups else 1
+
+
+def report_dict(session, topology, date_from, date_to, stats, site_partials, series, averages):
+
+    main_site = topology.main
+
+    # excursion counts and durations come from the event index the
+    # importer keeps, not from a scan of the range
+    with span('report.excursions'):
+        excursions = excursion_summary(session, topology, date_from, date_to) if excursions_enabled() else {}
+
+    header_dict = {name: s for name, s in zip(CHANNELS, stats)}
+    for group in main_site.groups:
+        header_dict[group.name] = group_stats([stats[i] for i in group.indexes])
+
+    # graphs are numbered csv_g1, csv_g2, ... in page order: an average and
+    # a per sensor graph for each group of the main site, then one daily
+    # average per freezer
+    graphs = []
+    report_graphs = {}
+
+    def add_graph(title, lines):
+        key = f'csv_g{len(graphs) + 1}'
+        graphs.append((key, title))
+        report_graphs[key] = lines
+
+
+    ## data for graphs
+    for group, ((_, avg_labels, avg), (_, labels, values)) in zip(main_site.groups, series):
+        lines = ['Date, Temperature']
+        for label, value in zip(avg_labels.tolist(), avg.tolist()):
+            lines.append(f'{label}, {value}')
+        add_graph(f'{group.label} - average temperature', lines)
+
+        lines = ['Date, ' + ', '.join(str(i + 1) for i in group.indexes)]
+        for label, row in zip(labels.tolist(), values.tolist()):
+            lines.append(f'{label}, ' + ','.join(map(str, row)))
+        add_graph(f'{group.label} - sensors {graph_title_channels(group)}', lines)
+
+
+    ## FREEZER LOG ##
+    for site in topology.freezers:
+        lines = ['Date, Temperature']
+        for day, avg in zip(*averages[site.location_id]):
+            d = day.strftime("%Y-%m-%d")
+            # d = day.strftime("%Y-%m-%d") + " - " + DAYS_OF_WEEK[day.weekday()]
+            lines.append(f'{d}, {avg}')
+        add_graph(f'{site.label} - daily average', lines)
+
+    return {
+        'title': 'DAILY' if date_from == date_to else 'WEEKLY',
+        'date_from': date_from.strftime("%d.%m.%Y"),
+        'date_to': date_to.strftime("%d.%m.%Y"),
+        **report_graphs,
+        'graphs': graphs,
+        'header_dict': header_dict,
+        'sites': [
+            site_summary(site, site_partials.get(site.location_id, {}), excursions.get(site.location_id, {}))
+            for site in topology.sites
+        ],
+    }
@@ -0,0 +1,282 @@
+import datetime
+
+from sqlalchemy import (
+    Table, Column, Integer, SmallInteger, Float, String, Date, DateTime,
+    and_, select, bindparam, case
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+
+from db import LogLoaderdb
+from config import Config
+from samples import CHANNELS, sample_columns
+from lazy_tables import ensure_table
+
+ROLLUP_FETCH_SIZE = 10000
+
+log_rollup_hourly = Table(
+    'log_rollup_hourly',
+    LogLoaderdb.metadata,
+    Column('location_id', String(64), primary_key=True),
+    Column('bucket', DateTime, primary_key=True),
+    Column('channel', SmallInteger, primary_key=True),
+    Column('count', Integer, nullable=False),
+    Column('sum', Float, nullable=False),
+    Column('min', Float, nullable=False),
+    Column('max', Float, nullable=False),
+)
+
+log_rollup_daily = Table(
+    'log_rollup_daily',
+    LogLoaderdb.metadata,
+    Column('location_id', String(64), primary_key=True),
+    Column('bucket', Date, primary_key=True),
+    Column('channel', SmallInteger, primary_key=True),
+    Column('count', Integer, nullable=False),
+    Column('sum', Float, nullable=False),
+    Column('min', Float, nullable=False),
+    Column('max', Float, nullable=False),
+)
+
+ROLLUP_TABLES = [log_rollup_hourly, log_rollup_daily]
+
+
+def rollups_enabled():
+    return getattr(Config, 'report_use_rollups', True)
+
+
+def ensure_rollup_tables(session):
+    for table in ROLLUP_TABLES:
+        ensure_table(session, table)
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def hour_bucket(logdate, logtimein):
+    return datetime.datetime.combine(logdate, datetime.time(logtimein.hour))
+
+
+def collect_partials(rows):
+
+    # rows are (location_id, logdate, logtimein, chann1..chann16) tuples;
+    # returns {(location_id, bucket, channel): [count, sum, min, max]} per table
+    hourly = {}
+    daily = {}
+
+    for row in rows:
+        location_id, logdate, logtimein = row[0], row[1], row[2]
+        hour = hour_bucket(logdate, logtimein)
+
+        for channel, raw in enumerate(row[3:], start=1):
+            value = to_float(raw)
+            if value is None:
+                continue
+
+            for partials, bucket in ((hourly, hour), (daily, logdate)):
+                acc = partials.get((location_id, bucket, channel))
+                if acc is None:
+                    partials[(location_id, bucket, channel)] = [1, value, value, value]
+                else:
+                    acc[0] += 1
+                    acc[1] += value
+                    if value < acc[2]:
+                        acc[2] = value
+                    if value > acc[3]:
+                        acc[3] = value
+
+    return {log_rollup_hourly: hourly, log_rollup_daily: daily}
+
+
+def merge_partials(session, table, partials):
+
+    if not partials:
+        return
+
+    buckets = [key[1] for key in partials]
+    location_ids = {key[0] for key in partials}
+
+    q = select(table.c.location_id, table.c.bucket, table.c.channel).where(
+        and_(
+            table.c.location_id.in_(location_ids),
+            table.c.bucket >= min(buckets),
+            table.c.bucket <= max(buckets),
+        )
+    )
+    known = {tuple(r) for r in session.execute(q)}
+
+    # the arithmetic is done by the database, so two imports adding to the
+    # same bucket both count instead of the later one overwriting the other
+    updates = [
+        partial_params(key, acc, prefix='b_')
+        for key, acc in partials.items()
+        if key in known
+    ]
+    if updates:
+        session.execute(merge_statement(table), updates)
+
+    inserts = [
+        partial_params(key, acc)
+        for key, acc in partials.items()
+        if key not in known
+    ]
+    if not inserts:
+        return
+
+    try:
+        with session.begin_nested():
+            session.execute(table.insert(), inserts)
+    except IntegrityError:
+        # another import created some of these buckets first
+        for params in inserts:
+            try:
+                with session.begin_nested():
+                    session.execute(table.insert(), params)
+            except IntegrityError:
+                session.execute(
+                    merge_statement(table),
+                    {'b_' + k: v for k, v in params.items()}
+                )
+
+
+def partial_params(key, acc, prefix=''):
+    location_id, bucket, channel = key
+    return {
+        prefix + 'location_id': location_id,
+        prefix + 'bucket': bucket,
+        prefix + 'channel': channel,
+        prefix + 'count': acc[0],
+        prefix + 'sum': acc[1],
+        prefix + 'min': acc[2],
+        prefix + 'max': acc[3],
+    }
+
+
+def merge_statement(table):
+    return table.update().where(
+        and_(
+            table.c.location_id == bindparam('b_location_id'),
+            table.c.bucket == bindparam('b_bucket'),
+            table.c.channel == bindparam('b_channel'),
+        )
+    ).values(
+        count=table.c.count + bindparam('b_count'),
+        sum=table.c.sum + bindparam('b_sum'),
+        min=case((table.c.min > bindparam('b_min'), bindparam('b_min')), else_=table.c.min),
+        max=case((table.c.max < bindparam('b_max'), bindparam('b_max')), else_=table.c.max),
+    )
+
+
+def update_rollups(session, rows):
+
+    # called with every batch the importer inserts, so the rollups move
+    # forward with the raw table inside the same transaction
+    ensure_rollup_tables(session)
+
+    for table, partials in collect_partials(rows).items():
+        merge_partials(session, table, partials)
+
+
+def rebuild_rollups(session, date_from, date_to):
+
+    # backfill for data imported before rollups existed, or after manual edits
+    ensure_rollup_tables(session)
+
+    session.execute(
+        log_rollup_daily.delete().where(
+            and_(
+                log_rollup_daily.c.bucket >= date_from,
+                log_rollup_daily.c.bucket <= date_to,
+            )
+        )
+    )
+    session.execute(
+        log_rollup_hourly.delete().where(
+            and_(
+                log_rollup_hourly.c.bucket >= datetime.datetime.combine(date_from, datetime.time()),
+                log_rollup_hourly.c.bucket < datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time()),
+            )
+        )
+    )
+
+    table = LogLoaderdb.__table__
+    q = select(*sample_columns()).where(
+        and_(
+            table.c.logdate >= date_from,
+            table.c.logdate <= date_to,
+        )
+    )
+    result = session.execute(q)
+
+    partials = {log_rollup_hourly: {}, log_rollup_daily: {}}
+    rows = 0
+
+    while True:
+        chunk = result.fetchmany(ROLLUP_FETCH_SIZE)
+        if not chunk:
+            break
+        rows += len(chunk)
+
+        for t, chunk_partials in collect_partials(chunk).items():
+            merged = partials[t]
+            for key, acc in chunk_partials.items():
+                cur = merged.get(key)
+                if cur is None:
+                    merged[key] = acc
+                else:
+                    cur[0] += acc[0]
+                    cur[1] += acc[1]
+                    cur[2] = min(cur[2], acc[2])
+                    cur[3] = max(cur[3], acc[3])
+
+    for t, t_partials in partials.items():
+        merge_partials(session, t, t_partials)
+
+    return rows
+
+
+def rollup_channel_stats(session, date_from, date_to, location_ids=None):
+
+    # per channel avg/min/max over whole days, read from the daily rollup,
+    # plus the sample count per channel behind each figure
+    t = log_rollup_daily
+
+    q = select(
+        t.c.channel,
+        func.sum(t.c.count),
+        func.sum(t.c.sum),
+        func.min(t.c.min),
+        func.max(t.c.max),
+    ).where(
+        and_(
+            t.c.bucket >= date_from,
+            t.c.bucket <= date_to,
+        )
+    )
+    if location_ids is not None:
+        q = q.where(t.c.location_id.in_(location_ids))
+
+    q = q.group_by(t.c.channel)
+
+    by_channel = {r[0]: r for r in session.execute(q)}
+    if len(by_channel) < len(CHANNELS):
+        return None, None
+
+    channels = range(1, len(CHANNELS) + 1)
+
+    stats = [
+        {
+            'avg': by_channel[i][2] / by_channel[i][1],
+            'min': by_channel[i][3],
+            'max': by_channel[i][4],
+        }
+        for i in channels
+    ]
+    counts = [int(by_channel[i][1]) for i in channels]
+
+    return stats, counts
+
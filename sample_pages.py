@@ -0,0 +1,165 @@
+import json
+import base64
+import datetime
+
+from sqlalchemy import and_, or_, select
+
+from db import LogLoaderdb
+from config import Config
+from samples import CHANNELS
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_MAX_PAGE_SIZE = 5000
+MAX_DOWNSAMPLE = 1000
+
+
+class SamplePageError(ValueError):
+    pass
+
+
+def encode_cursor(row):
+    key = [row.logdate.isoformat(), row.logtimein.isoformat(), row.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        logdate, logtimein, row_id = json.loads(raw)
+        return (
+            datetime.date.fromisoformat(logdate),
+            datetime.time.fromisoformat(logtimein),
+            int(row_id),
+        )
+    except (ValueError, TypeError):
+        raise SamplePageError('Invalid cursor!')
+
+
+def parse_channels(value):
+
+    # "1,2,chann5" -> ['chann1', 'chann2', 'chann5'], empty means all
+    if not value:
+        return list(CHANNELS)
+
+    names = []
+    for part in value.split(','):
+        part = part.strip()
+        name = part if part.startswith('chann') else f'chann{part}'
+        if name not in CHANNELS:
+            raise SamplePageError(f'Unknown channel {part}!')
+        if name not in names:
+            names.append(name)
+
+    return names
+
+
+def parse_page_size(value):
+
+    max_size = getattr(Config, 'samples_max_page_size', DEFAULT_MAX_PAGE_SIZE)
+    try:
+        size = int(value) if value else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise SamplePageError('Invalid limit!')
+
+    return max(1, min(size, max_size))
+
+
+def parse_every(value):
+
+    try:
+        every = int(value) if value else 1
+    except ValueError:
+        raise SamplePageError('Invalid downsampling factor!')
+
+    return max(1, min(every, MAX_DOWNSAMPLE))
+
+
+def after_clause(table, cursor):
+
+    # (logdate, logtimein, id) > cursor spelled out, with the leading
+    # logdate >= bound kept separate so the (logdate, logtimein) index is
+    # used as a range scan on every backend
+    logdate, logtimein, row_id = cursor
+
+    return and_(
+        table.c.logdate >= logdate,
+        or_(
+            table.c.logdate > logdate,
+            and_(
+                table.c.logdate == logdate,
+                or_(
+                    table.c.logtimein > logtimein,
+                    and_(table.c.logtimein == logtimein, table.c.id > row_id),
+                ),
+            ),
+        ),
+    )
+
+
+def sample_page_query(date_from, date_to, location_ids, channels, cursor, limit):
+
+    table = LogLoaderdb.__table__
+
+    q = select(
+        table.c.id,
+        table.c.location_id,
+        table.c.logdate,
+        table.c.logtimein,
+        *[table.c[name] for name in channels]
+    )
+
+    if date_from is not None:
+        q = q.where(table.c.logdate >= date_from)
+    if date_to is not None:
+        q = q.where(table.c.logdate <= date_to)
+    if location_ids:
+        q = q.where(table.c.location_id.in_(location_ids))
+    if cursor is not None:
+        q = q.where(after_clause(table, cursor))
+
+    return q.order_by(
+        table.c.logdate.asc(),
+        table.c.logtimein.asc(),
+        table.c.id.asc(),
+    ).limit(limit)
+
+
+def fetch_sample_page(session, date_from=None, date_to=None, location_ids=None,
+                      channels=None, cursor=None, limit=DEFAULT_PAGE_SIZE, every=1):
+
+    # Keyset pagination: each page starts right after the last key of the
+    # one before, so page cost does not grow with how deep the client is.
+    # With every=n a page scans limit * n rows and returns every n-th, the
+    # cursor still points at the last row scanned so pages tile exactly.
+    # The rows scanned per page are capped at the maximum page size, a large
+    # n gets fewer samples per page instead of a bigger scan.
+    channels = channels or list(CHANNELS)
+
+    max_scan = getattr(Config, 'samples_max_page_size', DEFAULT_MAX_PAGE_SIZE)
+    limit = max(1, min(limit, max_scan // every))
+
+    result = session.execute(
+        sample_page_query(date_from, date_to, location_ids, channels, cursor, limit * every)
+    )
+
+    samples = []
+    scanned = 0
+    last = None
+    for row in result:
+        if scanned % every == 0:
+            sample = {
+                'id': row.id,
+                'location_id': row.location_id,
+                'logdate': row.logdate.isoformat(),
+                'logtimein': row.logtimein.isoformat(),
+            }
+            for name in channels:
+                sample[name] = getattr(row, name)
+            samples.append(sample)
+
+        scanned += 1
+        last = row
+
+    next_cursor = encode_cursor(last) if scanned == limit * every else None
+
+    return samples, next_cursor
@@ -0,0 +1,108 @@
+import numpy as np
+
+from db import LogLoaderdb
+
+CHANNELS = [f'chann{i}' for i in range(1, 17)]
+
+FETCH_CHUNK_SIZE = 10000
+
+
+class LogSamples:
+
+    # One array per field instead of one dict of strings per row: channel
+    # values live in a single (rows x 16) float block, NULL becomes NaN.
+    __slots__ = ('location_id', 'logdate', 'logtimein', 'channels')
+
+    def __init__(self, location_id, logdate, logtimein, channels):
+        self.location_id = location_id
+        self.logdate = logdate
+        self.logtimein = logtimein
+        self.channels = channels
+
+    def __len__(self):
+        return len(self.logdate)
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.empty(0, dtype=object),
+            np.empty(0, dtype='datetime64[D]'),
+            np.empty(0, dtype='timedelta64[s]'),
+            np.empty((0, len(CHANNELS)), dtype=np.float64),
+        )
+
+    @classmethod
+    def concat(cls, parts):
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+
+        return cls(
+            np.concatenate([p.location_id for p in parts]),
+            np.concatenate([p.logdate for p in parts]),
+            np.concatenate([p.logtimein for p in parts]),
+            np.concatenate([p.channels for p in parts]),
+        )
+
+    def take(self, index):
+        return LogSamples(
+            self.location_id[index],
+            self.logdate[index],
+            self.logtimein[index],
+            self.channels[index],
+        )
+
+    def channel(self, name):
+        return self.channels[:, CHANNELS.index(name)]
+
+    def timestamps(self):
+        return self.logdate.astype('datetime64[s]') + self.logtimein
+
+    def labels(self):
+        # same text as str(logdate) + ' ' + str(logtimein)
+        return [
+            s.replace('T', ' ')
+            for s in np.datetime_as_string(self.timestamps(), unit='s').tolist()
+        ]
+
+
+def sample_columns():
+    table = LogLoaderdb.__table__
+
+    return [
+        table.c.location_id,
+        table.c.logdate,
+        table.c.logtimein,
+        *[table.c[name] for name in CHANNELS]
+    ]
+
+
+def rows_to_samples(rows):
+
+    # None -> NaN comes for free with dtype=float
+    return LogSamples(
+        np.array([r[0] for r in rows], dtype=object),
+        np.array([r[1] for r in rows], dtype='datetime64[D]'),
+        np.array(
+            [t.hour * 3600 + t.minute * 60 + t.second for t in (r[2] for r in rows)],
+            dtype='timedelta64[s]',
+        ),
+        np.array([r[3:] for r in rows], dtype=np.float64).reshape(len(rows), len(CHANNELS)),
+    )
+
+
+def fetch_samples(session, query, chunk_size=FETCH_CHUNK_SIZE):
+
+    # query must select sample_columns(); rows are pulled off the cursor in
+    # chunks and converted straight into arrays, no ORM objects in between
+    result = session.execute(query)
+
+    parts = []
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        parts.append(rows_to_samples(rows))
+
+    return LogSamples.concat(parts)
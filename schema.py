@@ -0,0 +1,137 @@
+import sys
+sys.dont_write_bytecode = True
+
+from sqlalchemy import Index, inspect, select, func
+
+from db import Session, LogLoaderdb
+from ledger import ingest_ledger
+from rollups import ROLLUP_TABLES
+from excursions import log_excursion
+from day_cache import log_day_stamp
+from lazy_tables import mark_ready
+
+logloader = LogLoaderdb.__table__
+
+# Every hot query filters on a logdate range, most of them for a set of
+# locations, and orders by (logdate, logtimein). The first index is also the
+# sample key: a row the importer's dedup missed, e.g. from two overlapping
+# imports, fails the insert instead of being counted twice.
+LOGLOADER_INDEXES = [
+    Index(
+        'ux_logloaderdb_location_date_time',
+        logloader.c.location_id,
+        logloader.c.logdate,
+        logloader.c.logtimein,
+        unique=True,
+    ),
+    Index(
+        'ix_logloaderdb_date_time',
+        logloader.c.logdate,
+        logloader.c.logtimein,
+    ),
+]
+
+SAMPLE_KEY = [logloader.c.location_id, logloader.c.logdate, logloader.c.logtimein]
+
+# same columns as the unique index that replaces it; kept only to drop it,
+# so it is taken off the table again and create_all never makes it
+OBSOLETE_INDEXES = [Index('ix_logloaderdb_location_date_time', *SAMPLE_KEY)]
+logloader.indexes.difference_update(OBSOLETE_INDEXES)
+
+MANAGED_TABLES = [ingest_ledger] + ROLLUP_TABLES + [log_excursion, log_day_stamp]
+
+
+def existing_indexes(connection, table):
+    return {ix['name'] for ix in inspect(connection).get_indexes(table.name)}
+
+
+def create_tables(engine):
+
+    # the tables the app writes besides logloaderdb; run at startup so
+    # requests never issue DDL inside their own transaction
+    with engine.begin() as connection:
+        for table in MANAGED_TABLES:
+            table.create(connection, checkfirst=True)
+
+    mark_ready(MANAGED_TABLES)
+
+
+def duplicate_keys(connection):
+    keys = select(*SAMPLE_KEY).group_by(*SAMPLE_KEY).having(func.count() > 1).subquery()
+    return connection.execute(select(func.count()).select_from(keys)).scalar()
+
+
+def drop_duplicates(connection):
+
+    # keeps the first row stored for every key; the rollups counted the
+    # others too and need a rebuild for the days reported here
+    days = connection.execute(
+        select(logloader.c.logdate).group_by(*SAMPLE_KEY).having(func.count() > 1).distinct()
+    ).scalars().all()
+
+    keep = select(func.min(logloader.c.id).label('id')).group_by(*SAMPLE_KEY).subquery()
+    connection.execute(
+        logloader.delete().where(logloader.c.id.not_in(select(keep.c.id)))
+    )
+
+    return sorted(days)
+
+
+def migrate(engine, dedupe=False):
+
+    applied = []
+
+    create_tables(engine)
+
+    with engine.begin() as connection:
+        present = existing_indexes(connection, logloader)
+        for index in LOGLOADER_INDEXES:
+            if index.name in present:
+                continue
+
+            if index.unique:
+                duplicates = duplicate_keys(connection)
+                if duplicates and not dedupe:
+                    print(f'-- Skipping index {index.name}: {duplicates} keys are stored more than once, '
+                          f'run with --dedupe to keep the first row of each --')
+                    continue
+                if duplicates:
+                    days = drop_duplicates(connection)
+                    print(f'-- Dropped duplicates of {duplicates} keys, rebuild the rollups '
+                          f'from {days[0]} to {days[-1]} --')
+
+            print(f'-- Creating index {index.name} --')
+            index.create(connection)
+            applied.append(index.name)
+            present.add(index.name)
+
+        if all(index.name in present for index in LOGLOADER_INDEXES):
+            for index in OBSOLETE_INDEXES:
+                if index.name in present:
+                    print(f'-- Dropping index {index.name} --')
+                    index.drop(connection)
+
+    return applied
+
+
+def drop_indexes(engine):
+
+    dropped = []
+
+    with engine.begin() as connection:
+        present = existing_indexes(connection, logloader)
+        for index in LOGLOADER_INDEXES:
+            if index.name in present:
+                index.drop(connection)
+                dropped.append(index.name)
+
+    return dropped
+
+
+if __name__ == '__main__':
+    session = Session()
+    engine = session.get_bind()
+    session.close()
+
+    applied = migrate(engine, dedupe='--dedupe' in sys.argv)
+    print(f'-- Migration done, {len(applied)} indexes created --')
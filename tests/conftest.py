@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import socketserver
+
+import pytest
+
+# the modules live at the top of the repo; like bench/, tests that need the
+# deployment's db and config modules expect them on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    # just enough of SMTP for smtplib: every command is accepted, DATA is
+    # collected until the lone dot
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.clients.append(self.connection)
+
+        self.reply('220 localhost stand-in')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            command = line[:4].upper()
+            if command == b'QUIT':
+                self.reply('221 bye')
+                return
+
+            if command == b'DATA':
+                self.reply('354 go ahead')
+                data = []
+                for line in iter(self.rfile.readline, b''):
+                    if line == b'.\r\n':
+                        break
+                    data.append(line)
+                with server.lock:
+                    server.messages.append(b''.join(data))
+                self.reply('250 queued')
+                continue
+
+            self.reply('250 OK')
+
+    def reply(self, text):
+        self.wfile.write(text.encode() + b'\r\n')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.clients = []
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def drop_clients(self):
+        # what a server closing idle connections looks like to the client
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            try:
+                client.shutdown(2)
+            except OSError:
+                pass
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.drop_clients()
+    server.shutdown()
+    server.server_close()
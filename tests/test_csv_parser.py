@@ -0,0 +1,87 @@
+import datetime
+
+import pytest
+
+from csv_parser import CSVParseError, CHANNEL_COUNT, LoggerCSVParser, parse_lines
+
+
+EXPORT = [
+    'Location ID: 73',
+    'Date,Time,Ch1,Ch2,Ch3',
+    '01/02/2024,10:00:00,1.5,2.5,3.5',
+    '02-01-2024,10:01:00,1.0,,x',
+    '',
+    'Location ID: 74',
+    'Date,Time,Ch1',
+    '31/12/2023,23:59:59,7',
+]
+
+
+def test_rows_are_typed_and_tagged_with_their_location():
+    records = list(parse_lines(EXPORT))
+
+    assert len(records) == 3
+    assert records[0][:3] == ('73', datetime.date(2024, 2, 1), datetime.time(10, 0))
+    assert records[0][3:6] == (1.5, 2.5, 3.5)
+    assert records[2][:4] == ('74', datetime.date(2023, 12, 31), datetime.time(23, 59, 59), 7.0)
+
+
+def test_both_date_layouts_read_as_the_same_day():
+    records = list(parse_lines(EXPORT))
+
+    assert records[0][1] == records[1][1] == datetime.date(2024, 2, 1)
+
+
+def test_every_record_has_all_channels():
+    for record in parse_lines(EXPORT):
+        assert len(record) == 3 + CHANNEL_COUNT
+
+    record = next(parse_lines(EXPORT))
+    assert record[6:] == (0.0,) * (CHANNEL_COUNT - 3)
+
+
+def test_blank_and_garbled_readings_become_none():
+    records = list(parse_lines(EXPORT))
+
+    assert records[1][3:6] == (1.0, None, None)
+
+
+def test_rows_before_a_location_line_are_skipped():
+    assert list(parse_lines(['01/02/2024,10:00:00,1'])) == []
+    assert list(parse_lines(EXPORT[:1] + ['', '01/02/2024,10:00:00,1'])) == []
+
+
+def test_location_carries_over_from_the_caller():
+    records = list(parse_lines(['01/02/2024,10:00:00,1'], location_id='75'))
+
+    assert records[0][0] == '75'
+
+
+def test_blank_line_ends_the_section():
+    parser = LoggerCSVParser('73')
+
+    assert parser.parse_row([]) is None
+    assert parser.location_id is None
+
+    parser.parse_row(['Location ID: 76'])
+    assert parser.location_id == '76'
+
+
+@pytest.mark.parametrize('row', [
+    ['30/02/2024', '10:00:00', '1'],
+    ['01/02/2024', '10-00-00', '1'],
+    ['01/02/2024', '25:00:00', '1'],
+    ['01/02/2024'],
+])
+def test_bad_date_or_time_raises(row):
+    with pytest.raises(CSVParseError):
+        LoggerCSVParser('73').parse_row(row)
+
+
+def test_dates_and_times_are_converted_once():
+    parser = LoggerCSVParser('73')
+    parser.parse_row(['01/02/2024', '10:00:00', '1'])
+    parser.parse_row(['01/02/2024', '10:00:00', '2'])
+
+    assert list(parser.dates) == ['01/02/2024']
+    assert list(parser.times) == ['10:00:00']
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('config')
+
+from downsample import downsample_indices, lttb_indices, minmax_indices
+
+
+def series(n=10000, seed=1):
+    rng = np.random.default_rng(seed)
+    x = np.arange(n, dtype=np.float64) * 60
+    y = np.cumsum(rng.normal(size=n))
+    return x, y
+
+
+def test_short_series_are_kept_whole():
+    x, y = series(50)
+
+    assert list(minmax_indices(y, 100)) == list(range(50))
+    assert list(lttb_indices(x, y, 100)) == list(range(50))
+    assert list(downsample_indices(x, y, threshold=0)) == list(range(50))
+
+
+def test_minmax_stays_within_threshold_and_keeps_the_extremes():
+    x, y = series()
+    y[1234] = 1e6
+    y[4321] = -1e6
+
+    kept = minmax_indices(y, 500)
+
+    assert len(kept) <= 500
+    assert kept[0] == 0 and kept[-1] == len(y) - 1
+    assert 1234 in kept and 4321 in kept
+    assert list(kept) == sorted(set(kept))
+
+
+def test_minmax_keeps_the_extremes_of_every_column():
+    _, a = series(seed=1)
+    _, b = series(seed=2)
+    values = np.column_stack([a, b])
+
+    kept = minmax_indices(values, 400)
+
+    assert len(kept) <= 400
+    for column in (a, b):
+        assert int(np.argmax(column)) in kept
+        assert int(np.argmin(column)) in kept
+
+
+def test_minmax_ignores_blank_readings():
+    x, y = series()
+    y[::7] = np.nan
+
+    kept = minmax_indices(y, 500)
+
+    assert len(kept) <= 500
+    assert int(np.nanargmax(y)) in kept
+    assert int(np.nanargmin(y)) in kept
+
+
+def test_minmax_with_more_columns_than_the_budget_allows():
+    values = np.column_stack([series(seed=seed)[1] for seed in range(7)])
+
+    kept = minmax_indices(values, 10)
+
+    assert 0 < len(kept) <= 10
+    assert kept[0] == 0 and kept[-1] == len(values) - 1
+    assert list(kept) == sorted(set(kept))
+
+
+def test_lttb_keeps_exactly_threshold_points_in_order():
+    x, y = series()
+
+    kept = lttb_indices(x, y, 300)
+
+    assert len(kept) == 300
+    assert kept[0] == 0 and kept[-1] == len(y) - 1
+    assert np.all(np.diff(kept) > 0)
+
+
+def test_lttb_keeps_a_lone_spike():
+    x, y = series()
+    y[5000] = 1e6
+
+    assert 5000 in lttb_indices(x, y, 300)
+
+
+def test_downsample_picks_the_method():
+    x, y = series()
+
+    assert list(downsample_indices(x, y, 300, 'lttb')) == list(lttb_indices(x, y, 300))
+    assert list(downsample_indices(x, y, 300, 'minmax')) == list(minmax_indices(y, 300))
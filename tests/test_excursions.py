@@ -0,0 +1,154 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('db')
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from db import LogLoaderdb
+from csv_parser import RECORD_COLUMNS
+from excursions import (
+    detect_events, log_excursion, rebuild_excursions, sample_kind, update_excursions
+)
+
+START = datetime.datetime(2024, 1, 1, 10, 0)
+WATCHED = {'73': {1: (2.0, 8.0)}}
+MAX_GAP = 30 * 60
+
+
+def minutes(*values, start=START):
+    return [(start + datetime.timedelta(minutes=i), v) for i, v in enumerate(values)]
+
+
+def detect(values, open_events=None, **kwargs):
+    series = {('73', 1): minutes(*values, **kwargs)}
+    return detect_events(series, WATCHED, open_events or {}, MAX_GAP)
+
+
+def test_sample_kind():
+    assert sample_kind(9, 2, 8) == 'excursion'
+    assert sample_kind(1, 2, 8) == 'incursion'
+    assert sample_kind(8, 2, 8) is None
+    assert sample_kind(100, None, 8) == 'excursion'
+    assert sample_kind(-100, None, 8) is None
+
+
+def test_run_outside_the_range_is_one_event():
+    events = detect([5, 9, 10, 9.5, 5])
+
+    assert len(events) == 1
+    event = events[0]
+    assert event['kind'] == 'excursion'
+    assert event['start_at'] == START + datetime.timedelta(minutes=1)
+    assert event['end_at'] == START + datetime.timedelta(minutes=3)
+    assert event['samples'] == 3
+    assert event['peak'] == 10
+    assert event['is_open'] is False
+
+
+def test_incursion_peak_is_the_lowest_value():
+    events = detect([1.5, 0.5, 1])
+
+    assert [(e['kind'], e['peak'], e['is_open']) for e in events] == [('incursion', 0.5, True)]
+
+
+def test_change_of_side_starts_a_new_event():
+    events = detect([9, 1, 9])
+
+    assert [e['kind'] for e in events] == ['excursion', 'incursion', 'excursion']
+    assert [e['is_open'] for e in events] == [False, False, True]
+
+
+def test_run_at_the_end_stays_open():
+    events = detect([5, 9])
+
+    assert events[0]['is_open'] is True
+    assert events[0]['id'] is None
+
+
+def test_open_event_is_extended_by_the_next_import():
+    first = detect([5, 9, 9.5])[0]
+    first['id'] = 1
+
+    later = START + datetime.timedelta(minutes=3)
+    events = detect([10, 5], open_events={('73', 1): first}, start=later)
+
+    assert len(events) == 1
+    assert events[0]['id'] == 1
+    assert events[0]['samples'] == 3
+    assert events[0]['peak'] == 10
+    assert events[0]['is_open'] is False
+
+
+def test_gap_longer_than_max_gap_splits_the_event():
+    first = detect([9])[0]
+    later = START + datetime.timedelta(seconds=MAX_GAP + 60)
+
+    events = detect([9], open_events={('73', 1): first}, start=later)
+
+    assert [(e['is_open'], e['samples']) for e in events] == [(False, 1), (True, 1)]
+
+
+def test_older_sample_does_not_extend_the_open_event():
+    first = detect([9, 9])[0]
+    earlier = START - datetime.timedelta(minutes=5)
+
+    events = detect([9], open_events={('73', 1): first}, start=earlier)
+
+    assert len(events) == 2
+    assert events[0] is first and first['is_open'] is False
+    assert events[1]['start_at'] == earlier
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    LogLoaderdb.metadata.create_all(engine, tables=[LogLoaderdb.__table__, log_excursion])
+    session = sessionmaker(bind=engine)()
+    session.topology = SimpleNamespace(sites=[
+        SimpleNamespace(location_id='73', groups=[SimpleNamespace(low=None, high=8.0, indexes=[0])]),
+    ])
+
+    yield session
+    session.close()
+
+
+def import_rows(session, day, minute, values):
+    rows = [
+        ('73', day, datetime.time(10, minute + i), value) + (0.0,) * 15
+        for i, value in enumerate(values)
+    ]
+    session.execute(LogLoaderdb.__table__.insert(), [dict(zip(RECORD_COLUMNS, r)) for r in rows])
+    update_excursions(session, rows, session.topology)
+
+
+def stored_events(session):
+    q = select(log_excursion).order_by(log_excursion.c.start_at)
+    return [(r.start_at, r.samples, r.is_open) for r in session.execute(q)]
+
+
+def test_rebuild_of_an_older_range_keeps_the_live_event_open(session):
+    first, later = datetime.date(2024, 1, 1), datetime.date(2024, 1, 5)
+    import_rows(session, first, 0, [9, 9, 5])
+    import_rows(session, later, 0, [5, 9, 9])
+
+    rebuild_excursions(session, first, first, session.topology)
+    import_rows(session, later, 10, [9])
+
+    assert stored_events(session) == [
+        (datetime.datetime(2024, 1, 1, 10, 0), 2, False),
+        (datetime.datetime(2024, 1, 5, 10, 1), 3, True),
+    ]
+
+
+def test_rebuilt_run_followed_by_later_samples_is_closed(session):
+    first, later = datetime.date(2024, 1, 1), datetime.date(2024, 1, 5)
+    import_rows(session, first, 0, [5, 9])
+    import_rows(session, later, 0, [5, 5])
+
+    rebuild_excursions(session, first, first, session.topology)
+
+    assert stored_events(session) == [(datetime.datetime(2024, 1, 1, 10, 1), 1, False)]
@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+pytest.importorskip('db')
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ledger import ingest_ledger, plan_import, save_entry
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    ingest_ledger.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_bytes(b'Location ID: 73\nDate,Time,Ch1\n01/02/2024,10:00:00,1\n')
+    return str(path)
+
+
+def touch(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_new_file_is_read_in_full(session, export):
+    plan = plan_import(session, export)
+
+    assert plan['action'] == 'full'
+    assert plan['offset'] == 0
+
+
+def test_unchanged_file_is_skipped(session, export):
+    plan = plan_import(session, export)
+    save_entry(session, plan, plan['size'], '73', 1)
+
+    plan = plan_import(session, export)
+
+    assert plan['action'] == 'skip'
+    assert plan['rows'] == 1
+
+
+def test_grown_file_is_read_from_the_checkpoint(session, export):
+    plan = plan_import(session, export)
+    save_entry(session, plan, plan['size'], '73', 1)
+    size = plan['size']
+
+    with open(export, 'ab') as f:
+        f.write(b'01/02/2024,10:01:00,2\n')
+
+    plan = plan_import(session, export)
+
+    assert plan['action'] == 'tail'
+    assert plan['offset'] == size
+    assert plan['location_id'] == '73'
+    assert plan['rows'] == 1
+
+
+def test_held_back_last_line_is_read_later(session, export):
+    # the last line had no newline yet, the import stopped before it
+    with open(export, 'ab') as f:
+        f.write(b'01/02/2024,10:01:00,2')
+
+    plan = plan_import(session, export)
+    offset = plan['size'] - len(b'01/02/2024,10:01:00,2')
+    save_entry(session, plan, offset, '73', 1)
+
+    plan = plan_import(session, export)
+
+    assert plan['action'] == 'tail'
+    assert plan['offset'] == offset
+
+
+def test_rewritten_file_is_read_again(session, export):
+    plan = plan_import(session, export)
+    save_entry(session, plan, plan['size'], '73', 1)
+
+    with open(export, 'wb') as f:
+        f.write(b'Location ID: 74\nDate,Time,Ch1\n01/02/2024,10:00:00,1\n01/02/2024,10:01:00,2\n')
+    touch(export, plan['mtime'] + 10)
+
+    plan = plan_import(session, export)
+
+    assert plan['action'] == 'full'
+    assert plan['offset'] == 0
+    assert plan['rows'] == 0
+
+
+def test_truncated_file_is_read_again(session, export):
+    plan = plan_import(session, export)
+    save_entry(session, plan, plan['size'], '73', 1)
+
+    with open(export, 'wb') as f:
+        f.write(b'Location ID: 73\n')
+
+    assert plan_import(session, export)['action'] == 'full'
+
+
+def test_touched_but_unchanged_file_is_skipped(session, export):
+    plan = plan_import(session, export)
+    save_entry(session, plan, plan['size'], '73', 1)
+    touch(export, plan['mtime'] + 10)
+
+    assert plan_import(session, export)['action'] == 'skip'
+
+
+def test_locked_plan_of_a_new_file_reads_it_in_full(session, export):
+    plan = plan_import(session, export, lock=True)
+
+    assert plan['action'] == 'full'
+    assert plan['offset'] == 0
+
+    # the row taken for the lock is the one save_entry fills in
+    save_entry(session, plan, plan['size'], '73', 1)
+    session.commit()
+
+    assert session.query(ingest_ledger).count() == 1
+    assert plan_import(session, export, lock=True)['action'] == 'skip'
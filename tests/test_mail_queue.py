@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+pytest.importorskip('db')
+
+from config import Config
+from mail_queue import MailQueue
+
+
+@pytest.fixture
+def settings(smtp_server, monkeypatch):
+    monkeypatch.setattr(Config, 'smtp_use_tls', False, raising=False)
+    return {
+        'sfrom': 'logger@example.com',
+        'shost': '127.0.0.1',
+        'sport': smtp_server.port,
+        'suser': None,
+        'spass': None,
+    }
+
+
+@pytest.fixture
+def mail_queue():
+    queue = MailQueue()
+    yield queue
+    queue.connection.close()
+
+
+def send(mail_queue, settings, subject='report'):
+    job = mail_queue.submit(settings, ['to@example.com'], [], subject, 'body')
+    return mail_queue.wait(job, timeout=10)
+
+
+def test_connection_is_reused(smtp_server, settings, mail_queue):
+    jobs = [send(mail_queue, settings, f'report {i}') for i in range(3)]
+
+    assert [job.status for job in jobs] == ['sent'] * 3
+    assert len(smtp_server.messages) == 3
+    assert smtp_server.connections == 1
+
+
+def test_dropped_connection_is_reopened(smtp_server, settings, mail_queue):
+    assert send(mail_queue, settings).status == 'sent'
+
+    smtp_server.drop_clients()
+    job = send(mail_queue, settings)
+
+    assert job.status == 'sent'
+    assert job.attempts == 1
+    assert len(smtp_server.messages) == 2
+    assert smtp_server.connections == 2
+
+
+def test_changed_settings_open_a_new_connection(smtp_server, settings, mail_queue):
+    send(mail_queue, settings)
+    send(mail_queue, dict(settings, sfrom='other@example.com'))
+    send(mail_queue, dict(settings, suser='', spass=None))
+
+    assert smtp_server.connections == 2
+
+
+def test_bad_settings_fail_the_job_not_the_worker(smtp_server, settings, mail_queue):
+    job = send(mail_queue, dict(settings, sport=None))
+
+    assert job.status == 'error'
+    assert job.done.is_set()
+
+    assert send(mail_queue, settings).status == 'sent'
+
+
+def test_status_endpoint(smtp_server, settings, monkeypatch, tmp_path):
+    app_module = pytest.importorskip('app')
+    monkeypatch.setattr(app_module, 'smtp_settings', lambda session: dict(settings, temail=''))
+
+    report = tmp_path / 'report.pdf'
+    report.write_bytes(b'%PDF-1.4')
+
+    client = app_module.app.test_client()
+    response = client.post('/send/mail', data=json.dumps({
+        'emailAddress': 'to@example.com',
+        'path': str(report),
+        'dateFrom': '2024-01-01',
+        'dateTo': '2024-01-01',
+        'wait': True,
+    }))
+    mail = response.get_json()['mail']
+    assert mail['status'] == 'sent'
+
+    response = client.get(f'/send/mail/{mail["id"]}')
+    assert response.get_json() == {'status': 'success', 'mail': mail}
+
+    response = client.get('/send/mail/unknown')
+    assert response.status_code == 404
+    assert response.get_json()['status'] == 'error'
+
+    app_module.mail_queue.connection.close()
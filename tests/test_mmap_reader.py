@@ -0,0 +1,76 @@
+import pytest
+
+pytest.importorskip('config')
+
+from config import Config
+from mmap_reader import iter_file_rows, parse_chunk, plan_chunks
+
+
+def export_lines(nul=b'\x00'):
+    # logger exports pad lines with NULs, in front of "Location ID:" too
+    lines = []
+    for n, location in enumerate([b'73', b'74', b'75', b'76']):
+        prefix = [b'Location ID: ', nul + b'Location ID: ', b'Loc' + nul + b'ation ID: ', b'"Location ID: '][n]
+        suffix = b'"' if n == 3 else b''
+        lines.append(prefix + location + suffix)
+        lines.append(b'Date,Time,Ch1,Ch2')
+        for minute in range(36):
+            row = b'01/02/2024,10:%02d:00,%d.5,%d' % (minute, minute, n)
+            lines.append(nul * (minute % 3) + row)
+        lines.append(nul * 4)
+
+    return lines
+
+
+@pytest.fixture(params=[b'\n', b'\r\n'])
+def export(request, tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_bytes(request.param.join(export_lines()) + request.param)
+    return str(path)
+
+
+def serial(path, offset=0, location_id=None):
+    state = {'offset': offset, 'location_id': location_id}
+    return list(iter_file_rows(path, state)), state
+
+
+def chunked(path, chunk_bytes, offset=0, location_id=None):
+    records = []
+    state = None
+    for start, end, location in plan_chunks(path, offset, location_id, chunk_bytes):
+        part, state, _ = parse_chunk(path, start, end, location)
+        records += part
+    return records, state
+
+
+@pytest.fixture(autouse=True)
+def settled(monkeypatch):
+    monkeypatch.setattr(Config, 'import_settle_seconds', 0, raising=False)
+
+
+def test_serial_parse_sees_every_section(export):
+    records, _ = serial(export)
+
+    assert len(records) == 4 * 36
+    assert [r[0] for r in records[::36]] == ['73', '74', '75', '76']
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 50, 200, 1000, 10 ** 6])
+def test_chunks_match_serial_parse(export, chunk_bytes):
+    assert chunked(export, chunk_bytes) == serial(export)
+
+
+def test_chunks_match_serial_parse_from_any_line(export):
+    with open(export, 'rb') as f:
+        data = f.read()
+    starts = [i + 1 for i, b in enumerate(data[:-1]) if b == ord('\n')]
+
+    for offset in starts[::7]:
+        # the location the parser holds at that offset
+        state = {'offset': 0, 'location_id': None}
+        for _ in iter_file_rows(export, state, offset):
+            pass
+
+        for chunk_bytes in (1, 120):
+            assert chunked(export, chunk_bytes, offset, state['location_id']) == \
+                serial(export, offset, state['location_id'])
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from password_hasher import PasswordHasher, is_hash
+
+BCRYPT = '$2b$12$KIXQJ9pVh2mJ7yq3s9c5QeZ5yW0m2b1nLkz5QF7tqL0o1hW6Yw5b2'
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1)
+    yield hasher
+    hasher.shutdown()
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'pbkdf2:sha256', 'pbkdf2:sha256:1000'])
+def test_hash_made_with_the_configured_method_is_kept(method):
+    hasher = PasswordHasher(method=method, workers=1)
+    try:
+        assert not hasher.needs_rehash(generate_password_hash('pw', method))
+        assert hasher.needs_rehash(generate_password_hash('pw', 'pbkdf2:sha256:2000'))
+    finally:
+        hasher.shutdown()
+
+
+def test_login_upgrades_an_older_werkzeug_hash(hasher):
+    user = SimpleNamespace(password=generate_password_hash('pw', 'pbkdf2:sha256:2000'))
+
+    assert not hasher.verify_and_update(user, 'wrong')
+    assert hasher.verify_and_update(user, 'pw')
+    assert user.password.startswith('pbkdf2:sha256:1000$')
+
+
+def test_other_hash_formats_are_checked_by_the_model(hasher):
+    user = SimpleNamespace(password=BCRYPT, check_password=lambda password: password == 'pw')
+
+    assert hasher.verify_and_update(user, 'pw')
+    assert not hasher.verify_and_update(user, 'wrong')
+    assert user.password == BCRYPT
+
+
+@pytest.mark.parametrize('value, hashed', [
+    (BCRYPT, True),
+    ('$argon2id$v=19$m=65536,t=3,p=4$c29tZXNhbHQ$RdescudvJCsgt3ub', True),
+    ('sha256$salt$' + '0' * 64, True),
+    (generate_password_hash('pw', 'pbkdf2:sha256:1000'), True),
+    ('secret', False),
+    ('pa$$word', False),
+    ('a$b$c', False),
+])
+def test_is_hash(value, hashed):
+    assert is_hash(value) is hashed
@@ -0,0 +1,110 @@
+import os
+import sys
+import datetime
+
+import pytest
+
+pytest.importorskip('db')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker
+
+from db import LogLoaderdb
+from config import Config
+from synthetic import iter_samples
+from rollups import log_rollup_daily, rebuild_rollups
+from day_cache import day_cache
+import reporting
+
+START = datetime.date(2024, 1, 1)
+END = datetime.date(2024, 1, 4)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    engine = create_engine('sqlite://')
+    LogLoaderdb.metadata.create_all(engine)
+
+    records = list(iter_samples(['73', '74', '75', '76'], START, days=4, interval_minutes=30))
+    with engine.begin() as connection:
+        connection.execute(LogLoaderdb.__table__.insert(), records)
+
+    session = sessionmaker(bind=engine)()
+    rebuild_rollups(session, START, END)
+    session.commit()
+
+    # whole series, so merged and direct graphs can be compared row for row
+    monkeypatch.setattr(Config, 'report_graph_points', 0, raising=False)
+    monkeypatch.setattr(Config, 'report_use_rollups', True, raising=False)
+    day_cache.clear()
+
+    yield session
+
+    session.close()
+    day_cache.clear()
+
+
+def build(monkeypatch, session, by_days, use_rollups=True):
+    monkeypatch.setattr(Config, 'report_day_cache', by_days, raising=False)
+    monkeypatch.setattr(Config, 'report_use_rollups', use_rollups, raising=False)
+    return reporting.build_report(session, START, END)
+
+
+def assert_same_report(merged, direct):
+    assert merged['graphs'] == direct['graphs']
+
+    for name, stats in direct['header_dict'].items():
+        for key in ('avg', 'min', 'max'):
+            assert merged['header_dict'][name][key] == pytest.approx(stats[key])
+
+    for merged_site, direct_site in zip(merged['sites'], direct['sites']):
+        for name, stats in direct_site['channels'].items():
+            for key in ('avg', 'min', 'max', 'count'):
+                assert merged_site['channels'][name][key] == pytest.approx(stats[key])
+
+    for key, _ in direct['graphs']:
+        merged_lines, direct_lines = merged[key], direct[key]
+        assert len(merged_lines) == len(direct_lines)
+        for a, b in zip(merged_lines[1:], direct_lines[1:]):
+            a_label, a_values = a.split(', ', 1)
+            b_label, b_values = b.split(', ', 1)
+            assert a_label == b_label
+            assert [float(v) for v in a_values.split(',')] == pytest.approx([float(v) for v in b_values.split(',')])
+
+
+def test_merged_days_match_a_direct_build(monkeypatch, session):
+    direct = build(monkeypatch, session, by_days=False)
+    merged = build(monkeypatch, session, by_days=True)
+
+    assert_same_report(merged, direct)
+
+    # the second build is answered from the day cache
+    hits = day_cache.stats()['hits']
+    assert_same_report(build(monkeypatch, session, by_days=True), direct)
+    assert day_cache.stats()['hits'] - hits == 4
+
+
+def test_days_are_built_from_rollups_and_main_site_rows(monkeypatch, session):
+    fetched = []
+    fetch_days = reporting.fetch_days
+
+    def recording_fetch(session, location_ids, days):
+        fetched.append(list(location_ids))
+        return fetch_days(session, location_ids, days)
+
+    monkeypatch.setattr(reporting, 'fetch_days', recording_fetch)
+
+    build(monkeypatch, session, by_days=True)
+
+    assert fetched == [['73']]
+
+
+def test_days_the_rollups_are_behind_on_are_read_raw(monkeypatch, session):
+    direct = build(monkeypatch, session, by_days=False, use_rollups=False)
+
+    # the second day's rollups miss the main site's rows entirely
+    session.execute(log_rollup_daily.delete().where(log_rollup_daily.c.bucket == START + datetime.timedelta(days=1)))
+
+    assert_same_report(build(monkeypatch, session, by_days=True), direct)
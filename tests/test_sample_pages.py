@@ -0,0 +1,80 @@
+import datetime
+import itertools
+
+import pytest
+
+pytest.importorskip('db')
+
+from sqlalchemy import Table, Column, Integer, Date, Time, MetaData, create_engine, select
+
+from sample_pages import (
+    SamplePageError, after_clause, decode_cursor, encode_cursor, parse_channels, parse_every
+)
+
+
+@pytest.fixture
+def samples():
+    # a few rows sharing dates and times, so every tie-break level is used
+    table = Table(
+        'samples', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('logdate', Date),
+        Column('logtimein', Time),
+    )
+    engine = create_engine('sqlite://')
+    table.create(engine)
+
+    days = [datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)]
+    times = [datetime.time(10, 0), datetime.time(10, 1)]
+    rows = [
+        {'id': i + 1, 'logdate': day, 'logtimein': time}
+        for i, (day, time, _) in enumerate(itertools.product(days, times, range(2)))
+    ]
+    with engine.begin() as connection:
+        connection.execute(table.insert(), rows)
+
+    return engine, table, [(r['logdate'], r['logtimein'], r['id']) for r in rows]
+
+
+def test_after_clause_matches_tuple_order(samples):
+    engine, table, keys = samples
+
+    with engine.connect() as connection:
+        for cursor in keys:
+            found = connection.execute(
+                select(table.c.id).where(after_clause(table, cursor))
+            ).scalars().all()
+
+            assert sorted(found) == [key[2] for key in keys if key > cursor]
+
+
+def test_cursor_round_trip():
+    class Row:
+        logdate = datetime.date(2024, 1, 2)
+        logtimein = datetime.time(23, 59, 59)
+        id = 123456
+
+    assert decode_cursor(encode_cursor(Row)) == (Row.logdate, Row.logtimein, Row.id)
+
+
+@pytest.mark.parametrize('token', ['', 'not-a-cursor', 'WzEsMl0'])
+def test_bad_cursor_raises(token):
+    with pytest.raises(SamplePageError):
+        decode_cursor(token)
+
+
+def test_parse_channels():
+    assert parse_channels('1, chann3,1') == ['chann1', 'chann3']
+    assert len(parse_channels('')) == 16
+
+    with pytest.raises(SamplePageError):
+        parse_channels('17')
+
+
+def test_parse_every_is_clamped():
+    assert parse_every(None) == 1
+    assert parse_every('0') == 1
+    assert parse_every('100000') == 1000
+
+    with pytest.raises(SamplePageError):
+        parse_every('x')
@@ -0,0 +1,264 @@
+import threading
+
+from sqlalchemy import and_, select, bindparam
+from sqlalchemy.sql import func
+
+from config import Config
+from samples import CHANNELS
+from rollups import log_rollup_daily
+
+
+class ChannelGroup:
+
+    # channels of one site held to the same range, e.g. the 15-25 °C room
+    # sensors; low/high are the limits excursions are measured against
+    __slots__ = ('name', 'label', 'channels', 'low', 'high')
+
+    def __init__(self, name, label, channels, low=None, high=None):
+        self.name = name
+        self.label = label
+        self.channels = [c if isinstance(c, str) else f'chann{c}' for c in channels]
+        self.low = low
+        self.high = high
+
+    @property
+    def indexes(self):
+        # 0 based positions in the 16 channel block
+        return [CHANNELS.index(c) for c in self.channels]
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'label': self.label,
+            'channels': self.channels,
+            'low': self.low,
+            'high': self.high,
+        }
+
+
+class Site:
+
+    # one logger location; kind 'main' sites get the detailed graphs,
+    # 'freezer' sites the daily average graph
+    __slots__ = ('location_id', 'label', 'kind', 'groups')
+
+    def __init__(self, location_id, label, kind, groups):
+        self.location_id = str(location_id)
+        self.label = label
+        self.kind = kind
+        self.groups = groups
+
+
+class Topology:
+
+    def __init__(self, name, sites):
+        self.name = name
+        self.sites = sites
+
+    @property
+    def location_ids(self):
+        return [s.location_id for s in self.sites]
+
+    @property
+    def main(self):
+        return next(s for s in self.sites if s.kind == 'main')
+
+    @property
+    def freezers(self):
+        return [s for s in self.sites if s.kind == 'freezer']
+
+    def site(self, location_id):
+        return next((s for s in self.sites if s.location_id == location_id), None)
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(spec['name'], [
+            Site(
+                s['location_id'],
+                s.get('label', s['location_id']),
+                s.get('kind', 'main'),
+                [
+                    ChannelGroup(g['name'], g.get('label', g['name']), g['channels'], g.get('low'), g.get('high'))
+                    for g in s.get('groups', [])
+                ],
+            )
+            for s in spec['sites']
+        ])
+
+
+# the layout the reports were written for: one main room with a 15-25 °C
+# and a 2-8 °C sensor group, three freezers watched on their first channel
+DEFAULT_TOPOLOGY = Topology('default', [
+    Site('73', 'Main', 'main', [
+        ChannelGroup('l15to25', '15-25 °C', range(1, 8), 15, 25),
+        ChannelGroup('l2to8', '2-8 °C', range(8, 15), 2, 8),
+    ]),
+] + [
+    Site(location_id, f'Freezer {location_id}', 'freezer', [
+        ChannelGroup('freezer', 'Freezer', [1], -20, -10),
+    ])
+    for location_id in ('74', '75', '76')
+])
+
+
+## Registry ##
+
+_topologies = {}
+_queries = {}
+_lock = threading.Lock()
+
+
+def register_topology(topology):
+    with _lock:
+        _topologies[topology.name] = topology
+        # statements are built per topology, a replaced one needs new ones
+        _queries.pop(topology.name, None)
+
+
+def get_topology(name=None):
+
+    # Config.report_topology names a registered topology or is a dict in
+    # the Topology.from_dict layout, the default layout otherwise
+    name = name or getattr(Config, 'report_topology', None) or DEFAULT_TOPOLOGY.name
+
+    if isinstance(name, dict):
+        topology = Topology.from_dict(name)
+        with _lock:
+            known = _topologies.get(topology.name)
+        if known is None:
+            register_topology(topology)
+            return topology
+        return known
+
+    with _lock:
+        return _topologies[name]
+
+
+register_topology(DEFAULT_TOPOLOGY)
+
+
+## Grouped queries, built once per topology ##
+
+def build_queries(topology):
+
+    t = log_rollup_daily
+    location_ids = bindparam('location_ids', expanding=True)
+
+    # per site, per channel count/sum/min/max over whole days
+    rollup_stats = select(
+        t.c.location_id,
+        t.c.channel,
+        func.sum(t.c.count),
+        func.sum(t.c.sum),
+        func.min(t.c.min),
+        func.max(t.c.max),
+    ).where(
+        and_(
+            t.c.location_id.in_(location_ids),
+            t.c.bucket >= bindparam('date_from'),
+            t.c.bucket <= bindparam('date_to'),
+        )
+    ).group_by(t.c.location_id, t.c.channel)
+
+    # daily averages of one channel for several sites at once
+    rollup_daily = select(
+        t.c.location_id,
+        t.c.bucket,
+        t.c.sum,
+        t.c.count,
+    ).where(
+        and_(
+            t.c.location_id.in_(location_ids),
+            t.c.channel == bindparam('channel'),
+            t.c.bucket >= bindparam('date_from'),
+            t.c.bucket <= bindparam('date_to'),
+        )
+    ).order_by(t.c.location_id.asc(), t.c.bucket.asc())
+
+    # per site, per channel count/sum/min/max of each of a set of days
+    rollup_days = select(
+        t.c.bucket,
+        t.c.location_id,
+        t.c.channel,
+        t.c.count,
+        t.c.sum,
+        t.c.min,
+        t.c.max,
+    ).where(
+        and_(
+            t.c.location_id.in_(location_ids),
+            t.c.bucket.in_(bindparam('days', expanding=True)),
+        )
+    )
+
+    return {
+        'rollup_stats': rollup_stats,
+        'rollup_daily': rollup_daily,
+        'rollup_days': rollup_days,
+    }
+
+
+def topology_queries(topology):
+
+    # Statements only differ in their bound values from one request to the
+    # next, so the compiled form SQLAlchemy caches per statement is reused
+    # for every report on this topology.
+    with _lock:
+        queries = _queries.get(topology.name)
+        if queries is None:
+            queries = _queries[topology.name] = build_queries(topology)
+
+    return queries
+
+
+def site_channel_stats(session, topology, date_from, date_to):
+
+    # {location_id: {channel: (count, sum, min, max)}} for every site of the
+    # topology from the daily rollups, one grouped query whatever the number
+    # of sites
+    rows = session.execute(topology_queries(topology)['rollup_stats'], {
+        'location_ids': topology.location_ids,
+        'date_from': date_from,
+        'date_to': date_to,
+    })
+
+    sites = {location_id: {} for location_id in topology.location_ids}
+    for location_id, channel, count, total, low, high in rows:
+        sites[location_id][channel] = (int(count), total, low, high)
+
+    return sites
+
+
+def site_day_partials(session, topology, days):
+
+    # {day: {location_id: {channel: (count, sum, min, max)}}} for every site
+    # of the topology from the daily rollups, one query for all the days
+    partials = {day: {location_id: {} for location_id in topology.location_ids} for day in days}
+
+    rows = session.execute(topology_queries(topology)['rollup_days'], {
+        'location_ids': topology.location_ids,
+        'days': list(days),
+    })
+    for day, location_id, channel, count, total, low, high in rows:
+        partials[day][location_id][channel] = (int(count), total, low, high)
+
+    return partials
+
+
+def site_daily_averages(session, topology, sites, date_from, date_to, channel=1):
+
+    # {location_id: (days, averages)} from the daily rollups in one query
+    result = {site.location_id: ([], []) for site in sites}
+
+    rows = session.execute(topology_queries(topology)['rollup_daily'], {
+        'location_ids': list(result),
+        'channel': channel,
+        'date_from': date_from,
+        'date_to': date_to,
+    })
+    for location_id, bucket, total, count in rows:
+        days, averages = result[location_id]
+        days.append(bucket)
+        averages.append(total / count)
+
+    return result
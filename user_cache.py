@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+__all__ = ['user_cache']
+
+
+
+import time
+import pickle
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.orm import configure_mappers, make_transient_to_detached
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Import the resbase object from the main app module
+from app import app, db
+
+# Import module models (i.e. UserAccount)
+from app.model.user import UserAccount
+
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 300
+
+
+class LocalCache:
+
+    # bounded LRU with a per entry TTL, one per process
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class RedisCache:
+
+    # shared between processes, so an invalidation in one worker is seen
+    # by all of them
+    def __init__(self, url, ttl, prefix='user_cache:'):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, pickle.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class UserCache:
+
+    # Column values of UserAccount rows keyed by id. A hit is attached to
+    # the session with merge(load=False), so current_user is a normal
+    # persistent object but costs no query. Views that change a user call
+    # invalidate() after their commit.
+
+    def __init__(self):
+        self.backend = None
+
+    def get_backend(self):
+        if self.backend is None:
+            size = app.config.get('USER_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+            ttl = app.config.get('USER_CACHE_TTL', DEFAULT_CACHE_TTL)
+            url = app.config.get('USER_CACHE_URL')
+
+            if url and redis is not None:
+                self.backend = RedisCache(url, ttl)
+            else:
+                self.backend = LocalCache(size, ttl)
+
+        return self.backend
+
+    def snapshot(self, user):
+        return {
+            column.key: getattr(user, column.key)
+            for column in UserAccount.__mapper__.column_attrs
+        }
+
+    def attach(self, state):
+        # a hit can come before anything has queried UserAccount in this
+        # process, attribute instrumentation needs configured mappers
+        configure_mappers()
+
+        user = UserAccount.__mapper__.class_manager.new_instance()
+        for key, value in state.items():
+            setattr(user, key, value)
+        make_transient_to_detached(user)
+
+        return db.session.merge(user, load=False)
+
+    def load(self, user_id):
+        key = str(user_id)
+
+        try:
+            state = self.get_backend().get(key)
+        except Exception as e:
+            # the shared cache being down must not lock everybody out
+            print(e)
+            state = None
+
+        if state is not None:
+            return self.attach(state)
+
+        user = UserAccount.query.get(user_id)
+        if user is not None:
+            try:
+                self.get_backend().set(key, self.snapshot(user))
+            except Exception as e:
+                print(e)
+
+        return user
+
+    def invalidate(self, user_id):
+        try:
+            self.get_backend().delete(str(user_id))
+        except Exception as e:
+            print(e)
+
+
+user_cache = UserCache()